@@ -0,0 +1,197 @@
+"""
+Parses comma (or whitespace) separated numbers in bulk.
+
+ex05, ex07 and ex29 use `int(n)` on the tokens that pass `n.isnumeric()`, so negative
+numbers and decimals are silently dropped, and ex05 reads one number per input().
+parse_numbers() accepts signed integers and decimals (anything int()/float() accept,
+except nan/inf) and hands the whole text to numpy, which parses it in one go.
+The result is a typed numpy array (int64, or float64 if any token is a decimal),
+along with the tokens that were rejected. Integers that do not fit in int64 raise
+ValueError (unless there are decimals too, and the array is float64 anyway).
+
+    python number_parser.py --values "12, -5, 3.5, abc"
+    python number_parser.py numbers.txt
+    cat numbers.txt | python number_parser.py
+    python number_parser.py --benchmark
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np     # pip install numpy
+
+ParsedNumbers = namedtuple('ParsedNumbers', ['values', 'rejected'])
+
+
+def _tokens(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    # bytes.split() with no separator splits on any whitespace and skips empty tokens
+    return data.replace(b',', b' ').split()
+
+
+def _parse_one_by_one(tokens):
+    values = []
+    rejected = []
+    is_float = False
+    for i, t in enumerate(tokens):
+        try:
+            values.append(int(t))
+            continue
+        except ValueError:
+            pass
+        try:
+            v = float(t)
+            if v - v != 0:      # nan or inf
+                raise ValueError
+            values.append(v)
+            is_float = True
+        except ValueError:
+            rejected.append((i, t.decode('utf-8', errors='replace')))
+
+    if is_float:
+        return ParsedNumbers(np.array(values, dtype=np.float64), rejected)
+    for v in values:
+        # as float64 they would lose their last digits
+        if not _INT64_LIMITS[0] <= v <= _INT64_LIMITS[1]:
+            raise ValueError(f'{v} does not fit in int64')
+    return ParsedNumbers(np.array(values, dtype=np.int64), rejected)
+
+
+# np.fromstring() quietly takes a lone '-' or '+' for a number (or a sign of the next
+# one): '5, -, 7' gives [5, -7]. The text goes to it only if it is made of nothing but
+# well-formed numbers; anything else goes through the tokens one by one.
+_FLOAT = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+_FLOATS_TEXT = re.compile(rf'\s*{_FLOAT}(?:\s+{_FLOAT})*\s*', re.ASCII)
+
+# the class of every byte: 0 anything else, 1 whitespace, 2 a sign, 3 a digit
+_OTHER, _SPACE, _SIGN, _DIGIT = range(4)
+_CLASSES = np.zeros(256, dtype=np.uint8)
+_CLASSES[list(b' \t\n\r\v\f')] = _SPACE
+_CLASSES[list(b'+-')] = _SIGN
+_CLASSES[list(b'0123456789')] = _DIGIT
+
+
+def _only_ints(text):
+    """True if text is whitespace separated integers, with at most a sign right before the digits"""
+    try:
+        classes = _CLASSES[np.frombuffer(text.encode('ascii'), dtype=np.uint8)]
+    except UnicodeEncodeError:
+        return False
+    # a regular expression does the same, 5 times slower than np.fromstring() itself
+    if (classes == _OTHER).any():
+        return False
+    signs = classes == _SIGN
+    digit_after = np.append(classes[1:] == _DIGIT, False)
+    space_before = np.insert(classes[:-1] == _SPACE, 0, True)
+    return not (signs & ~(digit_after & space_before)).any()
+
+
+_INT64_LIMITS = (np.iinfo(np.int64).min, np.iinfo(np.int64).max)
+
+
+def parse_numbers(data):
+    """parses a str/bytes of numbers separated by commas and/or whitespace"""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8', errors='replace')
+    # np.fromstring() parses the whole text in C
+    text = data.replace(',', ' ')
+    if not text or text.isspace():
+        # np.fromstring() would make a 0 out of nothing
+        return ParsedNumbers(np.empty(0, dtype=np.int64), [])
+    if _only_ints(text):
+        values = np.fromstring(text, dtype=np.int64, sep=' ')
+        # numbers too big for int64 are silently clamped to the limits; the one by one pass
+        # below rejects them (parsed as float64 they would lose digits)
+        if not np.isin(values, _INT64_LIMITS).any():
+            return ParsedNumbers(values, [])
+    elif _FLOATS_TEXT.fullmatch(text):
+        values = np.fromstring(text, dtype=np.float64, sep=' ')
+        # beyond int64 it may be an integer token that does not fit
+        if np.isfinite(values).all() and not (np.abs(values) >= 2.0**63).any():
+            return ParsedNumbers(values, [])
+
+    # some tokens are bad (or too big); go through them one by one to find out which
+    return _parse_one_by_one(_tokens(data))
+
+
+def read_numbers(source='-'):
+    """source may be a filename, a binary/text file object, or '-' for stdin"""
+    if source == '-':
+        return parse_numbers(sys.stdin.buffer.read())
+    if isinstance(source, str):
+        with open(source, 'rb') as file:
+            return parse_numbers(file.read())
+    return parse_numbers(source.read())
+
+
+def aggregates(values):
+    """count, sum, sum of squares, min and max of the parsed numbers"""
+    if len(values) == 0:
+        return dict(count=0, total=0, sum_of_squares=0, smallest=None, largest=None)
+
+    if values.dtype == np.int64:
+        # int64 arithmetic wraps around silently; use python ints if it could overflow
+        biggest = int(np.abs(values).max())
+        if biggest * biggest * len(values) < 2**63:
+            total, sum_of_squares = int(values.sum()), int(np.dot(values, values))
+        else:
+            nums = values.tolist()
+            total, sum_of_squares = sum(nums), sum(n * n for n in nums)
+    else:
+        total, sum_of_squares = float(values.sum()), float(np.dot(values, values))
+    return dict(count=len(values), total=total, sum_of_squares=sum_of_squares,
+                smallest=values.min().item(), largest=values.max().item())
+
+
+def benchmark(n=5_000_000):
+    text = ','.join(str(random.randint(-10_000, 10_000)) for _ in range(n))
+
+    start = time.perf_counter()
+    nums = [int(t) for t in text.split(',') if t.strip().isnumeric()]   # the ex07 way
+    total = sum(nums)
+    squares = [t * t for t in nums]
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parsed = parse_numbers(text)
+    stats = aggregates(parsed.values)
+    new_time = time.perf_counter() - start
+
+    print(f'{n:,} comma separated integers')
+    print(f'split + isnumeric + int : {old_time:.3f} seconds, {len(nums):,} numbers (the negative ones are lost)')
+    print(f'parse_numbers           : {new_time:.3f} seconds, {stats["count"]:,} numbers')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sum up comma/whitespace separated numbers')
+    parser.add_argument('files', nargs='*', help='files with numbers; reads stdin if none given')
+    parser.add_argument('--values', help='numbers given directly on the command line')
+    parser.add_argument('--benchmark', action='store_true', help='compare with the split/isnumeric approach')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    try:
+        if args.values is not None:
+            results = [parse_numbers(args.values)]
+        else:
+            results = [read_numbers(f) for f in args.files or ['-']]
+    except ValueError as err:
+        raise SystemExit(f'error: {err}')
+
+    values = np.concatenate([r.values for r in results])
+    rejected = [r for result in results for r in result.rejected]
+    for k, v in aggregates(values).items():
+        print(f'{k:15}: {v}')
+    if rejected:
+        print(f'{len(rejected)} token(s) rejected, e.g. {rejected[:10]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import unittest
+
+try:
+    from number_parser import parse_numbers
+except ImportError:     # numpy is not installed
+    parse_numbers = None
+
+
+@unittest.skipIf(parse_numbers is None, 'numpy is not installed')
+class TestParseNumbers(unittest.TestCase):
+
+    def check(self, data, values, rejected=()):
+        parsed = parse_numbers(data)
+        self.assertEqual(values, parsed.values.tolist())
+        self.assertEqual(list(rejected), parsed.rejected)
+
+    def test_integers(self):
+        self.check('1, 2,3 -4 +5', [1, 2, 3, -4, 5])
+        self.check(b'10\n20\t30\n', [10, 20, 30])
+        self.check('1,2,,3', [1, 2, 3])
+
+    def test_floats(self):
+        self.check('1.5, -2, 3e2', [1.5, -2.0, 300.0])
+
+    def test_empty(self):
+        for data in ['', '  \n', b'']:
+            with self.subTest(data=data):
+                self.check(data, [])
+
+    def test_stray_signs(self):
+        self.check('5, -, 7', [5, 7], [(1, '-')])
+        self.check('1 + 2', [1, 2], [(1, '+')])
+        self.check('-', [], [(0, '-')])
+        self.check('- 5', [5], [(0, '-')])
+        self.check('1.5 - 2', [1.5, 2.0], [(1, '-')])
+
+    def test_bad_tokens(self):
+        self.check('1 abc 3', [1, 3], [(1, 'abc')])
+        self.check('1-2 3 --4 5-', [3], [(0, '1-2'), (2, '--4'), (3, '5-')])
+        self.check('١٢ 3', [3], [(0, '١٢')])
+
+    def test_int64_limits(self):
+        self.check(f'{2**63 - 1} {-2**63}', [2**63 - 1, -2**63])
+        with self.assertRaises(ValueError):
+            parse_numbers(f'1 {2**63}')
+
+
+# python -m unittest test_number_parser.py
+if __name__ == '__main__':
+    unittest.main()
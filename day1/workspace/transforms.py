@@ -0,0 +1,163 @@
+"""
+Bulk versions of the list/dict comprehension transforms of ex06 and ex10.
+
+The comprehensions touch one element at a time in python. The functions here work
+on whole columns at once:
+
+- numbers are processed by numpy in single vectorized expressions
+- strings are normalized once per distinct value (city names repeat a lot)
+
+The outputs are the same as those of the comprehensions (see main()).
+"""
+import random
+import time
+
+import numpy as np     # pip install numpy
+
+
+def squares(nums):
+    """[n*n for n in nums]"""
+    nums = np.asarray(nums, dtype=np.int64)
+    return nums * nums
+
+
+def odd_numbers(nums):
+    """[n for n in nums if n%2]"""
+    nums = np.asarray(nums, dtype=np.int64)
+    return nums[nums % 2 == 1]
+
+
+def even_numbers(nums):
+    """[n for n in nums if n%2==0]"""
+    nums = np.asarray(nums, dtype=np.int64)
+    return nums[nums % 2 == 0]
+
+
+def partition_odd_even(nums):
+    """both odd_numbers() and even_numbers() with just one pass to compute the mask"""
+    nums = np.asarray(nums, dtype=np.int64)
+    is_odd = (nums & 1).astype(bool)
+    return nums[is_odd], nums[~is_odd]
+
+
+def normalize(values, fn=str.lower):
+    """
+    [fn(v) for v in values], calling fn just once for every distinct value.
+    The results are kept for this call only, so memory does not grow across calls.
+    """
+    cache = {}
+    result = []
+    append = result.append
+    for v in values:
+        try:
+            append(cache[v])
+        except KeyError:
+            cache[v] = fn(v)
+            append(cache[v])
+    return result
+
+
+def city_key(city):
+    """the titlecase_cities transform of ex06"""
+    return city.title().replace(' ', '')
+
+
+def discount_column(prices, discount, above=None, keep_others=True):
+    """
+    int((1-discount)*v) for a whole numpy column of prices.
+    With `above`, only prices greater than it are discounted; the others are kept
+    as they are (keep_others=True) or dropped (then a mask of the kept rows is also returned).
+    Kept float prices stay floats next to the int discounted ones, as in the comprehension,
+    so that column is of dtype object; int prices give an int64 column.
+    """
+    prices = np.asarray(prices)
+    # the same double precision arithmetic as int((1-discount)*v), then truncated the same way
+    discounted = np.trunc((1 - discount) * prices).astype(np.int64)
+    if above is None:
+        return discounted
+    selected = prices > above
+    if keep_others:
+        if prices.dtype.kind in 'iu':
+            return np.where(selected, discounted, prices)
+        # np.where() would make the discounted prices floats too
+        mixed = prices.astype(object)
+        mixed[selected] = discounted[selected].tolist()
+        return mixed
+    return discounted[selected], selected
+
+
+def apply_discount(prices, discount, above=None, keep_others=True):
+    """the ex10 dict comprehensions, for a whole dict {name: price} at once"""
+    names = list(prices)
+    # int64 for int prices, float64 if there are decimal ones (kept as they are, like the comprehension)
+    values = np.asarray(list(prices.values()))
+    if above is None or keep_others:
+        return dict(zip(names, discount_column(values, discount, above, keep_others).tolist()))
+    discounted, selected = discount_column(values, discount, above, keep_others)
+    return dict(zip([n for n, keep in zip(names, selected.tolist()) if keep], discounted.tolist()))
+
+
+def main():
+    # same data as ex06 and ex10
+    cities = ['Bangalore', 'kolkata', 'NEW   DELHI', 'navi      mumBAI', 'old CHENNai', 'HYderaBAD']
+    nums = [12, 38, 81, 2, 48, 18, 41, 49, 55, 22, 20, 49]
+    fruits = {'apple': 129, 'banana': 65, 'melon': 25}
+    prices = {'apple': 129.5, 'banana': 65, 'melon': 25.5}
+    discount = 0.1
+
+    print(f'{normalize(cities) = }')
+    print(f'{normalize(cities, city_key) = }')
+    print(f'{squares(nums).tolist() = }')
+    print(f'{apply_discount(fruits, discount, above=50) = }')
+
+    checks = [
+        (normalize(cities), [c.lower() for c in cities]),
+        (normalize(cities, city_key), [c.title().replace(' ', '') for c in cities]),
+        (squares(nums).tolist(), [n*n for n in nums]),
+        (odd_numbers(nums).tolist(), [n for n in nums if n%2]),
+        (even_numbers(nums).tolist(), [n for n in nums if n%2==0]),
+        (apply_discount(fruits, discount), {k: int((1-discount)*v) for k,v in fruits.items()}),
+        (apply_discount(fruits, discount, above=50), {k: int((1-discount)*v) if v>50 else v for k,v in fruits.items()}),
+        (apply_discount(fruits, discount, above=50, keep_others=False),
+            {k: int((1-discount)*v) for k,v in fruits.items() if v>50}),
+        (apply_discount(prices, discount, above=50), {k: int((1-discount)*v) if v>50 else v for k,v in prices.items()}),
+        # 116 == 116.0, so the types are compared as well
+        ([type(v) for v in apply_discount(prices, discount, above=50).values()],
+            [type(int((1-discount)*v) if v>50 else v) for v in prices.values()]),
+    ]
+    print(f'{all(actual == expected for actual, expected in checks) = }')
+
+    # benchmark on bigger tables
+    n = 5_000_000
+    big_nums = [random.randint(1, 10_000) for _ in range(n)]
+    big_cities = [random.choice(cities) for _ in range(n)]
+    big_prices = {f'item{i}': v for i, v in enumerate(big_nums)}
+
+    def timed(label, comprehension, bulk):
+        start = time.perf_counter()
+        expected = comprehension()
+        middle = time.perf_counter()
+        actual = bulk()
+        end = time.perf_counter()
+        if isinstance(actual, np.ndarray):
+            actual = actual.tolist()
+        print(f'{label:22} {middle - start:10.3f} {end - middle:10.3f} {actual == expected!s:>8}')
+
+    print(f'\n{n:,} rows (seconds)')
+    print(f'{"":22} {"compreh.":>10} {"bulk":>10} {"same?":>8}')
+    # the tables are kept as numpy columns; converting a list costs about as much as the comprehension
+    column = np.array(big_nums, dtype=np.int64)
+    timed('squares', lambda: [n*n for n in big_nums], lambda: squares(column))
+    timed('squares (from a list)', lambda: [n*n for n in big_nums], lambda: squares(big_nums))
+    timed('odd numbers', lambda: [n for n in big_nums if n%2], lambda: odd_numbers(column))
+    timed('odd/even partition', lambda: ([n for n in big_nums if n%2], [n for n in big_nums if n%2==0]),
+          lambda: tuple(a.tolist() for a in partition_odd_even(column)))
+    timed('lowercase cities', lambda: [c.lower() for c in big_cities], lambda: normalize(big_cities))
+    timed('discount (column)', lambda: [int((1-discount)*v) for v in big_nums],
+          lambda: discount_column(column, discount))
+    timed('discount (dict)', lambda: {k: int((1-discount)*v) for k,v in big_prices.items()},
+          lambda: apply_discount(big_prices, discount))
+
+
+if __name__ == '__main__':
+    main()
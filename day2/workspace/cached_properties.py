@@ -0,0 +1,125 @@
+"""
+Cached derived properties for the shapes of ex23, and cheaper Book objects (ex21).
+
+@cached('radius') turns a method into a property whose value is computed on the first
+access and stored in the object's __dict__. Since `cached` is a non-data descriptor
+(it has no __set__), python finds the stored value in __dict__ first on the following
+accesses, so a cached read costs the same as reading a plain attribute.
+
+Classes using it inherit from InvalidatesCache; assigning to an attribute that a cached
+property depends on (c1.radius = 3) drops the stored value, so it is recomputed on
+the next access.
+
+Book.from_trusted_rows() builds many Book objects at once without running the
+validations of the ex21 setters. (Skipping the setters only when a value has not
+changed was tried too, but the check costs as much as the validations themselves.)
+"""
+import math
+import timeit
+
+import ex21_object_properties
+import ex23_polymorphism
+
+
+class cached:
+    def __init__(self, *depends_on):
+        self.depends_on = depends_on
+
+    def __call__(self, fn):
+        self.fn = fn
+        self.__doc__ = fn.__doc__
+        return self
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        # attribute name -> names of the cached properties to drop when it is assigned;
+        # every class gets its own copy, extending the one of its base class
+        if '_dependents' not in owner.__dict__:
+            inherited = getattr(owner, '_dependents', {})
+            owner._dependents = {k: list(v) for k, v in inherited.items()}
+        for attr in self.depends_on:
+            owner._dependents.setdefault(attr, []).append(name)
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.name] = self.fn(obj)
+        return value
+
+
+class InvalidatesCache:
+    _dependents = {}
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        for prop in self._dependents.get(name, ()):
+            self.__dict__.pop(prop, None)
+
+
+class Circle(InvalidatesCache, ex23_polymorphism.Circle):
+    @cached('radius')
+    def area(self):
+        return self.radius * self.radius * math.pi
+
+
+class Rectangle(InvalidatesCache, ex23_polymorphism.Rectangle):
+    @cached('length', 'width')
+    def area(self):
+        return self.length * self.width
+
+
+class Square(Rectangle, ex23_polymorphism.Square):
+    # area (cached) from Rectangle above; __init__ and shape_name from ex23
+    pass
+
+
+class Triangle(InvalidatesCache, ex23_polymorphism.Triangle):
+    @cached('base', 'height')
+    def area(self):
+        return self.base * self.height / 2.
+
+
+class Book(ex21_object_properties.Book):
+    # the validated values live in _Book__title etc. (name mangling in ex21)
+
+    @classmethod
+    def from_trusted_rows(cls, rows):
+        """
+        builds Book objects from (title, price, page_count) rows WITHOUT validating them.
+        Only for data that was validated before it was stored, e.g. rows from our own DB.
+        """
+        books = []
+        for title, price, page_count in rows:
+            b = cls.__new__(cls)
+            b.__dict__.update(_Book__title=title, _Book__price=price, _Book__page_count=page_count)
+            books.append(b)
+        return books
+
+
+def main():
+    c1 = Circle(2)
+    print(f'{c1.area = }')
+    c1.radius = 3
+    print(f'after c1.radius = 3, {c1.area = }')
+    s1 = Square(4)
+    s1.width = 5
+    print(f'after s1.width = 5, {s1.area = }')
+
+    number = 1_000_000
+    print(f'\n{number:,} reads of the area property (seconds):')
+    for label, shape in [('ex23 Circle', ex23_polymorphism.Circle(2)), ('cached Circle', Circle(2)),
+                         ('ex23 Triangle', ex23_polymorphism.Triangle(2, 3)), ('cached Triangle', Triangle(2, 3))]:
+        print(f'{label:20} {timeit.timeit("s.area", globals={"s": shape}, number=number):.4f}')
+
+    rows = [(f'Book {i}', 100 + i % 500, 50 + i % 900) for i in range(100_000)]
+    number = 5
+    original = timeit.timeit(lambda: [ex21_object_properties.Book(title=t, price=p, page_count=c) for t, p, c in rows],
+                             number=number) / number
+    trusted = timeit.timeit(lambda: Book.from_trusted_rows(rows), number=number) / number
+    print(f'\nbuilding {len(rows):,} books (seconds):')
+    print(f'{"ex21 Book(...)":20} {original:.4f}')
+    print(f'{"from_trusted_rows":20} {trusted:.4f}')
+
+
+if __name__ == '__main__':
+    main()
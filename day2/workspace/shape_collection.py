@@ -0,0 +1,165 @@
+"""
+Struct-of-arrays storage for the shapes of ex23.
+
+Instead of a list of Circle/Rectangle/Square/Triangle objects (and one `area`
+property call per object), a ShapeCollection keeps the shapes grouped by kind,
+with one column of numbers per dimension:
+
+    circle      radius
+    rectangle   length, width
+    square      side
+    triangle    base, height
+
+The areas of all shapes of a kind are then computed by numpy in a single
+vectorized expression. Note that the shapes come back grouped by kind, not in
+the order they were added.
+"""
+import math
+import random
+import time
+from array import array
+
+import numpy as np     # pip install numpy
+
+from ex23_polymorphism import Shape, Circle, Rectangle, Square, Triangle
+
+
+# kind -> (class, dimensions, attributes of the class holding those dimensions)
+KINDS = {
+    'circle': (Circle, ('radius',), ('radius',)),
+    'rectangle': (Rectangle, ('length', 'width'), ('length', 'width')),
+    'square': (Square, ('side',), ('length',)),
+    'triangle': (Triangle, ('base', 'height'), ('base', 'height')),
+}
+
+
+def _kind_of(shape):
+    # Square is a Rectangle too, so it has to be checked first
+    for kind in ('square', 'circle', 'rectangle', 'triangle'):
+        if isinstance(shape, KINDS[kind][0]):
+            return kind
+    return None
+
+
+class ShapeCollection:
+    def __init__(self, shapes=()):
+        # array('d') stores plain doubles (no float objects), grows cheaply on append,
+        # and numpy reads it through the buffer protocol with a single memcpy
+        self.__columns = {kind: {dim: array('d') for dim in dims} for kind, (_, dims, _) in KINDS.items()}
+        self.extend(shapes)
+
+    def add(self, shape):
+        kind = _kind_of(shape)
+        if kind is None:
+            raise TypeError(f'Cannot store {shape!r} in a ShapeCollection')
+        _, dims, attrs = KINDS[kind]
+        for dim, attr in zip(dims, attrs):
+            self.__columns[kind][dim].append(getattr(shape, attr))
+
+    def extend(self, shapes):
+        # like print_shape_areas(), anything that is not a Shape is ignored, and so are
+        # the shapes of other kinds (ex23's Sphere); add() raises TypeError for those
+        for s in shapes:
+            if _kind_of(s) is not None:
+                self.add(s)
+
+    def add_many(self, kind, **dimensions):
+        """bulk insert, e.g. add_many('rectangle', length=[1, 2], width=[3, 4])"""
+        _, dims, _ = KINDS[kind]
+        if sorted(dimensions) != sorted(dims):
+            raise ValueError(f'{kind} needs the dimensions {dims}')
+        columns = [np.asarray(dimensions[dim], dtype='d') for dim in dims]
+        if len({len(c) for c in columns}) > 1:
+            raise ValueError('all the dimensions must have the same number of values')
+        for dim, values in zip(dims, columns):
+            self.__columns[kind][dim].frombytes(values.tobytes())
+
+    def column(self, kind, dim):
+        # a copy, so that holding on to it never blocks adding more shapes
+        return np.array(self.__columns[kind][dim], dtype='d')
+
+    def count(self, kind):
+        return len(self.__columns[kind][KINDS[kind][1][0]])
+
+    def __len__(self):
+        return sum(self.count(kind) for kind in KINDS)
+
+    def areas(self, kind):
+        """the areas of all the shapes of the given kind, as a numpy array"""
+        if kind == 'circle':
+            r = self.column('circle', 'radius')
+            return r * r * math.pi
+        if kind == 'rectangle':
+            return self.column('rectangle', 'length') * self.column('rectangle', 'width')
+        if kind == 'square':
+            side = self.column('square', 'side')
+            return side * side
+        if kind == 'triangle':
+            return self.column('triangle', 'base') * self.column('triangle', 'height') / 2.
+        raise ValueError(f'Unknown kind of shape {kind!r}')
+
+    def all_areas(self):
+        return np.concatenate([self.areas(kind) for kind in KINDS])
+
+    def total_area(self):
+        return float(sum(self.areas(kind).sum() for kind in KINDS))
+
+    def stats_by_kind(self):
+        stats = {}
+        for kind in KINDS:
+            a = self.areas(kind)
+            if len(a):
+                stats[kind] = dict(count=len(a), total=float(a.sum()), mean=float(a.mean()),
+                                   min=float(a.min()), max=float(a.max()))
+            else:
+                stats[kind] = dict(count=0, total=0.0, mean=None, min=None, max=None)
+        return stats
+
+    def to_shapes(self):
+        """converts back into a list of ex23 objects (grouped by kind)"""
+        shapes = []
+        for kind, (cls, dims, _) in KINDS.items():
+            columns = [self.column(kind, dim).tolist() for dim in dims]
+            shapes.extend(cls(*values) for values in zip(*columns))
+        return shapes
+
+
+def main():
+    n = 1_000_000
+    makers = [
+        lambda: Circle(random.uniform(1, 10)),
+        lambda: Rectangle(random.uniform(1, 10), random.uniform(1, 10)),
+        lambda: Square(random.uniform(1, 10)),
+        lambda: Triangle(random.uniform(1, 10), random.uniform(1, 10)),
+    ]
+    shapes = [random.choice(makers)() for _ in range(n)]
+
+    start = time.perf_counter()
+    totals = {}
+    for s in shapes:
+        if isinstance(s, Shape):
+            totals[s.shape_name] = totals.get(s.shape_name, 0) + s.area
+    loop_total = sum(totals.values())
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    collection = ShapeCollection(shapes)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = collection.stats_by_kind()
+    vector_total = collection.total_area()
+    vector_time = time.perf_counter() - start
+
+    print(f'{n:,} shapes')
+    print(f'per object loop         : {loop_time:.4f} seconds')
+    print(f'ShapeCollection         : {vector_time:.4f} seconds (+ {build_time:.4f} seconds to build it from the objects)')
+    print(f'{math.isclose(loop_total, vector_total) = }')
+    for kind, s in stats.items():
+        print(f'{kind:10} {s['count']:8,} shapes, total area {s['total']:14,.2f}, mean {s['mean']:8.2f}')
+
+    print(f'{len(collection.to_shapes()) == n = }')
+
+
+if __name__ == '__main__':
+    main()
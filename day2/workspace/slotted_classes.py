@@ -0,0 +1,181 @@
+"""
+Low memory variants of Employee (ex19), Book (ex20) and Book with properties (ex21).
+
+A class that declares __slots__ reserves a fixed set of attribute slots in every
+object instead of giving each one its own __dict__. The constructors, __str__ and
+__eq__ behave exactly like the original classes, but an object takes less memory
+(no per-object dict) and reading an attribute is a bit faster too.
+
+The trade-off is that you cannot add new attributes to the objects on the fly.
+"""
+import sys
+import timeit
+import tracemalloc
+
+from ex17_kwargs_demo import line
+
+
+class Employee:
+    __slots__ = ('empid', 'name', 'salary', 'department', 'email')
+
+    # class variables are not affected by __slots__
+    __count = 0
+
+    def __init__(self, **kwargs):
+        Employee.__count += 1
+        self.empid = Employee.__count
+        self.name = kwargs.get('name')
+        self.salary = kwargs.get('salary', 25_000)
+        self.department = kwargs.get('department', 'ACCOUNTING')
+        self.email = kwargs.get('email')
+
+    def __str__(self):
+        return f'Employee(empid={self.empid!r}, name={self.name!r}, salary={self.salary!r}, department={self.department!r}, email={self.email!r})'
+
+    def print(self):
+        print(f'ID          : {self.empid}')
+        print(f'Name        : {self.name}')
+        print(f'Email       : {self.email}')
+        print(f'Salary      : {self.salary}')
+        print(f'Department  : {self.department}')
+        line()
+
+    def __eq__(self, other):
+        return self.empid == other.empid and \
+            self.name == other.name and \
+            self.department == other.department and \
+            self.salary == other.salary
+
+
+class Book:
+    __slots__ = ('title', 'price', 'genre')
+
+    available_genres = ['Thriller', 'Comedy', 'Romance']
+
+    def __init__(self, title, price, genre='Romance'):
+        self.title = title
+        self.price = price
+
+        if genre not in Book.available_genres:
+            self.genre = 'General'
+        else:
+            self.genre = genre
+
+    def __str__(self):
+        return f'Book(title={self.title!r},price={self.price!r},genre={self.genre!r})'
+
+
+class ValidatedBook:
+    # names starting with __ are mangled in __slots__ too, so the
+    # properties below work exactly the way they do in ex21
+    __slots__ = ('__title', '__price', '__page_count')
+
+    def __init__(self, **kwargs):
+        self.title = kwargs.get('title')            # calls setter for `title`
+        self.price = kwargs.get('price')            # calls setter for `price`
+        self.page_count = kwargs.get('page_count')  # calls setter for `page_count`
+
+    def __str__(self):
+        return f'Book(title={self.__title!r}, price={self.__price!r}, page_count={self.__page_count!r})'
+
+    @property
+    def title(self):
+        return self.__title
+
+    @title.setter
+    def title(self, value):
+        if value is None:
+            self.__title = None
+        elif isinstance(value, str):
+            if len(value.strip()) == 0:
+                raise ValueError('Cannot assign empty string')
+            self.__title = value
+        else:
+            raise TypeError('Invalid type of value assigned. Must be a `str` or None')
+
+    @property
+    def price(self):
+        return self.__price
+
+    @price.setter
+    def price(self, value):
+        if value is None:
+            self.__price = None
+        elif type(value) in (int, float):
+            if value < 0:
+                raise ValueError('Price cannot be negative')
+            self.__price = value
+        else:
+            raise TypeError('Price must be a number')
+
+    @property
+    def page_count(self):
+        return self.__page_count
+
+    @page_count.setter
+    def page_count(self, value):
+        if value is None:
+            self.__page_count = None
+        elif isinstance(value, int):
+            if value < 50:
+                raise ValueError('Book should have at least 50 pages')
+            if value > 10000:
+                raise ValueError('Book cannot have more than 10000 pages')
+            self.__page_count = value
+        else:
+            raise TypeError('Page count must be a number')
+
+
+def bytes_per_instance(factory, count=100_000):
+    """measures the memory allocated per object (including its __dict__, if any)"""
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [factory(i) for i in range(count)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # the list holding the objects is not part of the objects
+    return (after - before - sys.getsizeof(objects)) / count
+
+
+def main():
+    import ex19_class_and_object
+    import ex20_class_variables
+    import ex21_object_properties
+
+    # the strings are shared by all objects so that only the objects are measured
+    name, email = 'Rajesh', 'rajesh@xmpl.com'
+    title = 'Let us C'
+    pairs = [
+        ('Employee (ex19)', 'name',
+            lambda i: ex19_class_and_object.Employee(name=name, salary=i, email=email),
+            lambda i: Employee(name=name, salary=i, email=email)),
+        ('Book (ex20)', 'title',
+            lambda i: ex20_class_variables.Book(title, i, 'Thriller'),
+            lambda i: Book(title, i, 'Thriller')),
+        ('Book (ex21)', 'title',
+            lambda i: ex21_object_properties.Book(title=title, price=i, page_count=298),
+            lambda i: ValidatedBook(title=title, price=i, page_count=298)),
+    ]
+
+    print(f"{'':16} {'bytes/object':>24} {'attribute read (ns)':>24}")
+    print(f"{'':16} {'original':>12}{'slotted':>12} {'original':>12}{'slotted':>12}")
+    for label, attr, original, slotted in pairs:
+        size_before = bytes_per_instance(original)
+        size_after = bytes_per_instance(slotted)
+
+        o1, o2 = original(1), slotted(1)
+        number = 1_000_000
+        read_before = timeit.timeit(f'o.{attr}', globals={'o': o1}, number=number)
+        read_after = timeit.timeit(f'o.{attr}', globals={'o': o2}, number=number)
+        print(f'{label:16} {size_before:12.0f}{size_after:12.0f} {read_before / number * 1e9:12.1f}{read_after / number * 1e9:12.1f}')
+
+    e1 = Employee(name='Rajesh', department='ADMIN')
+    e2 = Employee(name='Rajesh', department='ADMIN')
+    e1.empid = e2.empid
+    print(e1)
+    print(f'{e1 == e2 = }')
+    print(ValidatedBook(title='Learn Python', price=999.99, page_count=345))
+
+
+if __name__ == '__main__':
+    main()
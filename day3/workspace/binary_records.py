@@ -0,0 +1,341 @@
+"""
+A compact binary row format for customer (or any flat, CSV like) records.
+
+File layout (all numbers are little endian):
+
+    magic           b'CUSTBIN1'
+    row count       u32
+    field count     u16
+    fields          for each field: name (u16 length + utf-8 bytes), kind (1 byte)
+                      'i' -> int64, 'f' -> float64,
+                      's' -> u16 length + utf-8 bytes, or the length 65535 alone for None
+                      'd' -> u16 code into a dictionary of strings
+    dictionaries    for each 'd' field: u16 count, followed by the strings (as for 's')
+    rows            the values of each row, in the order of the fields
+    index           (optional) u32 count, the sorted ids (int64 each), followed by
+                    the offsets of the rows (uint64 each)
+    trailer         u64 offset of the index (0 if there is none), b'CBIX'
+
+The index footer lets a reader jump straight to a record by its id, and since the
+reader memory maps the file, only the pages actually touched are read from the disk.
+"""
+import csv
+import json
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+
+MAGIC = b'CUSTBIN1'
+TRAILER_MAGIC = b'CBIX'
+MAX_DICTIONARY_SIZE = 65535
+NONE_LENGTH = 65535     # the length of a string that is None (a missing value)
+
+_u16 = struct.Struct('<H')
+_u32 = struct.Struct('<I')
+_i64 = struct.Struct('<q')
+_f64 = struct.Struct('<d')
+_trailer = struct.Struct('<Q4s')
+
+
+# only the values that are written back the same way they were read: '00123' (a zip
+# code) or '1_000' are int() too, but would come back as 123 and 1000
+
+def _is_int(value):
+    try:
+        return str(int(value)) == value
+    except ValueError:
+        return False
+
+
+def _is_float(value):
+    try:
+        return repr(float(value)) == value
+    except ValueError:
+        return False
+
+
+def infer_kinds(records, fields):
+    """guesses the kind of each field by looking at all the values (as read by csv.DictReader)"""
+    kinds = {}
+    for field in fields:
+        values = [r[field] for r in records]
+        if not values:
+            kinds[field] = 's'      # no rows, nothing to go by
+        elif all(type(v) is int or (type(v) is str and _is_int(v)) for v in values):
+            kinds[field] = 'i'
+        elif all(type(v) in (int, float) or (type(v) is str and _is_float(v)) for v in values):
+            kinds[field] = 'f'
+        elif len(set(values)) <= min(MAX_DICTIONARY_SIZE, len(values) // 2):
+            # values repeat a lot (gender, city etc), so store each of them just once
+            kinds[field] = 'd'
+        else:
+            kinds[field] = 's'
+    return kinds
+
+
+def _pack_str(value):
+    # csv.DictReader gives None for the fields missing from a short row
+    if value is None:
+        return _u16.pack(NONE_LENGTH)
+    data = value.encode('utf-8')
+    if len(data) >= NONE_LENGTH:
+        raise ValueError(f'strings longer than {NONE_LENGTH - 1} bytes are not supported')
+    return _u16.pack(len(data)) + data
+
+
+def write_records(filename, records, fields=None, kinds=None, index_field='id'):
+    """writes the records (list of dicts) into filename; index_field=None skips the index footer"""
+    records = list(records)
+    if fields is None:
+        fields = list(records[0].keys()) if records else []
+    if kinds is None:
+        kinds = infer_kinds(records, fields)
+        if not records and index_field in kinds:
+            kinds[index_field] = 'i'        # an empty index
+    if index_field is not None and kinds.get(index_field) != 'i':
+        raise ValueError(f'index field {index_field!r} must be an integer field')
+
+    dictionaries = {}
+    for field in fields:
+        if kinds[field] == 'd':
+            dictionaries[field] = {v: code for code, v in enumerate(dict.fromkeys(r[field] for r in records))}
+
+    with open(filename, 'wb') as file:
+        header = [MAGIC, _u32.pack(len(records)), _u16.pack(len(fields))]
+        for field in fields:
+            header.append(_pack_str(field))
+            header.append(kinds[field].encode('ascii'))
+        for field, codes in dictionaries.items():
+            header.append(_u16.pack(len(codes)))
+            header.extend(_pack_str(v) for v in codes)
+        file.write(b''.join(header))
+
+        # one packer per field, looked up just once
+        packers = []
+        for field in fields:
+            kind = kinds[field]
+            if kind == 'i':
+                packers.append((field, lambda v: _i64.pack(int(v))))
+            elif kind == 'f':
+                packers.append((field, lambda v: _f64.pack(float(v))))
+            elif kind == 'd':
+                packers.append((field, lambda v, codes=dictionaries[field]: _u16.pack(codes[v])))
+            else:
+                packers.append((field, lambda v: _pack_str(v if v is None else str(v))))
+
+        offsets = []
+        position = file.tell()
+        for r in records:
+            row = b''.join([pack(r[field]) for field, pack in packers])
+            if index_field is not None:
+                offsets.append((int(r[index_field]), position))
+            file.write(row)
+            position += len(row)
+
+        index_offset = 0
+        if index_field is not None:
+            index_offset = position
+            offsets.sort()
+            file.write(_u32.pack(len(offsets)))
+            file.write(struct.pack(f'<{len(offsets)}q', *[i for i, _ in offsets]))
+            file.write(struct.pack(f'<{len(offsets)}Q', *[o for _, o in offsets]))
+        file.write(_trailer.pack(index_offset, TRAILER_MAGIC))
+
+
+def _compile_row_reader(fields, kinds, dictionaries):
+    """
+    generates a function that decodes one row at a given position. Runs of fixed width
+    fields (numbers and dictionary codes) are unpacked with a single struct call.
+    """
+    lines = ['def read_row(mm, pos):']
+    namespace = {'_u16': _u16.unpack_from, '_NONE': NONE_LENGTH}
+    values = []
+    run = []
+
+    def flush():
+        if not run:
+            return
+        fmt = '<' + ''.join({'i': 'q', 'f': 'd', 'd': 'H'}[kinds[f]] for _, f in run)
+        namespace[f'_s{len(namespace)}'] = unpacker = struct.Struct(fmt)
+        names = ''.join(f'{v}, ' for v, _ in run)
+        lines.append(f'    {names}= _s{len(namespace) - 1}.unpack_from(mm, pos)')
+        lines.append(f'    pos += {unpacker.size}')
+        run.clear()
+
+    for i, field in enumerate(fields):
+        v = f'v{i}'
+        if kinds[field] == 's':
+            flush()
+            lines.append(f'    n, = _u16(mm, pos)')
+            lines.append(f'    if n == _NONE:')
+            lines.append(f'        {v} = None')
+            lines.append(f'        pos += 2')
+            lines.append(f'    else:')
+            lines.append(f"        {v} = str(mm[pos + 2:pos + 2 + n], 'utf-8')")
+            lines.append(f'        pos += 2 + n')
+            values.append(f'{field!r}: {v}')
+        else:
+            run.append((v, field))
+            if kinds[field] == 'd':
+                namespace[f'_d{i}'] = dictionaries[field]
+                values.append(f'{field!r}: _d{i}[{v}]')
+            else:
+                values.append(f'{field!r}: {v}')
+    flush()
+    lines.append(f'    return {{{", ".join(values)}}}, pos')
+
+    exec('\n'.join(lines), namespace)
+    return namespace['read_row']
+
+
+class BinaryRecordReader:
+    """memory mapped reader for files written by write_records()"""
+
+    def __init__(self, filename):
+        self.__file = open(filename, 'rb')
+        self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__index_ids = self.__index_offsets = None
+        mm = self.__mm
+
+        if mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{filename} is not a binary records file')
+        pos = len(MAGIC)
+        self.__count, = _u32.unpack_from(mm, pos)
+        field_count, = _u16.unpack_from(mm, pos + 4)
+        pos += 6
+
+        self.fields = []
+        self.kinds = {}
+        for _ in range(field_count):
+            name, pos = self.__read_str(pos)
+            self.fields.append(name)
+            self.kinds[name] = chr(mm[pos])
+            pos += 1
+
+        self.__dictionaries = {}
+        for field in self.fields:
+            if self.kinds[field] == 'd':
+                count, = _u16.unpack_from(mm, pos)
+                pos += 2
+                values = []
+                for _ in range(count):
+                    value, pos = self.__read_str(pos)
+                    values.append(value)
+                self.__dictionaries[field] = values
+        self.__data_offset = pos
+
+        index_offset, trailer_magic = _trailer.unpack_from(mm, len(mm) - _trailer.size)
+        if trailer_magic != TRAILER_MAGIC:
+            self.close()
+            raise ValueError(f'{filename} is truncated')
+        self.__read_row = _compile_row_reader(self.fields, self.kinds, self.__dictionaries)
+        if index_offset:
+            count, = _u32.unpack_from(mm, index_offset)
+            start = index_offset + 4
+            # memoryviews over the mapped file; bisect works on them without copying anything
+            self.__view = memoryview(mm)
+            self.__index_ids = self.__view[start:start + 8 * count].cast('q')
+            self.__index_offsets = self.__view[start + 8 * count:start + 16 * count].cast('Q')
+
+    def __read_str(self, pos):
+        length, = _u16.unpack_from(self.__mm, pos)
+        pos += 2
+        if length == NONE_LENGTH:
+            return None, pos
+        return str(self.__mm[pos:pos + length], 'utf-8'), pos + length
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        pos = self.__data_offset
+        for _ in range(self.__count):
+            row, pos = self.__read_row(self.__mm, pos)
+            yield row
+
+    def get(self, record_id):
+        """returns the record with the given id (using the index footer) or None"""
+        if self.__index_ids is None:
+            raise ValueError('this file was written without an index')
+        i = bisect_left(self.__index_ids, record_id)
+        if i == len(self.__index_ids) or self.__index_ids[i] != record_id:
+            return None
+        return self.__read_row(self.__mm, self.__index_offsets[i])[0]
+
+    def close(self):
+        if self.__index_ids is not None:
+            self.__index_ids.release()
+            self.__index_offsets.release()
+            self.__view.release()
+            self.__index_ids = self.__index_offsets = None
+        self.__mm.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_records(filename):
+    with BinaryRecordReader(filename) as reader:
+        return list(reader)
+
+
+def main():
+    with open('customers.csv', encoding='utf-8') as csv_file:
+        customers = list(csv.DictReader(csv_file))
+
+    # make a bigger data set out of the sample
+    n = 100_000
+    records = []
+    for i in range(n):
+        c = dict(customers[i % len(customers)])
+        c['id'] = str(i + 1)
+        c['email'] = f'{i}.{c["email"]}'
+        c['phone'] = f'{c["phone"]}-{i}'
+        records.append(c)
+
+    json_filename = f'customers_{n}.json'
+    bin_filename = f'customers_{n}.bin'
+    with open(json_filename, 'wt', encoding='utf-8') as json_file:
+        json.dump(records, json_file, indent=3)
+    write_records(bin_filename, records)
+
+    json_size = os.path.getsize(json_filename)
+    bin_size = os.path.getsize(bin_filename)
+    print(f'{n:,} customers')
+    print(f'JSON file size   : {json_size:,} bytes')
+    print(f'binary file size : {bin_size:,} bytes ({bin_size / json_size:.0%} of JSON)')
+
+    start = time.perf_counter()
+    with open(json_filename, encoding='utf-8') as json_file:
+        from_json = json.load(json_file)
+    json_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from_bin = read_records(bin_filename)
+    bin_time = time.perf_counter() - start
+
+    print(f'parse time JSON   : {json_time:.4f} seconds')
+    print(f'parse time binary : {bin_time:.4f} seconds')
+    print(f'{len(from_json) == len(from_bin) = }')
+
+    with BinaryRecordReader(bin_filename) as reader:
+        start = time.perf_counter()
+        for i in range(1, 10_001):
+            reader.get(i * 7 % n + 1)
+        lookup_time = time.perf_counter() - start
+        print(f'10,000 lookups by id from the index: {lookup_time:.4f} seconds')
+        print(f'{reader.get(42) = }')
+
+    os.remove(json_filename)
+    os.remove(bin_filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,14 @@ import argparse
 import time
 import csv
 import json
+from binary_records import write_records
 
 
 def main():
     parser = argparse.ArgumentParser(description="Convert a CSV file into a JSON file")
     parser.add_argument("--source", help="CSV file for converting into JSON", required=True)
     parser.add_argument("--target", help="JSON filename. If not given, will be auto-generated")
+    parser.add_argument("--format", help="output format (default json)", choices=["json", "binary"], default="json")
 
     args = parser.parse_args()
     # print(f'{args = }')
@@ -19,17 +21,22 @@ def main():
         print('Invalid filename. Must be CSV file.')
         exit(1)
     
-    json_filename = f'{csv_filename[:-4]}_{round(time.time())}.json' if args.target is None \
+    extension = 'bin' if args.format == 'binary' else 'json'
+    json_filename = f'{csv_filename[:-4]}_{round(time.time())}.{extension}' if args.target is None \
         else args.target
     
     with open(csv_filename, encoding='utf-8') as csv_file:
         reader = csv.DictReader(csv_file)
         data = [c for c in reader]
+        fields = reader.fieldnames or []     # None for an empty file
         
-    with open(json_filename, 'wt', encoding='utf-8') as json_file:
-        json.dump(data, json_file, indent=3)
+    if args.format == 'binary':
+        write_records(json_filename, data, fields, index_field='id' if 'id' in fields else None)
+    else:
+        with open(json_filename, 'wt', encoding='utf-8') as json_file:
+            json.dump(data, json_file, indent=3)
 
-    print(f'content from {csv_filename} is written in JSON format in {json_filename}.')
+    print(f'content from {csv_filename} is written in {args.format.upper()} format in {json_filename}.')
 
 if __name__ == '__main__':
     main()
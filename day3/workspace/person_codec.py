@@ -0,0 +1,353 @@
+"""
+Schema compiled JSON encoder/decoder.
+
+The shape of a record is declared once, using plain python types:
+
+    PERSON_SCHEMA = {
+        'name': str,
+        'age': int,
+        'married': bool,
+        'email': {'personal': str, 'official': str},
+        'phones': [str],
+    }
+
+compile_codec(schema) generates the source code of an encoder and a decoder
+specialized for that shape and compiles them with exec(). The generated functions
+know every field, its position and its type up-front, so there is no generic type
+dispatch, and the input is validated while it is being encoded/parsed: a field
+that is not in the schema is an error, not silently left out of the JSON.
+
+The decoder has a fast path for compact input (no whitespace, keys in the declared
+order - exactly what the encoder produces), a second path that tolerates whitespace,
+and falls back to json.loads() + validate() when the keys come in a different order.
+"""
+import json
+import timeit
+from json.decoder import scanstring, WHITESPACE
+from json.encoder import encode_basestring_ascii
+from json.scanner import NUMBER_RE
+
+
+PERSON_SCHEMA = {
+    'name': str,
+    'age': int,
+    'married': bool,
+    'email': {'personal': str, 'official': str},
+    'phones': [str],
+}
+
+
+class _KeyOrderMismatch(Exception):
+    """raised by a generated parser when the input is not laid out the way it expects"""
+
+
+def _type_name(schema):
+    if isinstance(schema, dict):
+        return 'an object'
+    if isinstance(schema, list):
+        return 'an array'
+    return {str: 'a string', int: 'an integer', float: 'a number', bool: 'a boolean'}[schema]
+
+
+def validate(obj, schema, path='$'):
+    """raises ValueError if obj does not match the schema"""
+    if isinstance(schema, dict):
+        if type(obj) is not dict:
+            raise ValueError(f'{path}: expected {_type_name(schema)}')
+        if obj.keys() != schema.keys():
+            missing = [k for k in schema if k not in obj]
+            unknown = [k for k in obj if k not in schema]
+            raise ValueError(f'{path}: missing fields {missing}, unknown fields {unknown}')
+        for k, sub in schema.items():
+            validate(obj[k], sub, f'{path}.{k}')
+    elif isinstance(schema, list):
+        if type(obj) is not list:
+            raise ValueError(f'{path}: expected {_type_name(schema)}')
+        for i, item in enumerate(obj):
+            validate(item, schema[0], f'{path}[{i}]')
+    elif schema is float:
+        if type(obj) not in (int, float):
+            raise ValueError(f'{path}: expected {_type_name(schema)}')
+    elif type(obj) is not schema:
+        raise ValueError(f'{path}: expected {_type_name(schema)}')
+
+
+class _Source:
+    """collects lines of generated code along with unique variable names"""
+
+    def __init__(self):
+        self.lines = []
+        self.count = 0
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def var(self):
+        self.count += 1
+        return f'_v{self.count}'
+
+    def text(self):
+        return '\n'.join(self.lines)
+
+
+# ---------- encoder ----------
+
+def _gen_encode(schema, src, path, code, indent):
+    """emits the checks for `src` and returns the list of string pieces (literals or expressions)"""
+    if isinstance(schema, dict):
+        pieces = [('lit', '{')]
+        for i, (k, sub) in enumerate(schema.items()):
+            v = code.var()
+            code.emit(indent, f'{v} = {src}[{k!r}]')
+            pieces.append(('lit', (',' if i else '') + json.dumps(k) + ':'))
+            pieces.extend(_gen_encode(sub, v, f'{path}.{k}', code, indent))
+        # all the declared fields are there, so anything more is unknown (as for the decoder and validate)
+        code.emit(indent, f'if len({src}) != {len(schema)}: '
+                          f'raise ValueError({path + ": unknown fields "!r} + str([k for k in {src} if k not in {tuple(schema)!r}]))')
+        pieces.append(('lit', '}'))
+        return pieces
+
+    if isinstance(schema, list):
+        code.emit(indent, f'if type({src}) is not list: raise ValueError({path + ": expected an array"!r})')
+        item = code.var()
+        if schema[0] is str:
+            code.emit(indent, f'for {item} in {src}:')
+            code.emit(indent + 1, f'if type({item}) is not str: raise ValueError({path + "[]: expected a string"!r})')
+            return [('lit', '['), ('expr', f"','.join(map(_str, {src}))"), ('lit', ']')]
+
+        # any other item type gets its own little encoder function
+        fn = f'_enc{item}'
+        code.emit(indent, f'def {fn}({item}):')
+        code.emit(indent + 1, f'return {_join(_gen_encode(schema[0], item, path + "[]", code, indent + 1))}')
+        return [('lit', '['), ('expr', f"','.join(map({fn}, {src}))"), ('lit', ']')]
+
+    if schema is str:
+        code.emit(indent, f'if type({src}) is not str: raise ValueError({path + ": expected a string"!r})')
+        return [('expr', f'_str({src})')]
+    if schema is int:
+        code.emit(indent, f'if type({src}) is not int: raise ValueError({path + ": expected an integer"!r})')
+        return [('expr', f'_int({src})')]
+    if schema is float:
+        code.emit(indent, f'if type({src}) not in (int, float): raise ValueError({path + ": expected a number"!r})')
+        return [('expr', f'_float(float({src}))')]
+    if schema is bool:
+        code.emit(indent, f'if type({src}) is not bool: raise ValueError({path + ": expected a boolean"!r})')
+        return [('expr', f"('true' if {src} else 'false')")]
+
+    raise TypeError(f'Unsupported schema type at {path}: {schema!r}')
+
+
+def _join(pieces):
+    # merge adjacent literals so that the generated code does the least concatenations
+    merged = []
+    for kind, value in pieces:
+        if kind == 'lit' and merged and merged[-1][0] == 'lit':
+            merged[-1] = ('lit', merged[-1][1] + value)
+        else:
+            merged.append((kind, value))
+    return ' + '.join(repr(v) if k == 'lit' else v for k, v in merged)
+
+
+def _compile_encoder(schema):
+    code = _Source()
+    code.emit(0, 'def encode(obj):')
+    code.emit(1, 'try:')
+    pieces = _gen_encode(schema, 'obj', '$', code, 2)
+    code.emit(1, 'except KeyError as err:')
+    code.emit(2, "raise ValueError(f'missing field {err}') from None")
+    code.emit(1, 'except TypeError:')
+    code.emit(2, "raise ValueError('expected an object') from None")
+    code.emit(1, f'return {_join(pieces)}')
+
+    namespace = dict(_str=encode_basestring_ascii, _int=int.__repr__, _float=float.__repr__)
+    exec(code.text(), namespace)
+    encode = namespace['encode']
+    encode.source = code.text()
+    return encode
+
+
+# ---------- decoder ----------
+
+def _gen_decode(schema, target, path, code, indent, compact):
+    """
+    emits code that parses a value of the given schema at `pos` into `target`.
+    A `compact` parser assumes there is no whitespace between the tokens (which is what
+    our encoder produces) and gives up with _Mismatch on anything unexpected, so that the
+    whitespace tolerant parser can have a go at it and report a proper error.
+    """
+    emit = lambda line, extra=0: code.emit(indent + extra, line)
+    fail = lambda msg, at='pos': 'raise _Mismatch' if compact else f'_fail({path + ": " + msg!r}, s, {at})'
+
+    if not compact:
+        emit('pos = _ws(s, pos).end()')
+
+    if isinstance(schema, dict):
+        fields = []
+        for i, (k, sub) in enumerate(schema.items()):
+            key = json.dumps(k)
+            if compact:
+                lit = ('{' if i == 0 else ',') + key + ':'
+                emit(f'if not s.startswith({lit!r}, pos): raise _Mismatch')
+                emit(f'pos += {len(lit)}')
+            else:
+                if i == 0:
+                    emit(f"if s[pos:pos + 1] != '{{': {fail('expected an object')}")
+                else:
+                    emit('pos = _ws(s, pos).end()')
+                    emit("if s[pos:pos + 1] != ',': raise _Mismatch")
+                emit('pos = _ws(s, pos + 1).end()')
+                emit(f'if not s.startswith({key!r}, pos): raise _Mismatch')
+                emit(f'pos = _ws(s, pos + {len(key)}).end()')
+                emit(f"if s[pos:pos + 1] != ':': {fail('expected a colon')}")
+                emit('pos += 1')
+            v = code.var()
+            _gen_decode(sub, v, f'{path}.{k}', code, indent, compact)
+            fields.append(f'{k!r}: {v}')
+        if not compact:
+            emit('pos = _ws(s, pos).end()')
+        emit("if s[pos:pos + 1] != '}': raise _Mismatch")
+        emit('pos += 1')
+        emit(f'{target} = {{{", ".join(fields)}}}')
+
+    elif isinstance(schema, list):
+        item = code.var()
+        emit(f"if s[pos:pos + 1] != '[': {fail('expected an array')}")
+        emit(f'{target} = []')
+        emit('pos += 1' if compact else 'pos = _ws(s, pos + 1).end()')
+        emit("if s[pos:pos + 1] == ']':")
+        emit('pos += 1', 1)
+        emit('else:')
+        emit('while True:', 1)
+        _gen_decode(schema[0], item, path + '[]', code, indent + 2, compact)
+        emit(f'{target}.append({item})', 2)
+        if not compact:
+            emit('pos = _ws(s, pos).end()', 2)
+        emit('c = s[pos:pos + 1]', 2)
+        emit('pos += 1', 2)
+        emit("if c == ']': break", 2)
+        emit(f"if c != ',': {fail('expected , or ]', 'pos - 1')}", 2)
+
+    elif schema is str:
+        emit(f"if s[pos:pos + 1] != '\"': {fail('expected a string')}")
+        emit(f'{target}, pos = _scan(s, pos + 1)')
+
+    elif schema is int or schema is float:
+        m = code.var()
+        emit(f'{m} = _num(s, pos)')
+        if schema is int:
+            emit(f'if {m} is None or {m}.group(2) or {m}.group(3): {fail("expected an integer")}')
+            emit(f'{target} = int({m}.group(1))')
+        else:
+            emit(f'if {m} is None: {fail("expected a number")}')
+            emit(f'{target} = float({m}.group())')
+        emit(f'pos = {m}.end()')
+
+    elif schema is bool:
+        emit("if s.startswith('true', pos):")
+        emit(f'{target} = True', 1)
+        emit('pos += 4', 1)
+        emit("elif s.startswith('false', pos):")
+        emit(f'{target} = False', 1)
+        emit('pos += 5', 1)
+        emit('else:')
+        emit(fail('expected a boolean'), 1)
+
+    else:
+        raise TypeError(f'Unsupported schema type at {path}: {schema!r}')
+
+
+def _fail(msg, s, pos):
+    raise json.JSONDecodeError(msg, s, pos)
+
+
+def _compile_parser(schema, compact):
+    code = _Source()
+    code.emit(0, 'def parse(s):')
+    code.emit(1, 'pos = 0')
+    _gen_decode(schema, 'result', '$', code, 1, compact)
+    if compact:
+        code.emit(1, 'if pos != len(s): raise _Mismatch')
+    else:
+        code.emit(1, 'pos = _ws(s, pos).end()')
+        code.emit(1, "if pos != len(s): _fail('$: extra data', s, pos)")
+    code.emit(1, 'return result')
+
+    namespace = dict(_ws=WHITESPACE.match, _num=NUMBER_RE.match, _scan=scanstring,
+                     _fail=_fail, _Mismatch=_KeyOrderMismatch)
+    exec(code.text(), namespace)
+    parse = namespace['parse']
+    parse.source = code.text()
+    return parse
+
+
+def _compile_decoder(schema):
+    parse_compact = _compile_parser(schema, compact=True)
+    parse_spaced = _compile_parser(schema, compact=False)
+
+    def decode(s):
+        if isinstance(s, (bytes, bytearray)):
+            s = s.decode('utf-8')
+        try:
+            return parse_compact(s)
+        except _KeyOrderMismatch:
+            pass
+        try:
+            return parse_spaced(s)
+        except _KeyOrderMismatch:
+            # keys are not in the declared order (or some are missing/unknown)
+            obj = json.loads(s)
+            validate(obj, schema)
+            return obj
+
+    return decode
+
+
+def compile_codec(schema):
+    """returns a tuple (encode, decode) of functions specialized for the given schema"""
+    return _compile_encoder(schema), _compile_decoder(schema)
+
+
+encode_person, decode_person = compile_codec(PERSON_SCHEMA)
+
+
+def main():
+    p1 = dict(name='Vinod', age=52, married=True,
+              email=dict(personal='vinod@xmpl.com', official='vinod@vinod.co'),
+              phones=['9731424784', '9844083934'])
+
+    p1_json = encode_person(p1)
+    print(f'{p1_json = }')
+    print(f'{decode_person(p1_json) == p1 = }')
+    print(f'{p1_json == json.dumps(p1, separators=(",", ":")) = }')
+
+    try:
+        decode_person('{"name": "Vinod", "age": "52"}')
+    except ValueError as err:
+        print(f'{err = }')
+
+    # benchmark
+    number = 100_000
+    compact = json.dumps(p1, separators=(',', ':'))
+    print(f'\ntime taken for {number:,} records (seconds):')
+    print(f"{'':20} {'encode':>10} {'decode':>10}")
+    results = [
+        ('json', lambda: json.dumps(p1, separators=(',', ':')), lambda: json.loads(compact)),
+        ('json + validate', lambda: (validate(p1, PERSON_SCHEMA), json.dumps(p1, separators=(',', ':'))),
+            lambda: validate(json.loads(compact), PERSON_SCHEMA)),
+        ('person_codec', lambda: encode_person(p1), lambda: decode_person(compact)),
+    ]
+    try:
+        import orjson   # pip install orjson
+        compact_bytes = orjson.dumps(p1)
+        results.append(('orjson', lambda: orjson.dumps(p1), lambda: orjson.loads(compact_bytes)))
+    except ImportError:
+        print('orjson is not installed; skipping it')
+
+    for name, enc, dec in results:
+        enc_time = timeit.timeit(enc, number=number)
+        dec_time = timeit.timeit(dec, number=number)
+        print(f'{name:20} {enc_time:10.4f} {dec_time:10.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+Bulk import of customers.csv exports into the customers table of ex35 (SQLite)
+or ex36 (MySQL), instead of typing them in one at a time with add_new_customer_data().
+
+    python customer_loader.py customers.csv                      # into customersdb.sqlite
+    python customer_loader.py big.csv --initial --rejects rejects.csv
+    python customer_loader.py customers.csv --mysql              # with ex36's connection settings
+    python customer_loader.py --benchmark 2000000
+
+Both export layouts work: `name` (day3) or `first_name`,`last_name` (day4); the
+id column of the file is ignored, the database assigns new ones. The file is
+read as a stream and inserted with executemany() in transactions of --batch rows.
+
+Rows that would break a constraint are not sent to the database (where one bad
+row would fail a whole executemany batch) but written to the reject file, with
+the reason: an email or phone that is already in the table or earlier in the
+file, a gender other than Male/Female, a missing name/email/phone.
+
+--initial is for loading a large file into an empty table (SQLite only):
+- journal off, synchronous off, a big page cache, exclusive locking; a crash in
+  the middle leaves a corrupt database, so only for a table that can be reloaded
+- the unique indexes on email and phone are built after the rows are in, in one
+  sorted pass, instead of being updated row by row. The table is recreated
+  without the inline UNIQUE constraints, and with unique indexes on email and
+  phone instead, which reject duplicates the same way.
+
+If the database keeps the counts of customer_stats.py, they are made again after the load.
+"""
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import unicodedata
+
+from customer_stats import suspend_stats, rebuild_stats
+
+GENDERS = {'Male', 'Female', ''}
+
+# as created by ex35
+CUSTOMERS_TABLE = """create table customers(
+        id integer primary key autoincrement,
+        name varchar(50) not null,
+        email varchar(200) not null unique,
+        phone varchar(50) not null unique,
+        gender varchar(6) check (gender in ('Male', 'Female')),
+        city varchar(100)
+        )"""
+
+TABLE_WITHOUT_UNIQUE = """create table customers(
+        id integer primary key autoincrement,
+        name varchar(50) not null,
+        email varchar(200) not null,
+        phone varchar(50) not null,
+        gender varchar(6) check (gender in ('Male', 'Female')),
+        city varchar(100)
+        )"""
+
+UNIQUE_INDEXES = ['create unique index customers_email on customers(email)',
+                  'create unique index customers_phone on customers(phone)']
+
+
+class Rejects:
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self.__file = None
+        self.__writer = None
+
+    def add(self, line, reason, row):
+        self.count += 1
+        if self.filename is None:
+            return
+        if self.__writer is None:
+            self.__file = open(self.filename, 'wt', encoding='utf-8', newline='')
+            self.__writer = csv.writer(self.__file)
+            self.__writer.writerow(['line', 'reason', 'name', 'gender', 'email', 'phone', 'city'])
+        self.__writer.writerow([line, reason, *row])
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+
+
+def mysql_key(value):
+    """
+    an email or phone as MySQL compares them: its default collations ignore case,
+    accents and trailing spaces, so 'A@x.com ' is a duplicate of 'a@x.com'
+    """
+    value = value.rstrip(' ').casefold()
+    if value.isascii():
+        return value
+    return ''.join(c for c in unicodedata.normalize('NFKD', value) if not unicodedata.combining(c))
+
+
+def read_customers(filename, rejects, emails=None, phones=None, key=None):
+    """
+    yields (name, gender, email, phone, city) tuples of the valid, not duplicate, rows of the file.
+    key, if given, makes the emails and phones what is compared (and kept in the sets)
+    """
+    emails = set() if emails is None else emails
+    phones = set() if phones is None else phones
+    with open(filename, 'rt', encoding='utf-8', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            return      # an empty file
+        column = {name: i for i, name in enumerate(header)}
+        e, g, p, c = column['email'], column['gender'], column['phone'], column['city']
+        if 'name' in column:
+            n = column['name']
+            make_name = None
+        else:
+            first, last = column['first_name'], column['last_name']
+            make_name = lambda r: f'{r[first]} {r[last]}'.strip()
+
+        add_email, add_phone = emails.add, phones.add
+        # the columns of the reject file, for a row too short to be read the usual way
+        short_row = lambda r: tuple(r[i] if i < len(r) else '' for i in (n if make_name is None else first, g, e, p, c))
+        while True:
+            try:
+                r = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as err:
+                # a malformed line (a NUL byte, a field over the size limit...); the reader goes on after it
+                rejects.add(reader.line_num, f'malformed line: {err}', ('',) * 5)
+                continue
+            if not r:
+                continue        # a blank line
+            try:
+                name = r[n].strip() if make_name is None else make_name(r)
+                email, phone, gender, city = r[e], r[p], r[g], r[c]
+            except IndexError:
+                rejects.add(reader.line_num, f'{len(r)} columns, the header has {len(header)}', short_row(r))
+                continue
+            email_key, phone_key = (email, phone) if key is None else (key(email), key(phone))
+            # the common case with as few checks as possible; the reason is worked out for rejects only
+            if name and email and phone and gender in GENDERS and email_key not in emails and phone_key not in phones:
+                add_email(email_key)
+                add_phone(phone_key)
+                yield (name, gender or None, email, phone, city)
+                continue
+
+            line = reader.line_num
+            row = (name, gender, email, phone, city)
+            if not (name and email and phone):
+                rejects.add(line, 'missing name/email/phone', row)
+            elif gender not in GENDERS:
+                rejects.add(line, 'gender must be Male or Female', row)
+            elif email_key in emails:
+                rejects.add(line, 'duplicate email', row)
+            else:
+                rejects.add(line, 'duplicate phone', row)
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_sqlite(filename, db_name='customersdb.sqlite', initial=False, batch=100_000, rejects=None):
+    rejects = rejects or Rejects(None)
+    conn = sqlite3.connect(db_name)
+    table = conn.execute("select 1 from sqlite_master where type = 'table' and name = 'customers'").fetchone()
+    count = conn.execute('select count(*) from customers').fetchone()[0] if table else 0
+
+    # the triggers that keep the counts of customer_stats would write 3 rows for every
+    # row loaded; the counts are made again at the end instead
+    stats = suspend_stats(conn)
+    try:
+        loaded = _load(conn, filename, initial, count, batch, rejects)
+    finally:
+        if stats:
+            rebuild_stats(conn)
+        conn.close()
+    return loaded
+
+
+def _load(conn, filename, initial, count, batch, rejects):
+    if initial:
+        if count:
+            raise SystemExit(f'--initial is only for an empty table; customers has {count:,} rows')
+        conn.execute('pragma journal_mode = off')
+        conn.execute('pragma synchronous = off')
+        conn.execute('pragma cache_size = -262144')         # 256 MB
+        conn.execute('pragma temp_store = memory')
+        conn.execute('pragma locking_mode = exclusive')
+        with conn:
+            conn.execute('drop table if exists customers')
+            conn.execute(TABLE_WITHOUT_UNIQUE)
+        emails, phones = set(), set()
+    else:
+        # what is in the table already counts as duplicates too
+        emails, phones = set(), set()
+        for email, phone in conn.execute('select email, phone from customers'):
+            emails.add(email)
+            phones.add(phone)
+
+    sql = 'insert into customers(name, gender, email, phone, city) values (?, ?, ?, ?, ?)'
+    loaded = 0
+    for rows in _batches(read_customers(filename, rejects, emails, phones), batch):
+        with conn:
+            conn.executemany(sql, rows)
+        loaded += len(rows)
+
+    if initial:
+        with conn:
+            for index in UNIQUE_INDEXES:
+                conn.execute(index)
+    return loaded
+
+
+def load_mysql(filename, batch=10_000, rejects=None):
+    # ex36's connection settings; mysql.connector turns executemany() of an insert
+    # into multi-row INSERT statements
+    from ex36_mysql_database_demo import get_connection
+
+    rejects = rejects or Rejects(None)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('select email, phone from customers')
+    emails, phones = set(), set()
+    for email, phone in cursor:
+        emails.add(mysql_key(email))
+        phones.add(mysql_key(phone))
+
+    # the duplicates are looked for here with what MySQL's collation considers equal, as
+    # near as can be done; the unique checks stay on for what this misses
+    sql = 'insert into customers(name, gender, email, phone, city) values (%s, %s, %s, %s, %s)'
+    loaded = 0
+    try:
+        for rows in _batches(read_customers(filename, rejects, emails, phones, key=mysql_key), batch):
+            cursor.executemany(sql, rows)
+            conn.commit()
+            loaded += len(rows)
+    finally:
+        conn.close()
+    return loaded
+
+
+def generate_csv(filename, rows, duplicates=0.001):
+    r = random.Random(1)
+    first_names = ['Stacie', 'Rachelle', 'Gunter', 'Ker', 'Kaleb', 'Cris', 'Harriott', 'Elia', 'Bengt', 'Tadd']
+    last_names = ['Grimmett', 'Morrell', 'Gytesham', 'Scrimshire', 'Petche', 'Clowney', 'Sawbridge', 'Santi']
+    cities = ['Argostólion', 'Itapetinga', 'Bolou', 'Luhačovice', 'Bobowa', 'Zhongtai', 'Daegu', 'Angoulême']
+    with open(filename, 'wt', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['id', 'first_name', 'last_name', 'email', 'gender', 'phone', 'city'])
+        for i in range(1, rows + 1):
+            n = r.randrange(i) if r.random() < duplicates else i     # some repeated emails
+            writer.writerow([i, r.choice(first_names), r.choice(last_names), f'customer{n}@xmpl.com',
+                             r.choice(('Male', 'Female')), f'+91 {i:010}', r.choice(cities)])
+
+
+def benchmark(rows):
+    directory = tempfile.mkdtemp()
+    csv_file = os.path.join(directory, 'customers.csv')
+    generate_csv(csv_file, rows)
+    print(f'{rows:,} rows in {csv_file} ({os.path.getsize(csv_file) / 1e6:.0f} MB)')
+
+    def run(label, initial):
+        db_name = os.path.join(directory, f'{label}.sqlite')
+        conn = sqlite3.connect(db_name)
+        conn.execute(CUSTOMERS_TABLE)
+        conn.close()
+        rejects = Rejects(os.path.join(directory, f'{label}-rejects.csv'))
+        start = time.perf_counter()
+        loaded = load_sqlite(csv_file, db_name, initial=initial, rejects=rejects)
+        elapsed = time.perf_counter() - start
+        rejects.close()
+        print(f'{label:26} {elapsed:8.2f} s {loaded / elapsed:12,.0f} rows/s  {loaded:,} loaded, {rejects.count:,} rejected')
+
+    start = time.perf_counter()
+    for _ in read_customers(csv_file, Rejects(None)):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f'{"reading/checking only":26} {elapsed:8.2f} s {rows / elapsed:12,.0f} rows/s')
+    run('executemany', initial=False)
+    run('executemany --initial', initial=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load customers from a CSV file')
+    parser.add_argument('csv', nargs='?', help='e.g. customers.csv')
+    parser.add_argument('--db', default='customersdb.sqlite', help='the SQLite database (default: %(default)s)')
+    parser.add_argument('--mysql', action='store_true', help="load into MySQL (ex36's settings) instead")
+    parser.add_argument('--initial', action='store_true', help='fast initial load into an empty SQLite table')
+    parser.add_argument('--batch', type=int, default=100_000, help='rows per transaction')
+    parser.add_argument('--rejects', default='rejects.csv', help='where the rejected rows go (default: %(default)s)')
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', help='load a generated file of this many rows')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+    if args.csv is None:
+        parser.error('the csv file is required')
+
+    rejects = Rejects(args.rejects)
+    start = time.perf_counter()
+    if args.mysql:
+        loaded = load_mysql(args.csv, args.batch, rejects)
+    else:
+        loaded = load_sqlite(args.csv, args.db, args.initial, args.batch, rejects)
+    rejects.close()
+    elapsed = time.perf_counter() - start
+    print(f'{loaded:,} customers loaded in {elapsed:.2f} s ({loaded / elapsed:,.0f} rows/s)')
+    if rejects.count:
+        print(f'{rejects.count:,} rows rejected, see {args.rejects}')
+
+
+if __name__ == '__main__':
+    main()
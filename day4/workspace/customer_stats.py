@@ -0,0 +1,230 @@
+"""
+Counts of the customers of ex35 by city and by gender, kept up to date by triggers,
+so that they are read from a small table instead of counted with a full scan
+(select city, count(*) from customers group by city) every time.
+
+    python customer_stats.py                    # all the counts
+    python customer_stats.py --city Bangalore   # one count, a primary key lookup
+    python customer_stats.py --check            # compare with what group by counts
+    python customer_stats.py --rebuild          # count again, from the customers table
+    python customer_stats.py --benchmark 1000000
+
+customer_counts has one row per (dimension, value): ('all', '') is the number of
+customers, ('city', 'Bangalore') and ('gender', 'Female') the others; a NULL city
+or gender is counted under ''. The triggers on customers add and subtract 1 in the
+same transaction as the insert, update or delete, so every program that writes to
+the table (ex35, customer_loader, the sqlite3 shell) keeps the counts right.
+
+They can drift only when the customers table is changed without the triggers:
+rows written before init_stats() was run, a table dropped and created again
+(customer_loader --initial; dropping a table drops its triggers), or a database
+restored from elsewhere. --check shows the difference, --rebuild fixes it.
+
+The triggers make inserts about 3 times slower (three more rows written per customer),
+so customer_loader drops them for a bulk load and counts everything once at the end.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+STATS_TABLE = """create table if not exists customer_counts(
+        dimension varchar(10) not null,
+        value varchar(100) not null,
+        count integer not null,
+        primary key (dimension, value)
+        ) without rowid"""
+
+
+def _add(dimension, value, delta):
+    # the row is created by the first customer and deleted with the last one
+    if delta > 0:
+        return f"""insert into customer_counts values ('{dimension}', coalesce({value}, ''), 1)
+                on conflict (dimension, value) do update set count = count + 1;"""
+    return f"""update customer_counts set count = count - 1
+                where dimension = '{dimension}' and value = coalesce({value}, '');
+            delete from customer_counts
+                where dimension = '{dimension}' and value = coalesce({value}, '') and count <= 0;"""
+
+
+STATS_TRIGGERS = [
+    f"""create trigger if not exists customer_counts_insert after insert on customers begin
+            {_add('all', "''", 1)}
+            {_add('city', 'new.city', 1)}
+            {_add('gender', 'new.gender', 1)}
+        end""",
+    f"""create trigger if not exists customer_counts_delete after delete on customers begin
+            {_add('all', "''", -1)}
+            {_add('city', 'old.city', -1)}
+            {_add('gender', 'old.gender', -1)}
+        end""",
+    f"""create trigger if not exists customer_counts_city after update of city on customers
+        when old.city is not new.city begin
+            {_add('city', 'old.city', -1)}
+            {_add('city', 'new.city', 1)}
+        end""",
+    f"""create trigger if not exists customer_counts_gender after update of gender on customers
+        when old.gender is not new.gender begin
+            {_add('gender', 'old.gender', -1)}
+            {_add('gender', 'new.gender', 1)}
+        end""",
+]
+
+TRIGGER_NAMES = ['customer_counts_insert', 'customer_counts_delete', 'customer_counts_city', 'customer_counts_gender']
+
+COUNT_SQL = """select 'all', '', count(*) from customers
+        union all
+        select 'city', coalesce(city, ''), count(*) from customers group by 2
+        union all
+        select 'gender', coalesce(gender, ''), count(*) from customers group by 2"""
+
+
+def _install(conn, rebuild):
+    conn.execute('begin immediate')     # no writes to customers in between
+    try:
+        new = conn.execute("select 1 from sqlite_master where type = 'table' and name = 'customer_counts'").fetchone() is None
+        conn.execute(STATS_TABLE)
+        for trigger in STATS_TRIGGERS:
+            conn.execute(trigger)
+        if new or rebuild:
+            conn.execute('delete from customer_counts')
+            conn.execute(f'insert into customer_counts {COUNT_SQL}')
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def init_stats(conn):
+    """creates the table and the triggers if they are not there; counts the customers if the table is new"""
+    _install(conn, rebuild=False)
+
+
+def rebuild_stats(conn):
+    """counts all the customers again (one scan of the table), and creates the triggers if they are missing"""
+    _install(conn, rebuild=True)
+
+
+def suspend_stats(conn):
+    """drops the triggers, for a bulk load, if there are counts kept; rebuild_stats() afterwards. True if there are"""
+    with conn:
+        if conn.execute("select 1 from sqlite_master where type = 'table' and name = 'customer_counts'").fetchone() is None:
+            return False
+        for name in TRIGGER_NAMES:
+            conn.execute(f'drop trigger if exists {name}')
+    return True
+
+
+def check_stats(conn):
+    """[(dimension, value, kept count, actual count)] of the counts that are wrong"""
+    kept = {(d, v): c for d, v, c in conn.execute('select dimension, value, count from customer_counts')}
+    actual = {(d, v): c for d, v, c in conn.execute(COUNT_SQL) if c}
+    return sorted((d, v, kept.get((d, v), 0), actual.get((d, v), 0))
+                  for d, v in kept.keys() | actual.keys() if kept.get((d, v), 0) != actual.get((d, v), 0))
+
+
+def get_stats(conn):
+    """{'total': n, 'city': {city: n}, 'gender': {gender: n}}"""
+    stats = {'total': 0, 'city': {}, 'gender': {}}
+    for dimension, value, count in conn.execute('select dimension, value, count from customer_counts'):
+        if dimension == 'all':
+            stats['total'] = count
+        else:
+            stats[dimension][value] = count
+    return stats
+
+
+def get_count(conn, dimension, value):
+    row = conn.execute('select count from customer_counts where dimension = ? and value = ?',
+                       (dimension, value)).fetchone()
+    return row[0] if row else 0
+
+
+def print_stats(stats):
+    print(f'{stats["total"]} customers')
+    for dimension in ('gender', 'city'):
+        print('-' * 40)
+        print(f'{dimension:30} {"count":>9}')
+        print('-' * 40)
+        for value, count in sorted(stats[dimension].items(), key=lambda vc: (-vc[1], vc[0])):
+            print(f'{value or "(none)":30} {count:9}')
+    print('-' * 40)
+
+
+def benchmark(rows):
+    from customer_loader import CUSTOMERS_TABLE
+    directory = tempfile.mkdtemp()
+    cities = [f'City {i}' for i in range(500)]
+
+    def insert(label, stats):
+        conn = sqlite3.connect(os.path.join(directory, f'{label}.sqlite'))
+        conn.execute(CUSTOMERS_TABLE)
+        if stats:
+            init_stats(conn)
+        data = ((f'Customer {i}', f'customer{i}@xmpl.com', f'+91 {i:010}', ('Male', 'Female')[i % 2],
+                 cities[i * 7919 % len(cities)]) for i in range(rows))
+        start = time.perf_counter()
+        with conn:
+            conn.executemany('insert into customers(name, email, phone, gender, city) values (?, ?, ?, ?, ?)', data)
+        elapsed = time.perf_counter() - start
+        print(f'insert {rows:,} rows, {label:24} {elapsed:8.2f} s {rows / elapsed:12,.0f} rows/s')
+        return conn
+
+    insert('without the triggers', False).close()
+    conn = insert('with the triggers', True)
+
+    def timed(label, f, runs):
+        start = time.perf_counter()
+        for _ in range(runs):
+            result = f()
+        elapsed = (time.perf_counter() - start) / runs
+        print(f'{label:48} {elapsed * 1000:10.3f} ms')
+        return result
+
+    sql = 'select count(*) from customers where city = ?'
+    grouped = timed('count by city and gender: group by (full scan)', lambda: list(conn.execute(COUNT_SQL)), 3)
+    timed('count by city and gender: customer_counts', lambda: get_stats(conn), 100)
+    timed('count of one city: where city = ? (full scan)', lambda: conn.execute(sql, ('City 7',)).fetchone(), 3)
+    timed('count of one city: customer_counts', lambda: get_count(conn, 'city', 'City 7'), 1000)
+    timed('rebuild_stats', lambda: rebuild_stats(conn), 3)
+    assert sorted(grouped) == sorted(conn.execute('select * from customer_counts')) and not check_stats(conn)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Customer counts by city and gender')
+    parser.add_argument('--db', default='customersdb.sqlite', help='the SQLite database (default: %(default)s)')
+    parser.add_argument('--city', help='the count of one city')
+    parser.add_argument('--gender', help='the count of one gender')
+    parser.add_argument('--check', action='store_true', help='compare the counts with the customers table')
+    parser.add_argument('--rebuild', action='store_true', help='count the customers again')
+    parser.add_argument('--benchmark', type=int, metavar='ROWS', help='group by against the counts, on this many rows')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+
+    conn = sqlite3.connect(args.db)
+    init_stats(conn)
+    if args.rebuild:
+        wrong = check_stats(conn)
+        rebuild_stats(conn)
+        print(f'counts rebuilt, {len(wrong)} of them were wrong')
+    elif args.check:
+        wrong = check_stats(conn)
+        for dimension, value, kept, actual in wrong:
+            print(f'{dimension:8} {value or "(none)":30} kept {kept:9} actual {actual:9}')
+        print('the counts are right' if not wrong else f'{len(wrong)} counts are wrong, run with --rebuild')
+    elif args.city is not None:
+        print(get_count(conn, 'city', args.city))
+    elif args.gender is not None:
+        print(get_count(conn, 'gender', args.gender))
+    else:
+        print_stats(get_stats(conn))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+"""
+Parsing of whole columns of dates (birth dates, signup times...) in the formats of
+ex34, e.g. datetime.strptime(user_dob, '%d/%m/%Y'), without paying what strptime
+costs per call: it looks the format up, runs a generic regex and then a long if/elif
+over the matched directives, every time.
+
+    parse = compile_format('%d/%m/%Y')          # once
+    parse('20/01/1974')                         # datetime(1974, 1, 20, 0, 0), as strptime
+
+    DateParser('%d/%m/%Y').parse_all(values)    # the same, remembering the strings seen
+    dob = to_datetime64(values, '%d/%m/%Y')     # a numpy datetime64[D] array
+    ages(dob), days_between(dob, signup)        # int64 arrays
+
+- compile_format() builds the regex of the format once, the same one strptime uses,
+  and generates a function that converts just the groups of that format. Formats
+  with directives other than %d %m %Y %y %H %M %S %f are left to strptime.
+- DateParser remembers the result for each string: in a column of birth dates there
+  are a few tens of thousands of distinct values for millions of rows.
+- to_datetime64() works on the characters of the whole column with numpy for the
+  fixed width formats (%d/%m/%Y, %Y-%m-%d %H:%M:%S...): the rows in that exact
+  layout, with valid dates, are converted in a few array operations, and the rest
+  (no zero padding, bad dates...) go through DateParser, so the result and the
+  errors are those of strptime.
+- format_column() is the same for strftime.
+
+    python date_parser.py --rows 10000000     # checked against strptime, then timed
+"""
+import argparse
+import random
+import re
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np     # pip install numpy
+
+# the patterns of _strptime.TimeRE, for the directives converted here
+PATTERNS = {
+    'd': r"(?P<d>3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])",
+    'f': r"(?P<f>[0-9]{1,6})",
+    'H': r"(?P<H>2[0-3]|[0-1]\d|\d)",
+    'm': r"(?P<m>1[0-2]|0[1-9]|[1-9])",
+    'M': r"(?P<M>[0-5]\d|\d)",
+    'S': r"(?P<S>6[0-1]|[0-5]\d|\d)",
+    'y': r"(?P<y>\d\d)",
+    'Y': r"(?P<Y>\d\d\d\d)",
+    '%': '%',
+}
+
+CONVERSIONS = {
+    'd': 'day = int(d)',
+    'f': "microsecond = int(f + '0' * (6 - len(f)))",
+    'H': 'hour = int(H)',
+    'm': 'month = int(m)',
+    'M': 'minute = int(M)',
+    'S': 'second = int(S)',
+    'y': 'year = int(y)\n    year += 2000 if year <= 68 else 1900',
+    'Y': 'year = int(Y)',
+}
+
+# the zero padded directives, with their width, that to_datetime64() and format_column() do with numpy
+FIXED_WIDTHS = {'d': 2, 'm': 2, 'Y': 4, 'H': 2, 'M': 2, 'S': 2}
+
+CHUNK_SIZE = 1_000_000
+
+
+def _directives(fmt):
+    """splits the format into literal text and directives: ['', 'd', '/', 'm', '/', 'Y', '']"""
+    parts = re.split(r'%(.)', fmt)
+    if fmt.count('%') != len(parts) // 2 + fmt.count('%%'):
+        raise ValueError(f"stray % in format '{fmt}'")
+    return parts
+
+
+def _pattern(fmt):
+    # as TimeRE.pattern() does it: regex characters escaped, whitespace matching any whitespace
+    parts = _directives(fmt)
+    pattern = ''
+    for i, part in enumerate(parts):
+        if i % 2:
+            pattern += PATTERNS[part]
+        else:
+            pattern += re.sub(r'\s+', r'\\s+', re.sub(r'([\\.^$*+?\(\){}\[\]|])', r'\\\1', part))
+    return pattern
+
+
+def compile_format(fmt):
+    """a function parsing strings in the format `fmt` into datetimes, exactly as datetime.strptime(s, fmt)"""
+    try:
+        regex = re.compile(_pattern(fmt), re.IGNORECASE)
+    except (KeyError, re.error):
+        # a directive not done here (or one used twice): strptime it is
+        return lambda s: datetime.strptime(s, fmt)
+
+    groups = list(regex.groupindex)
+    lines = [f'def parse(s):',
+             f'    found = match(s)',
+             f'    if found is None:',
+             f'        raise ValueError("time data %r does not match format %r" % (s, {fmt!r}))',
+             f'    if found.end() != len(s):',
+             f'        raise ValueError("unconverted data remains: %s" % s[found.end():])',
+             f'    year, month, day, hour, minute, second, microsecond = 1900, 1, 1, 0, 0, 0, 0']
+    if groups:
+        lines.append(f'    {", ".join(groups)}, = found.groups()')
+    lines += [f'    {CONVERSIONS[g]}' for g in groups]
+    lines.append(f'    return datetime(year, month, day, hour, minute, second, microsecond)')
+    namespace = {'match': regex.match, 'datetime': datetime}
+    exec('\n'.join(lines), namespace)
+    return namespace['parse']
+
+
+class DateParser:
+    """compile_format(fmt), remembering the datetime of each string (up to cache_size of them)"""
+    def __init__(self, fmt, cache_size=1_000_000):
+        self.fmt = fmt
+        self.parse = compile_format(fmt)
+        self.cache_size = cache_size
+        self.__cache = {}
+
+    def __call__(self, s):
+        try:
+            return self.__cache[s]
+        except KeyError:
+            pass
+        if len(self.__cache) >= self.cache_size:
+            self.__cache.clear()
+        result = self.__cache[s] = self.parse(s)
+        return result
+
+    def parse_all(self, values):
+        cache, parse = self.__cache, self.parse
+        result = []
+        append = result.append
+        for s in values:
+            d = cache.get(s)
+            if d is None:
+                if len(cache) >= self.cache_size:
+                    cache.clear()
+                d = cache[s] = parse(s)
+            append(d)
+        return result
+
+
+def _fixed_layout(fmt):
+    """[(directive, offset, width)], the literal characters and the width, if fmt is all fixed width"""
+    parts = _directives(fmt)
+    fields, literals, offset = [], [], 0
+    for i, part in enumerate(parts):
+        if i % 2:
+            if part not in FIXED_WIDTHS or part in (f for f, _, _ in fields):
+                return None
+            fields.append((part, offset, FIXED_WIDTHS[part]))
+            offset += FIXED_WIDTHS[part]
+        else:
+            # exactly these characters; anything else strptime would take (other whitespace,
+            # other case) is left to DateParser
+            literals += [(offset + j, ord(c)) for j, c in enumerate(part)]
+            offset += len(part)
+    return fields, literals, offset
+
+
+def _unit(fmt):
+    directives = set(_directives(fmt)[1::2])
+    return 'us' if 'f' in directives else 's' if directives & {'H', 'M', 'S'} else 'D'
+
+
+def _fixed_chunk(values, layout, unit):
+    """datetime64 values of the rows in exactly the layout, and the mask of those rows"""
+    fields, literals, width = layout
+    chars = np.asarray(values, dtype=str)
+    n = len(chars)
+    if n == 0 or chars.itemsize // 4 < width:
+        return None, np.zeros(n, dtype=bool)
+    # the UCS4 code points of every string, one row each, zero padded
+    codes = chars.view(np.uint32).reshape(n, -1)
+    ok = np.ones(n, dtype=bool)
+    if codes.shape[1] > width:
+        ok &= codes[:, width] == 0
+    for column, code in literals:
+        ok &= codes[:, column] == code
+
+    numbers = {'Y': 1900, 'm': 1, 'd': 1, 'H': 0, 'M': 0, 'S': 0}
+    digits = codes[:, :width] - np.uint32(48)       # wraps around for the code points below '0'
+    for directive, offset, size in fields:
+        value = np.zeros(n, dtype=np.uint32)
+        for column in range(offset, offset + size):
+            ok &= digits[:, column] <= 9
+            value = value * 10 + digits[:, column]
+        numbers[directive] = value.astype(np.int64)
+    year, month, day = numbers['Y'], numbers['m'], numbers['d']
+    hour, minute, second = numbers['H'], numbers['M'], numbers['S']
+    ok &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    ok &= (hour <= 23) & (minute <= 59) & (second <= 59)
+
+    # the rows that are not ok are made 1970-01-01 for the arithmetic, and are done elsewhere
+    months = (np.where(ok, year, 1970) - 1970) * 12 + np.where(ok, month, 1) - 1
+    months = months.astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (np.where(ok, day, 1) - 1).astype('timedelta64[D]')
+    ok &= days.astype('datetime64[M]') == months         # no 31/04 or 29/02 of other years
+    if unit == 'D':
+        return days, ok
+    seconds = np.where(ok, hour * 3600 + minute * 60 + second, 0)
+    return days.astype(f'datetime64[{unit}]') + seconds.astype('timedelta64[s]'), ok
+
+
+def to_datetime64(values, fmt, errors='raise', parser=None):
+    """
+    the strings of `values` parsed as by strptime, into a datetime64 array (of days, seconds or
+    microseconds, whatever the format has); errors='coerce' makes the unparseable ones NaT
+    """
+    if errors not in ('raise', 'coerce'):
+        raise ValueError("errors must be 'raise' or 'coerce'")
+    unit = _unit(fmt)
+    layout = _fixed_layout(fmt)
+    parser = parser or DateParser(fmt)
+    result = np.empty(len(values), dtype=f'datetime64[{unit}]')
+
+    for start in range(0, len(values), CHUNK_SIZE):
+        chunk = values[start:start + CHUNK_SIZE]
+        if layout is not None:
+            converted, ok = _fixed_chunk(chunk, layout, unit)
+            if converted is not None:
+                result[start:start + len(chunk)] = converted
+            rest = np.flatnonzero(~ok)
+        else:
+            rest = range(len(chunk))
+        for i in rest:
+            try:
+                value = np.datetime64(parser(chunk[i]), unit)
+            except ValueError:
+                if errors == 'raise':
+                    raise
+                value = np.datetime64('NaT', unit)
+            result[start + i] = value
+    return result
+
+
+def format_column(dates, fmt):
+    """the datetime64 values of `dates` formatted as by strftime(fmt) (NaT gives ''), as a numpy str array"""
+    dates = np.asarray(dates)
+    layout = _fixed_layout(fmt)
+    if layout is None:
+        return np.array(['' if d is None else d.strftime(fmt) for d in dates.astype(object)])
+
+    fields, literals, width = layout
+    year, month, day = _split(dates)
+    seconds = (dates - dates.astype('datetime64[D]')).astype('timedelta64[s]').astype(np.int64)
+    numbers = {'Y': year, 'm': month, 'd': day, 'H': seconds // 3600, 'M': seconds // 60 % 60, 'S': seconds % 60}
+    codes = np.empty((len(dates), width), dtype=np.uint32)
+    for column, code in literals:
+        codes[:, column] = code
+    for directive, offset, size in fields:
+        for k in range(size):
+            codes[:, offset + k] = numbers[directive] // 10 ** (size - 1 - k) % 10 + 48
+    result = codes.view(f'<U{width}').ravel() if len(dates) else np.array([], dtype=f'<U{width}')
+
+    # strftime does not zero pad years before 1000; those few are left to it
+    odd = np.flatnonzero(np.isnat(dates) | (year < 1000) | (year > 9999))
+    if len(odd):
+        result = result.astype(f'<U{max(width, 16)}')
+        for i, d in zip(odd, dates[odd].astype(object)):
+            result[i] = '' if d is None else d.strftime(fmt)
+    return result
+
+
+def _split(dates):
+    """year, month and day of a datetime64 array, as int64 arrays"""
+    days = np.asarray(dates).astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    years = days.astype('datetime64[Y]')
+    return (years.astype(np.int64) + 1970,
+            (months - years.astype('datetime64[M]')).astype(np.int64) + 1,
+            (days - months.astype('datetime64[D]')).astype(np.int64) + 1)
+
+
+def ages(birth_dates, on=None):
+    """completed years on the date `on` (default: today) of everyone born on birth_dates (NaT: -1)"""
+    on = np.datetime64(date.today() if on is None else on, 'D')
+    year, month, day = _split(birth_dates)
+    on_year, on_month, on_day = (int(v) for v in _split(on))
+    result = on_year - year - ((on_month < month) | ((on_month == month) & (on_day < day)))
+    return np.where(np.isnat(birth_dates), -1, result)
+
+
+def days_between(start, end):
+    """whole days from the dates of `start` to the dates of `end`, as (end.date() - start.date()).days"""
+    return (np.asarray(end).astype('datetime64[D]') - np.asarray(start).astype('datetime64[D]')).astype(np.int64)
+
+
+def check(values, fmt):
+    """fails if anything here gives a different datetime, or error, from strptime for these strings"""
+    def by_strptime(s):
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            return None
+
+    def by(fn, s):
+        try:
+            return fn(s)
+        except ValueError:
+            return None
+
+    expected = [by_strptime(s) for s in values]
+    parse = compile_format(fmt)
+    assert [by(parse, s) for s in values] == expected, fmt
+    parser = DateParser(fmt)
+    assert [by(parser, s) for s in values] == expected, fmt
+    unit = _unit(fmt)
+    column = to_datetime64(values, fmt, errors='coerce')
+    assert column.tolist() == [None if d is None else np.datetime64(d, unit).item() for d in expected], fmt
+    parsed = column[~np.isnat(column)]
+    assert format_column(parsed, fmt).tolist() == [d.strftime(fmt) for d in parsed.astype(object)], fmt
+
+
+def generate(rows, seed=1):
+    """birth dates (some 26,000 distinct ones, as people have) and signup times (all different)"""
+    r = random.Random(seed)
+    first, last = date(1940, 1, 1).toordinal(), date(2010, 12, 31).toordinal()
+    birth_days = [date.fromordinal(n).strftime('%d/%m/%Y') for n in range(first, last + 1)]
+    signup_start = datetime(2015, 1, 1)
+    birth_dates = [r.choice(birth_days) for _ in range(rows)]
+    signups = [(signup_start + timedelta(seconds=r.randrange(300_000_000))).strftime('%Y-%m-%d %H:%M:%S')
+               for _ in range(rows)]
+    return birth_dates, signups
+
+
+def timed(label, rows, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f'{label:34} {elapsed:8.2f} s {rows / elapsed:14,.0f} values/s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk date parsing, checked against strptime and timed')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--strptime-rows', type=int, default=1_000_000,
+                        help='strptime is timed on this many rows only, it takes too long for all')
+    args = parser.parse_args()
+
+    odd = ['1/2/2020', ' 1/02/2020', '31/04/2020', '29/02/2019', '29/02/2020', '00/01/2020', '01/13/2020',
+           '01/01/0000', '01/01/0999', '01/01/2020 ', '01/01/20201', '01-01-2020', '', '１２/01/2020', '12/01/20x0',
+           '2020-01-05 10:30:00', '2020-1-5 9:05:07', '2020-01-05 24:00:00', '2020-01-05 10:60:00',
+           '2020-01-05 10:30:61', '2020-01-05  10:30:00', '2020-01-05\t10:30:00', '2020-01-05T10:30:00']
+    birth_dates, signups = generate(100_000, seed=2)
+    for fmt, values in [('%d/%m/%Y', birth_dates + odd), ('%Y-%m-%d %H:%M:%S', signups + odd),
+                        ('%d %b %Y', ['20 Jan 1974', '20 jan 1974', '20 Foo 1974'] + odd),
+                        ('%y%m%d', ['740120', '690101', '680101']), ('%Y-%m-%dT%H:%M:%S.%f', ['2020-01-05T10:30:00.5'])]:
+        check(values, fmt)
+    dob = to_datetime64(birth_dates, '%d/%m/%Y')
+    today = date.today()
+    expected = [today.year - d.year - ((today.month, today.day) < (d.month, d.day))
+                for d in (datetime.strptime(s, '%d/%m/%Y') for s in birth_dates)]
+    assert ages(dob, today).tolist() == expected
+    signup = to_datetime64(signups, '%Y-%m-%d %H:%M:%S')
+    assert days_between(dob, signup).tolist() == [(s.date() - d).days
+                                                  for d, s in zip(dob.astype(object), signup.astype(object))]
+    print('same results as strptime/strftime: ok')
+
+    print(f'{args.rows:,} rows')
+    birth_dates, signups = generate(args.rows)
+    sample = min(args.strptime_rows, args.rows)
+    for fmt, values in [('%d/%m/%Y', birth_dates), ('%Y-%m-%d %H:%M:%S', signups)]:
+        print(f'{fmt} ({len(set(values[:sample])):,} distinct in the first {sample:,})')
+        timed(f'strptime ({sample:,})', sample, lambda: [datetime.strptime(s, fmt) for s in values[:sample]])
+        parse = compile_format(fmt)
+        timed(f'compile_format ({sample:,})', sample, lambda: [parse(s) for s in values[:sample]])
+        timed('DateParser.parse_all', args.rows, DateParser(fmt).parse_all, values)
+        column = timed('to_datetime64', args.rows, to_datetime64, values, fmt)
+        timed('format_column', args.rows, format_column, column, fmt)
+
+    dob = to_datetime64(birth_dates, '%d/%m/%Y')
+    signup = to_datetime64(signups, '%Y-%m-%d %H:%M:%S')
+    timed('ages', args.rows, ages, dob)
+    timed('days_between', args.rows, days_between, dob, signup)
+
+
+if __name__ == '__main__':
+    main()
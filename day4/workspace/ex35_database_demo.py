@@ -1,4 +1,6 @@
 from sqlite3 import connect, DatabaseError
+from customer_loader import Rejects, load_sqlite
+from customer_stats import init_stats, get_stats, get_count, print_stats
 
 db_name = 'customersdb.sqlite'
 
@@ -16,6 +18,7 @@ def create_db_table():
         cursor = conn.cursor()
         try:
             cursor.execute(sql)
+            init_stats(conn)
             print('DB/table created successfully')
         except DatabaseError as err:
             print(str(err))
@@ -83,6 +86,18 @@ def search_by_city_gender():
         print_customers_as_table(rows)
 
 
+def customer_counts():
+    # from the counts kept by the triggers of customer_stats, not by counting the customers
+    city_gender = input('Enter city or gender (or just Enter for all): ')
+    with connect(db_name) as conn:
+        init_stats(conn)
+        if not city_gender:
+            print_stats(get_stats(conn))
+            return
+        count = get_count(conn, 'city', city_gender) + get_count(conn, 'gender', city_gender)
+        print(f'{count} customers with city or gender {city_gender}')
+
+
 def delete_customer():
     cust_id = input('Enter customer id to delete: ')
     with connect(db_name) as conn:
@@ -110,6 +125,22 @@ def delete_customer():
             print(str(err))
 
 
+def import_customers_from_csv():
+    filename = input('Enter the CSV file to import: ')
+    rejects = Rejects('rejects.csv')
+    try:
+        loaded = load_sqlite(filename, db_name, rejects=rejects)
+    except (OSError, KeyError, DatabaseError) as err:
+        print("Couldn't import the customers!")
+        print(str(err))
+        return
+    finally:
+        rejects.close()
+    print(f'{loaded} customers imported')
+    if rejects.count:
+        print(f'{rejects.count} rows rejected, see rejects.csv')
+
+
 def print_customers_as_table(customers):
 
     if len(customers) == 0:
@@ -134,6 +165,8 @@ def menu():
     print('5. Search by gender/city')
     print('6. Update customer data')    
     print('7. Delete customer data')
+    print('8. Import customers from a CSV file')
+    print('9. Customer counts by city/gender')
     print()
     try:
         return int(input('Enter your choice: '))
@@ -145,7 +178,7 @@ def main():
     while True:
         choice = menu()
 
-        if choice not in range(0, 8):
+        if choice not in range(0, 10):
             print('Invalid choice. Please try again.')
             continue
 
@@ -168,6 +201,10 @@ def main():
             pass
         elif choice == 7:
             delete_customer()
+        elif choice == 8:
+            import_customers_from_csv()
+        elif choice == 9:
+            customer_counts()
 
 
 if __name__ == '__main__':
@@ -1,30 +1,68 @@
-class Squares:
-    def __init__(self, max):
-        self.max = max
-        self.n = 0
+class SquaresIterator:
+    # the cursor lives here, so every loop over Squares gets its own
+    def __init__(self, numbers):
+        self.numbers = iter(numbers)
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.n < self.max:
-            result = self.n ** 2
-            self.n += 1
-            return result
-        else:
-            raise StopIteration
-        
+        # raises StopIteration when the numbers run out
+        return next(self.numbers) ** 2
+
+
+class Squares:
+    # an iterable (not an iterator): can be looped over any number of times,
+    # even from multiple threads at once, since it does not keep any state
+    def __init__(self, max):
+        self.numbers = range(max)
+
+    @classmethod
+    def _of(cls, numbers):
+        sq = cls.__new__(cls)
+        sq.numbers = numbers
+        return sq
+
+    def __iter__(self):
+        return SquaresIterator(self.numbers)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, index):
+        # a slice of a range is a range, so sq[10:100:2] is computed without a list
+        if isinstance(index, slice):
+            return Squares._of(self.numbers[index])
+        return self.numbers[index] ** 2
+
+    def __reversed__(self):
+        return SquaresIterator(reversed(self.numbers))
+
+    def to_array(self):
+        # all the squares at once, computed by numpy in a single vectorized pass
+        import numpy as np     # pip install numpy
+        r = self.numbers
+        if r and max(abs(r[0]), abs(r[-1])) ** 2 > np.iinfo(np.int64).max:
+            # int64 would overflow silently (from 3037000500 on); python ints, one at a time
+            return np.fromiter(self, dtype=object, count=len(r))
+        nums = np.arange(r.start, r.stop, r.step, dtype=np.int64)
+        return nums * nums
+
 
 def main():
     sq = Squares(15)
-    # print(next(sq))
-    # print(next(sq))
-    # print(next(sq))
-    # print(next(sq))
-    # print(next(sq))
-    # print(next(sq))
+    # it = iter(sq)
+    # print(next(it))
+    # print(next(it))
+    # print(next(it))
     for s in sq:
         print(s)
 
+    # can be iterated again
+    print(f'{list(sq) = }')
+    print(f'{len(sq) = }, {sq[4] = }, {sq[-1] = }')
+    print(f'{list(sq[2:10:3]) = }')
+    print(f'{list(reversed(sq)) = }')
+
 if __name__ == '__main__':
     main()
@@ -1,39 +1,42 @@
 class Employee:
+    # no per-object __dict__; saves memory when there are lots of employees
+    __slots__ = ('name', 'salary', 'department', 'email')
+
+    # the same for every employee, so kept at the class level
+    fields = ('name', 'salary', 'email', 'department')
+
     def __init__(self, **kwargs):
         self.name = kwargs.get('name')
         self.salary = kwargs.get('salary')
         self.department = kwargs.get('department')
         self.email = kwargs.get('email')
 
-        self.fields = ['name', 'salary', 'email', 'department']
-        self.n = 0
-
     def __str__(self):
         return f'Employee({self.name!r}, {self.salary!r}, {self.department!r}, {self.email!r})'
     
+    # a generator function; every call returns a fresh iterator, so an employee
+    # can be looped over again and again (and from many threads at the same time)
     def __iter__(self):
-        return self
-    
-    def __next__(self):
-        if self.n < len(self.fields):
-            field = self.fields[self.n]
-            self.n += 1
-            return self.__dict__.get(field)
-        raise StopIteration
+        for field in self.fields:
+            yield getattr(self, field)
 
 def main():
     e1 = Employee(name='Ramesh', email='ramesh@xmpl.com', salary=45000, department='ASDF')
     print(e1)
 
-    # print(next(e1))
-    # print(next(e1))
-    # print(next(e1))
-    # print(next(e1))
-    # print(next(e1))
+    # it = iter(e1)
+    # print(next(it))
+    # print(next(it))
+    # print(next(it))
+    # print(next(it))
+    # print(next(it))
 
     for info in e1:
         print(info)
 
+    # can be iterated again
+    print(f'{list(e1) = }')
+
 
 if __name__ == '__main__':
     main()
@@ -1,5 +1,6 @@
 import time
 from datetime import datetime
+from perf_events import timed
 
 
 # decorator for checking method execution time
@@ -19,7 +20,8 @@ def check_exec_time(log_to):
         return wrapper
     return decorator
 
-@check_exec_time(log_to='performance.log')
+# structured timing events, summarized with: python perf_events.py performance.jsonl
+@timed(log_to='performance.jsonl')
 def is_prime(num: int) -> bool:
     if num < 0:
         return False
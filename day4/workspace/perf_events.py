@@ -0,0 +1,218 @@
+"""
+Structured timing events, as a replacement for the free text lines that
+check_exec_time() (ex42) appends to performance.log.
+
+    @timed(log_to='performance.jsonl')
+    def is_prime(num): ...
+
+    with timing('load customers', log_to='performance.sqlite'):
+        ...
+
+Every call produces an event (time, function, fingerprint of the arguments,
+duration in nanoseconds, thread name). The decorated function only appends the
+event to an in-memory ring buffer (a deque, whose append is atomic, so no lock
+is taken on the hot path); a background thread drains the buffer every
+`flush_interval` seconds and writes the events in batches to a JSON-lines file
+(.jsonl) or an SQLite database (.sqlite/.db). If the writer falls behind by more
+than `capacity` events, the oldest ones are dropped rather than slowing down the
+application.
+
+Summarize a log (the old free text performance.log works too):
+
+    python perf_events.py performance.jsonl --top 10
+"""
+import argparse
+import atexit
+import functools
+import hashlib
+import json
+import math
+import re
+import reprlib
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+FIELDS = ('ts_ns', 'function', 'args_fingerprint', 'duration_ns', 'thread')
+
+
+class JsonLinesWriter:
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, events):
+        with open(self.path, 'at', encoding='utf-8') as file:
+            file.writelines(json.dumps(dict(zip(FIELDS, e))) + '\n' for e in events)
+
+
+class SqliteWriter:
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+
+    def write(self, events):
+        # created on first use, i.e. in the background thread that does all the writing
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("""create table if not exists perf_events(
+                ts_ns integer, function text, args_fingerprint text, duration_ns integer, thread text)""")
+        with self.conn:
+            self.conn.executemany('insert into perf_events values (?, ?, ?, ?, ?)', events)
+
+
+class EventRecorder:
+    def __init__(self, path, capacity=100_000, flush_interval=0.5):
+        if path.endswith(('.sqlite', '.db')):
+            self.writer = SqliteWriter(path)
+        else:
+            self.writer = JsonLinesWriter(path)
+        self.buffer = deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, name=f'perf-events {path}', daemon=True)
+        self.__thread.start()
+
+    def record(self, event):
+        self.buffer.append(event)
+
+    def __run(self):
+        while not self.__stopped.wait(self.flush_interval):
+            self.drain()
+        self.drain()
+
+    def drain(self):
+        batch = []
+        try:
+            while True:
+                batch.append(self.buffer.popleft())
+        except IndexError:
+            pass
+        if batch:
+            self.writer.write(batch)
+
+    def close(self):
+        self.__stopped.set()
+        self.__thread.join()
+
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def get_recorder(path):
+    """one recorder (and background thread) per log file"""
+    with _recorders_lock:
+        if path not in _recorders:
+            _recorders[path] = EventRecorder(path)
+        return _recorders[path]
+
+
+@atexit.register
+def close_all():
+    for recorder in _recorders.values():
+        recorder.close()
+
+
+# a bounded repr: the first few items of a container, the first 100 characters of a string,
+# so that a call with a big argument does not cost a full repr() of it every time
+_repr = reprlib.Repr(maxlevel=3, maxtuple=8, maxlist=8, maxarray=8, maxdict=8, maxset=8, maxfrozenset=8,
+                     maxdeque=8, maxstring=100, maxlong=100, maxother=100)
+
+
+def fingerprint(args, kwargs):
+    """a short hash of (a bounded repr of) the arguments, to tell calls with different inputs apart"""
+    text = _repr.repr((args, sorted(kwargs.items()))) if kwargs else _repr.repr(args)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def timed(log_to='performance.jsonl', with_args=True):
+    recorder = get_recorder(log_to)
+
+    def decorator(fn):
+        name = fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                duration = time.perf_counter_ns() - start
+                recorder.record((time.time_ns(), name, fingerprint(args, kwargs) if with_args else None,
+                                 duration, threading.current_thread().name))
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timing(name, log_to='performance.jsonl'):
+    recorder = get_recorder(log_to)
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter_ns() - start
+        recorder.record((time.time_ns(), name, None, duration, threading.current_thread().name))
+
+
+# ---------- reading and summarizing the logs ----------
+
+_legacy_line = re.compile(r'^(.*?): time taken to run the function (\S+) = ([\d.]+) seconds$')
+
+
+def read_events(path):
+    """yields the events of a .jsonl/.sqlite log, or of an old free text performance.log, as dicts"""
+    if path.endswith(('.sqlite', '.db')):
+        with sqlite3.connect(path) as conn:
+            yield from (dict(zip(FIELDS, row)) for row in conn.execute(f'select {", ".join(FIELDS)} from perf_events'))
+        return
+
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if line.startswith('{'):
+                yield json.loads(line)
+            elif m := _legacy_line.match(line.strip()):
+                yield dict(ts_ns=None, function=m.group(2), args_fingerprint=None,
+                           duration_ns=round(float(m.group(3)) * 1e9), thread=None, time=m.group(1))
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(events, top=10):
+    by_function = {}
+    slowest = []
+    for e in events:
+        by_function.setdefault(e['function'], []).append(e['duration_ns'])
+        slowest.append(e)
+
+    print(f'{"function":30} {"calls":>8} {"total ms":>10} {"mean µs":>10} {"p50 µs":>10} {"p95 µs":>10} {"p99 µs":>10} {"max µs":>10}')
+    print('-' * 104)
+    for fn, durations in sorted(by_function.items(), key=lambda kv: -sum(kv[1])):
+        durations.sort()
+        us = lambda ns: f'{ns / 1000:10.1f}'
+        print(f'{fn:30} {len(durations):8} {sum(durations) / 1e6:10.2f} {us(sum(durations) / len(durations))} '
+              f'{us(percentile(durations, 50))} {us(percentile(durations, 95))} {us(percentile(durations, 99))} {us(durations[-1])}')
+
+    print(f'\ntop {top} slowest calls')
+    print('-' * 104)
+    slowest.sort(key=lambda e: -e['duration_ns'])
+    for e in slowest[:top]:
+        when = e.get('time') or (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e['ts_ns'] / 1e9)) if e['ts_ns'] else '')
+        print(f'{e["function"]:30} {e["duration_ns"] / 1000:12.1f} µs  {when:26} {e["thread"] or "":16} {e["args_fingerprint"] or ""}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize a performance log by function')
+    parser.add_argument('log', help='a .jsonl or .sqlite log written by perf_events, or an old performance.log')
+    parser.add_argument('--top', type=int, default=10, help='how many of the slowest calls to list')
+    args = parser.parse_args()
+    summarize(read_events(args.log), args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""
+Lazy, composable streams built on generators (see ex39 for the basics).
+
+    Stream(range(10)).map(lambda n: n * n).filter(lambda n: n % 2).reduce(operator.add)
+
+Every stage is a generator (or the builtin lazy map/filter), so each element flows
+through the whole pipeline before the next one is pulled from the source, and no
+intermediate list is ever created. Nothing runs until a terminal operation
+(iteration, to_list, reduce, sum, count) asks for the values.
+
+For numeric work, chunk(n, dtype=...) or Stream.arange() hand numpy arrays to the
+following stages, which can then process a whole chunk in one vectorized call;
+sum() and count() add up and count the numbers in the chunks.
+"""
+import argparse
+import operator
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from itertools import islice
+
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _array_chunks(iterable, size, dtype):
+    import numpy as np     # pip install numpy
+    it = iter(iterable)
+    while len(chunk := np.fromiter(islice(it, size), dtype=dtype)):
+        yield chunk
+
+
+def _is_array(value):
+    # a numpy array (but not a numpy scalar, whose ndim is 0), without importing numpy
+    return getattr(value, 'ndim', 0) > 0
+
+
+def _flatten(iterable):
+    for chunk in iterable:
+        yield from chunk
+
+
+def _parallel_map(fn, iterable, workers, window):
+    # keeps at most `window` tasks in flight and yields the results in the input order;
+    # unlike Executor.map(), it does not submit (and so read) the whole input up-front
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for item in iterable:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Stream:
+    def __init__(self, source):
+        """
+        source is an iterable, or a function without arguments returning one, which is
+        called again for every terminal operation. A stream over a reusable source (a
+        list, a range, a function) can be run any number of times; one over an iterator
+        or a generator object only once, as the iterator itself.
+        """
+        self.__source = source
+        self.__stages = ()
+
+    @classmethod
+    def arange(cls, start, stop=None, step=1, chunk_size=1 << 16, dtype='int64'):
+        """a stream of numpy arrays covering range(start, stop, step), chunk_size numbers each"""
+        import numpy as np     # pip install numpy
+        if stop is None:
+            start, stop = 0, start
+
+        def source():
+            span = chunk_size * step
+            for s in range(start, stop, span):
+                e = min(s + span, stop) if step > 0 else max(s + span, stop)
+                yield np.arange(s, e, step, dtype=dtype)
+
+        return cls(source)
+
+    def __then(self, stage):
+        # streams are immutable; every operation returns a new one
+        s = Stream(self.__source)
+        s.__stages = self.__stages + (stage,)
+        return s
+
+    def map(self, fn):
+        return self.__then(lambda it: map(fn, it))
+
+    def filter(self, predicate):
+        return self.__then(lambda it: filter(predicate, it))
+
+    def chunk(self, size, dtype=None):
+        """groups the elements into lists (or numpy arrays, if a dtype is given) of `size`"""
+        if dtype is None:
+            return self.__then(lambda it: _chunks(it, size))
+        return self.__then(lambda it: _array_chunks(it, size, dtype))
+
+    def flatten(self):
+        """the opposite of chunk()"""
+        return self.__then(_flatten)
+
+    def parallel_map(self, fn, workers=None, window=None):
+        """
+        like map(), but runs fn in a pool of processes. The output keeps the input order.
+        fn (and the elements) must be picklable, so use it on chunks, not single numbers.
+        """
+        workers = workers or os.cpu_count()
+        window = window or 2 * workers
+        return self.__then(lambda it: _parallel_map(fn, it, workers, window))
+
+    def __iter__(self):
+        it = iter(self.__source() if callable(self.__source) else self.__source)
+        for stage in self.__stages:
+            it = stage(it)
+        return iter(it)
+
+    # terminal operations
+
+    def to_list(self):
+        return list(self)
+
+    def reduce(self, fn, *initial):
+        return reduce(fn, self, *initial)
+
+    # numpy arrays (the chunks of arange() and chunk(dtype=...)) stand for their numbers
+
+    def sum(self):
+        return sum(v.sum().item() if _is_array(v) else v for v in self)
+
+    def count(self):
+        return sum(len(v) if _is_array(v) else 1 for v in self)
+
+
+# the pipeline used by the benchmark: odd squares, modulo 1000, added up
+def _square(n):
+    return n * n
+
+
+def _is_odd(n):
+    return n % 2
+
+
+def _mod_1000(n):
+    return n % 1000
+
+
+def _chunk_total(chunk):
+    squares = chunk * chunk
+    return int((squares[squares % 2 == 1] % 1000).sum())
+
+
+def _list_total(nums):
+    # the ex24 way: every step builds a complete list
+    squares = list(map(_square, nums))
+    odd_squares = list(filter(_is_odd, squares))
+    mods = list(map(_mod_1000, odd_squares))
+    return reduce(operator.add, mods)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare lazy streams with the list materializing style of ex24')
+    parser.add_argument('--n', type=int, default=10**8, help='how many numbers to process')
+    parser.add_argument('--list-limit', type=int, default=10**7,
+                        help='run the list style on at most this many numbers (and scale the time), to keep memory in check')
+    args = parser.parse_args()
+    n = args.n
+
+    def timed(label, fn, measured_on=n):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - start) * n / measured_on
+        note = f' (measured on {measured_on:,}, scaled)' if measured_on != n else ''
+        print(f'{label:36} {elapsed:10.2f} seconds{note}')
+        return result
+
+    print(f'sum of (odd squares % 1000) for the numbers below {n:,}')
+    list_n = min(n, args.list_limit)
+    timed('list(map(...)), list(filter(...))', lambda: _list_total(range(list_n)), list_n)
+
+    total = timed('Stream', lambda: Stream(range(n)).map(_square).filter(_is_odd).map(_mod_1000).reduce(operator.add, 0))
+    vectorized = timed('Stream.arange (numpy chunks)', lambda: Stream.arange(n, chunk_size=1 << 20).map(_chunk_total).sum())
+    parallel = timed('Stream.arange + parallel_map', lambda: Stream.arange(n, chunk_size=1 << 20).parallel_map(_chunk_total).sum())
+    print(f'{total == vectorized == parallel = }')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from ex38_iterator_demo import Squares
+from ex40_iterator_demo import Employee
+
+
+class TestSquares(unittest.TestCase):
+
+    def test_repeated_iteration(self):
+        sq = Squares(10)
+        expected = [n * n for n in range(10)]
+        self.assertEqual(expected, list(sq))
+        self.assertEqual(expected, list(sq))
+
+    def test_nested_iteration(self):
+        sq = Squares(3)
+        pairs = [(a, b) for a in sq for b in sq]
+        self.assertEqual(9, len(pairs))
+
+    def test_concurrent_iteration(self):
+        sq = Squares(10_000)
+        expected = [n * n for n in range(10_000)]
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: list(sq), range(16)))
+        for actual in results:
+            self.assertEqual(expected, actual)
+
+    def test_len_and_getitem(self):
+        sq = Squares(10**12)
+        self.assertEqual(10**12, len(sq))
+        self.assertEqual(25, sq[5])
+        self.assertEqual((10**12 - 1) ** 2, sq[-1])
+        with self.assertRaises(IndexError):
+            sq[10**12]
+
+    def test_slices(self):
+        sq = Squares(20)
+        expected = [n * n for n in range(20)]
+        for s in [slice(2, 10), slice(None, None, 3), slice(15, 2, -2), slice(-5, None)]:
+            with self.subTest(s=s):
+                self.assertEqual(expected[s], list(sq[s]))
+                self.assertEqual(len(expected[s]), len(sq[s]))
+
+    def test_reversed(self):
+        sq = Squares(10)
+        self.assertEqual([n * n for n in range(9, -1, -1)], list(reversed(sq)))
+
+    def test_to_array(self):
+        try:
+            import numpy    # noqa: F401
+        except ImportError:
+            self.skipTest('numpy is not installed')
+        sq = Squares(100)
+        self.assertEqual(list(sq), sq.to_array().tolist())
+        self.assertEqual(list(sq[10:50:7]), sq[10:50:7].to_array().tolist())
+        # beyond int64: exact python ints, not wrapped around
+        big = Squares(10**12)[-2:]
+        self.assertEqual(list(big), big.to_array().tolist())
+
+
+class TestEmployeeIteration(unittest.TestCase):
+
+    def setUp(self):
+        self.emp = Employee(name='Ramesh', email='ramesh@xmpl.com', salary=45000, department='ASDF')
+        self.expected = ['Ramesh', 45000, 'ramesh@xmpl.com', 'ASDF']
+
+    def test_repeated_iteration(self):
+        self.assertEqual(self.expected, list(self.emp))
+        self.assertEqual(self.expected, list(self.emp))
+
+    def test_concurrent_iteration(self):
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: list(self.emp), range(100)))
+        for actual in results:
+            self.assertEqual(self.expected, actual)
+
+
+# python -m unittest test_iterator_demos.py
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import operator
+import unittest
+
+from streams import Stream
+
+
+class TestStream(unittest.TestCase):
+
+    def test_pipeline(self):
+        s = Stream(range(10)).map(lambda n: n * n).filter(lambda n: n % 2)
+        self.assertEqual([1, 9, 25, 49, 81], s.to_list())
+        self.assertEqual(165, s.reduce(operator.add))
+        self.assertEqual(165, s.sum())
+        self.assertEqual(5, s.count())
+
+    def test_chunk_and_flatten(self):
+        s = Stream(range(7)).chunk(3)
+        self.assertEqual([[0, 1, 2], [3, 4, 5], [6]], s.to_list())
+        self.assertEqual(3, s.count())
+        self.assertEqual(list(range(7)), s.flatten().to_list())
+
+
+class TestArrayChunks(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import numpy    # noqa: F401
+        except ImportError:
+            self.skipTest('numpy is not installed')
+
+    def test_sum_and_count(self):
+        # the last chunk is shorter than the others
+        for n, chunk_size in [(10, 4), (8, 4), (3, 10), (0, 4)]:
+            with self.subTest(n=n, chunk_size=chunk_size):
+                s = Stream.arange(n, chunk_size=chunk_size)
+                self.assertEqual(sum(range(n)), s.sum())
+                self.assertEqual(n, s.count())
+                self.assertEqual(list(range(n)), s.flatten().to_list())
+
+    def test_chunk_with_dtype(self):
+        s = Stream(range(10)).chunk(4, dtype='float64')
+        self.assertEqual(45.0, s.sum())
+        self.assertEqual(10, s.count())
+
+    def test_chunks_mapped_to_numbers(self):
+        s = Stream.arange(1, 11, chunk_size=3).map(lambda chunk: int(chunk.max()))
+        self.assertEqual([3, 6, 9, 10], s.to_list())
+        self.assertEqual(28, s.sum())
+        self.assertEqual(4, s.count())
+
+
+# python -m unittest test_streams.py
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,357 @@
+"""
+Admission control for the customer service (ex45): under a traffic spike the requests
+that cannot be served in time are turned away at once, instead of all of them
+queueing in the threadpool and every one of them getting slow.
+
+    writes = Limit('writes', concurrency=8, queue=64, timeout=1.0)
+    app.add_middleware(AdmissionMiddleware, limits={
+        'GET /api/customers/{cust_id}': Limit('reads', concurrency=16, queue=32, timeout=0.5),
+        'POST /api/customers': writes,
+        'PUT|DELETE /api/customers/{cust_id}': writes,          # one limit for the three
+        '* /api/customers/changes': None,                       # not limited
+    }, default=Limit('default', 16, 32), rate_limiter=RateLimiter(rate=20, burst=40))
+
+- a Limit lets `concurrency` requests through at once; up to `queue` more wait for
+  a slot, first come first served, for at most `timeout` seconds. A request that
+  finds the queue full, or that waits too long, gets 503 with Retry-After.
+- the limits are matched on the method and the path, in the order given (the first
+  that matches); routes with no match get `default` (None: not limited). Long-lived
+  requests (the SSE change feed) must not be limited, they would hold a slot forever.
+- a RateLimiter is a token bucket per client (its address, or a header such as
+  x-api-key): `rate` requests per second, with bursts of up to `burst`. Over that,
+  429 with Retry-After, before the request takes a slot.
+
+The settings, the slots in use, the queues, the waits and the rejections are in
+GET /metrics (see metrics.py). Everything here runs on the event loop thread.
+
+    python admission.py --seconds 10      # p99 under overload, with and without it
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+
+from metrics import Histogram, metrics, percentile
+
+
+class Limit:
+    def __init__(self, name, concurrency, queue=0, timeout=1.0):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()      # futures of the requests waiting for a slot
+
+    async def acquire(self):
+        """None once the request has a slot, or why it does not get one: 'queue_full' or 'timeout'"""
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            return None
+        if len(self.waiters) >= self.queue:
+            return 'queue_full'
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                return None         # the slot came at the same time as the timeout
+            self.__forget(waiter)
+            return 'timeout'
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self.__forget(waiter)
+            raise
+        return None
+
+    def release(self):
+        # the slot goes straight to the first one waiting, if any
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def __forget(self, waiter):
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+
+class RateLimiter:
+    """a token bucket per client: `rate` requests per second, `burst` at most at once"""
+    def __init__(self, rate, burst=None, max_clients=100_000):
+        self.rate = rate
+        self.burst = burst or rate
+        self.max_clients = max_clients
+        self.buckets = {}       # client -> [tokens, time of the last refill]
+
+    def take(self, client):
+        """0 if the client may make a request now, otherwise the seconds until it may"""
+        now = time.monotonic()
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                self.__prune(now)
+            bucket = self.buckets[client] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / self.rate
+
+    def __prune(self, now):
+        # a client whose bucket is full again is no different from one never seen
+        for client, (tokens, last) in list(self.buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst:
+                del self.buckets[client]
+        if len(self.buckets) >= self.max_clients:
+            self.buckets.clear()
+
+
+def compile_route(route):
+    """'PUT|DELETE /api/customers/{cust_id}' -> ({'PUT', 'DELETE'} (None for '*'), path regex, path)"""
+    methods, _, path = route.partition(' ')
+    pattern = '[^/]+'.join(re.escape(part) for part in re.split(r'\{[^}]*\}', path))
+    return (None if methods == '*' else set(methods.upper().split('|'))), re.compile(pattern + '$'), path
+
+
+def override_limits(limits, text):
+    """'reads=32/64/500,writes=4/16/1000' sets concurrency/queue/timeout (ms) of the limits with those names"""
+    by_name = {limit.name: limit for limit in limits if limit is not None}
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        name, _, values = part.partition('=')
+        concurrency, queue, timeout = values.split('/')
+        limit = by_name[name.strip()]
+        limit.concurrency, limit.queue, limit.timeout = int(concurrency), int(queue), int(timeout) / 1000
+
+
+async def reject(send, status, detail, retry_after):
+    body = f'{{"detail":"{detail}"}}'.encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                            (b'retry-after', str(retry_after).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware"""
+    def __init__(self, app, limits, default=None, rate_limiter=None, client_header=None, retry_after=1):
+        self.app = app
+        self.routes = [(*compile_route(route), limit) for route, limit in limits.items()]
+        self.default = default
+        self.rate_limiter = rate_limiter
+        self.client_header = client_header.lower().encode() if client_header else None
+        self.retry_after = retry_after
+        for limit in list(limits.values()) + [default]:
+            if limit is not None:
+                metrics.limits[limit.name] = limit
+                metrics.admission_waits.setdefault(limit.name, Histogram())
+        metrics.rate_limiter = rate_limiter
+
+    def limit_for(self, method, path):
+        """the Limit of the request (None: not limited), and the route it matched"""
+        for methods, regex, route, limit in self.routes:
+            if (methods is None or method in methods) and regex.match(path):
+                return limit, route
+        return self.default, None
+
+    def client(self, scope):
+        if self.client_header is not None:
+            for name, value in scope['headers']:
+                if name == self.client_header:
+                    # x-forwarded-for: client, proxy1, proxy2
+                    return value.decode('latin-1').split(',')[0].strip()
+        client = scope.get('client')
+        return client[0] if client else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        limit, route = self.limit_for(scope['method'], scope['path'])
+        if route is not None:
+            scope['admission_route'] = route       # the route label of the rejected ones in the metrics
+
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take(self.client(scope))
+            if wait:
+                metrics.count_rejected('rate_limit', 'rate_limited')
+                return await reject(send, 429, 'Too many requests', math.ceil(wait))
+
+        if limit is None:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        reason = await limit.acquire()
+        metrics.admission_waits[limit.name].observe(time.perf_counter() - start)
+        if reason is not None:
+            metrics.count_rejected(limit.name, reason)
+            return await reject(send, 503, 'The service is busy, try again later', self.retry_after)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+
+# the overload test: ex45 in a process of its own, requests sent at a fixed rate (an open
+# loop, as real clients do: they do not slow down because the service is slow). The client
+# is plain asyncio with keep-alive connections; httpx itself cannot keep up with the rates
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.idle = []      # (reader, writer) of the open connections not in use
+
+    async def get(self, path):
+        """the status of GET path, or 'error'"""
+        if self.idle:
+            reader, writer = self.idle.pop()
+            status = await self.__get(reader, writer, path)
+            if status != 'error':
+                return status
+            # the service may have closed it, idle for too long
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        except OSError:
+            return 'error'
+        return await self.__get(reader, writer, path)
+
+    async def __get(self, reader, writer, path):
+        try:
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.partition(b':')
+                if name.lower() == b'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+        except (OSError, IndexError, ValueError, asyncio.IncompleteReadError):
+            writer.close()
+            return 'error'
+        self.idle.append((reader, writer))
+        return status
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+
+
+def start_service(directory, port, env):
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'ex45_fastapi_sqlite_rest_demo:app',
+                                '--port', str(port), '--log-level', 'warning', '--backlog', '4096'],
+                               cwd=directory, env=dict(os.environ, PYTHONPATH=here, **env),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        if asyncio.run(Client(port).get('/')) == 200:
+            return process
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('the service did not start')
+
+
+async def open_loop(port, rate, seconds, customers, list_share):
+    """[(kind, status, latency)] of the requests sent at `rate` per second for `seconds`, and the time
+    until the last one was answered"""
+    results = []
+    r = random.Random(1)
+    client = Client(port)
+
+    async def one(kind, path):
+        start = time.perf_counter()
+        status = await client.get(path)
+        results.append((kind, status, time.perf_counter() - start))
+
+    tasks = []
+    start = time.perf_counter()
+    for i in range(int(rate * seconds)):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if r.random() < list_share:
+            tasks.append(asyncio.create_task(one('list', '/api/customers')))
+        else:
+            tasks.append(asyncio.create_task(one('get', f'/api/customers/{r.randint(1, customers)}')))
+    await asyncio.gather(*tasks)
+    client.close()
+    return results, time.perf_counter() - start
+
+
+def ms(values, p):
+    value = percentile(sorted(values), p * 100)
+    return value * 1000 if value is not None else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='p99 of ex45 under overload, with and without admission control')
+    parser.add_argument('--customers', type=int, default=5000)
+    parser.add_argument('--rates', default='100,200,400,800', help='requests per second to send')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--list-share', type=float, default=0.0, help='share of GET /api/customers (all of them)')
+    parser.add_argument('--limits', default='', help='ADMISSION_LIMITS for the service, e.g. reads=8/16/300')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    here = os.path.dirname(os.path.abspath(__file__))
+    shutil.copy(os.path.join(here, 'customersdb.sqlite'), directory)
+    with sqlite3.connect(os.path.join(directory, 'customersdb.sqlite')) as conn:
+        conn.executemany('insert into customers(name, email, phone, city) values (?, ?, ?, ?)',
+                         ((f'Customer {i}', f'overload{i}@xmpl.com', f'7{i:09}', 'Bangalore')
+                          for i in range(args.customers)))
+
+    print(f'{args.customers:,} customers; GET /api/customers/{{id}}, and {args.list_share:.1%} GET /api/customers '
+          f'(all of them); {args.seconds} s per rate')
+    print('ok/s: answered 200/404 per second, until the last answer; latencies in ms')
+    lists = args.list_share > 0
+    print(f'{"admission":9} {"sent/s":>7} {"ok/s":>7} {"get p50":>8} {"get p99":>8} '
+          f'{"list p99 " if lists else ""}{"503":>6} {"503 p99":>8} {"errors":>7}')
+    for admission in ('off', 'on'):
+        port = free_port()
+        service = start_service(directory, port, {'ADMISSION': admission, 'ADMISSION_LIMITS': args.limits})
+        try:
+            for rate in map(float, args.rates.split(',')):
+                results, elapsed = asyncio.run(open_loop(port, rate, args.seconds, args.customers, args.list_share))
+                ok = {'get': [], 'list': []}
+                busy, errors = [], 0
+                for kind, status, latency in results:
+                    if status in (200, 404):
+                        ok[kind].append(latency)
+                    elif status == 503:
+                        busy.append(latency)
+                    else:
+                        errors += 1
+                print(f'{admission:9} {rate:7.0f} {(len(ok["get"]) + len(ok["list"])) / elapsed:7.0f} '
+                      f'{ms(ok["get"], 0.5):8.1f} {ms(ok["get"], 0.99):8.1f} '
+                      f'{f"{ms(ok["list"], 0.99):8.1f} " if lists else ""}'
+                      f'{len(busy) / len(results):6.1%} {ms(busy, 0.99):8.1f} {errors:7}')
+                time.sleep(1)
+        finally:
+            service.terminate()
+            service.wait()
+
+
+if __name__ == '__main__':
+    main()
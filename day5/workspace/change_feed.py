@@ -0,0 +1,223 @@
+"""
+Server-Sent Events feed of the changes to the customers, instead of clients polling
+GET /api/customers and comparing.
+
+    feed = ChangeFeed(db.get_changes, db.last_change_seq())
+    db.change_listeners.append(feed.notify)
+    ...
+    return StreamingResponse(feed.subscribe(since), media_type='text/event-stream')
+
+The changes themselves are numbered and stored by db.py (customer_changes table,
+filled by triggers). The feed keeps the most recent ones in memory, already
+encoded as SSE messages, and shares them between all the subscribers:
+
+- a write anywhere wakes one refresher task, which reads the new changes from the
+  database once, however many subscribers there are
+- a subscriber is just a position (seq) in that shared log; there are no queues
+  per subscriber that could grow without bound
+- a subscriber is sent what is pending (as one chunk) only when the previous chunk
+  has been written (the ASGI send waits while the client's socket buffer is full),
+  so a slow client only slows down itself. If it falls behind the in-memory log, or
+  asks for changes from long ago, it is served from the database, 1000 at a time.
+
+Changes made by other processes (e.g. other workers) show up on the next poll. If
+reading them fails (the database locked or gone), the error is logged and the read
+retried after retry_delay seconds; the subscribers just wait.
+
+With prune=fn(before_seq), the feed deletes the stored changes that no client can
+resume from any more, every prune_interval seconds: all but the last `retention`
+ones, and never any a connected subscriber of this process has not been sent yet.
+A client that asks for changes from before what is left gets an `event: reset`
+first: it missed some, and has to load the customers again.
+
+    python change_feed.py --subscribers 5000 --events 1000     # the fan-out benchmark
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_right
+
+log = logging.getLogger(__name__)
+
+
+def encode(change):
+    seq, ts, op, customer_id, data = change
+    # data is already the customer as JSON text (or None for deletes)
+    payload = f'{{"seq":{seq},"ts":{ts},"op":{json.dumps(op)},"id":{customer_id},"customer":{data or "null"}}}'
+    return f'id: {seq}\nevent: {op}\ndata: {payload}\n\n'.encode('utf-8')
+
+
+def encode_reset(seq):
+    # the changes up to seq are gone; the id moves a reconnecting client past them
+    return f'id: {seq}\nevent: reset\ndata: {{"seq":{seq}}}\n\n'.encode('utf-8')
+
+
+class ChangeFeed:
+    def __init__(self, read_changes, last_seq, capacity=10_000, poll_interval=1.0, heartbeat=15.0,
+                 retry_delay=5.0, prune=None, retention=100_000, prune_interval=60.0):
+        self.read_changes = read_changes        # fn(after_seq, limit) -> [(seq, ts, op, customer_id, data)]
+        self.last_seq = last_seq
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.retry_delay = retry_delay
+        self.prune = prune                      # fn(before_seq): deletes the changes with a lower seq
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.__pruned = time.monotonic()
+        self.__positions = {}                   # subscriber -> the last seq it was sent
+        # the log in memory covers the changes after start_seq, up to last_seq
+        self.start_seq = last_seq
+        self.__seqs = []
+        self.__messages = []
+        self.__loop = None
+        self.__dirty = None
+        self.__changed = None
+        self.__task = None
+
+    def start(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__dirty = asyncio.Event()
+        self.__changed = asyncio.Event()
+        self.__task = asyncio.create_task(self.__refresher())
+
+    async def stop(self):
+        self.__task.cancel()
+        try:
+            await self.__task
+        except asyncio.CancelledError:
+            pass
+
+    def notify(self):
+        """there are new changes in the database; may be called from any thread"""
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__dirty.set)
+
+    async def __refresher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.__dirty.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.__dirty.clear()
+            try:
+                changes = await asyncio.to_thread(self.read_changes, self.last_seq, self.capacity)
+                if changes:
+                    self.append([(c[0], encode(c)) for c in changes])
+                    if len(changes) == self.capacity:
+                        self.__dirty.set()      # there may be more
+                if self.prune is not None and time.monotonic() - self.__pruned >= self.prune_interval:
+                    self.__pruned = time.monotonic()
+                    await asyncio.to_thread(self.prune, self.__prune_before())
+            except Exception:
+                # the task must outlive the error, or every subscriber would silently stop getting events
+                log.exception('reading the changes failed; retrying in %s s', self.retry_delay)
+                await asyncio.sleep(self.retry_delay)
+                self.__dirty.set()
+
+    def __prune_before(self):
+        before = self.last_seq - self.retention + 1
+        if self.__positions:
+            before = min(before, min(self.__positions.values()) + 1)
+        return before
+
+    def append(self, events):
+        """adds (seq, message) pairs to the log and wakes up the subscribers"""
+        for seq, message in events:
+            self.__seqs.append(seq)
+            self.__messages.append(message)
+        self.last_seq = self.__seqs[-1]
+        if len(self.__seqs) > 2 * self.capacity:
+            # trimmed in one go now and then, rather than by one on every append
+            drop = len(self.__seqs) - self.capacity
+            self.start_seq = self.__seqs[drop - 1]
+            del self.__seqs[:drop], self.__messages[:drop]
+        changed, self.__changed = self.__changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self, since=None):
+        """yields the SSE messages of the changes after seq `since` (default: from now on), forever"""
+        seq = self.last_seq if since is None else since
+        key = object()
+        self.__positions[key] = seq
+        try:
+            yield b'retry: 3000\n\n'
+            while True:
+                changed = self.__changed
+                if seq < self.start_seq:
+                    # too far behind for the log in memory
+                    changes = await asyncio.to_thread(self.read_changes, seq, 1000)
+                    messages = [encode(c) for c in changes]
+                    if changes and changes[0][0] > seq + 1:
+                        # seqs have no gaps, but pruned ones
+                        messages.insert(0, encode_reset(changes[0][0] - 1))
+                    if changes:
+                        seq = changes[-1][0]
+                    else:
+                        seq = self.start_seq
+                else:
+                    i = bisect_right(self.__seqs, seq)
+                    messages = self.__messages[i:]
+                    if messages:
+                        seq = self.__seqs[-1]
+                self.__positions[key] = seq
+
+                if messages:
+                    # all that is pending in one chunk, i.e. one send() and one socket write
+                    yield b''.join(messages)
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield b': keep-alive\n\n'
+        finally:
+            del self.__positions[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fan-out of the change feed to many subscribers')
+    parser.add_argument('--subscribers', type=int, default=5000)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=10, help='changes per write')
+    args = parser.parse_args()
+
+    async def run():
+        feed = ChangeFeed(lambda after, limit: [], 0)
+        feed.start()
+        received = [0] * args.subscribers
+        done = asyncio.Event()
+        finished = [0]
+
+        async def subscriber(i):
+            async for chunk in feed.subscribe(since=0):
+                received[i] += chunk.count(b'\nevent: ')
+                if received[i] == args.events:
+                    finished[0] += 1
+                    if finished[0] == args.subscribers:
+                        done.set()
+                    return
+
+        tasks = [asyncio.create_task(subscriber(i)) for i in range(args.subscribers)]
+        await asyncio.sleep(0.1)      # everyone subscribed
+        start = time.perf_counter()
+        for seq in range(1, args.events + 1, args.batch):
+            feed.append([(s, encode((s, time.time(), 'update', s, '{"id":%d}' % s)))
+                         for s in range(seq, min(seq + args.batch, args.events + 1))])
+            await asyncio.sleep(0)
+        await done.wait()
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*tasks)
+        await feed.stop()
+
+        deliveries = args.subscribers * args.events
+        print(f'{args.events:,} changes to {args.subscribers:,} subscribers, {args.batch} per write')
+        print(f'{deliveries:,} messages delivered in {elapsed:.2f} s: {deliveries / elapsed:,.0f} per second, '
+              f'{elapsed / args.events * 1000:.2f} ms per change for all the subscribers')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,98 @@
+import re
+import threading
+from contextlib import contextmanager
 from sqlite3 import connect, DatabaseError, Row
+from urllib.parse import quote
+from metrics import track_db_time
+
+DB_FILE = 'customersdb.sqlite'
 
 def get_connection():
-    conn = connect('customersdb.sqlite')
+    conn = connect(DB_FILE)
+    conn.row_factory = Row
+    return conn
+
+
+# The database runs in WAL mode: readers see the last committed state and are never
+# blocked by the (single) writer, nor block it. The reads get read-only connections
+# from a pool; all the writes go through one writer connection (or the WriteBatcher).
+
+READ_POOL_SIZE = 16
+_read_pools = {}            # DB_FILE -> idle read-only connections
+_read_pool_lock = threading.Lock()
+
+def get_read_connection():
+    conn = connect(f'file:{quote(DB_FILE)}?mode=ro', uri=True, check_same_thread=False)
     conn.row_factory = Row
     return conn
 
+@contextmanager
+def reading():
+    """a read-only connection from the pool, for the duration of the with block"""
+    db_file = DB_FILE
+    with _read_pool_lock:
+        pool = _read_pools.setdefault(db_file, [])
+        conn = pool.pop() if pool else None
+    if conn is None:
+        conn = get_read_connection()
+    try:
+        yield conn
+    finally:
+        with _read_pool_lock:
+            if len(pool) < READ_POOL_SIZE:
+                pool.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+_writer = None
+_writer_settings = None     # the (DB_FILE, SYNCHRONOUS) the writer was opened with
+_writer_lock = threading.Lock()
+
+# pragma synchronous of the writer; None keeps SQLite's default (full: every commit is
+# synced to disk). In WAL mode 'normal' cannot corrupt the database, it only may lose
+# the last transactions on a power failure (not on a crash), for fewer fsyncs.
+SYNCHRONOUS = None
+
+def get_writer():
+    """the one connection that writes; only to be used holding _writer_lock"""
+    global _writer, _writer_settings
+    if _writer is None or _writer_settings != (DB_FILE, SYNCHRONOUS):
+        if _writer is not None:
+            _writer.close()
+        if SYNCHRONOUS is not None and SYNCHRONOUS.lower() not in ('off', 'normal', 'full', 'extra'):
+            raise ValueError(f'SYNCHRONOUS must be off, normal, full or extra, not {SYNCHRONOUS!r}')
+        _writer = connect(DB_FILE, check_same_thread=False)
+        _writer.row_factory = Row
+        if SYNCHRONOUS is not None:
+            _writer.execute(f'pragma synchronous = {SYNCHRONOUS}')
+        _writer_settings = (DB_FILE, SYNCHRONOUS)
+    return _writer
+
+
+# the version of the schema below, kept in the database file (pragma user_version);
+# to be increased whenever the schema changes, so that init_db() applies it again
+SCHEMA_VERSION = 2
+_schema_checked = set()     # the DB_FILEs this process has checked
+
 
 def init_db():
-    with get_connection() as conn:
+    # every worker calls this when it starts; the schema is only created/checked when the
+    # file does not have SCHEMA_VERSION yet, otherwise it is one read of the file header
+    if DB_FILE in _schema_checked:
+        return
+    with _writer_lock, get_writer() as conn:
         cursor = conn.cursor()
+        if cursor.execute('pragma user_version').fetchone()[0] == SCHEMA_VERSION:
+            _schema_checked.add(DB_FILE)
+            return
+        # stored in the database file, so the other connections get it too
+        cursor.execute('pragma journal_mode = wal')
+        # workers starting at the same time take turns; the ones after the first find it done
+        cursor.execute('begin immediate')
+        if cursor.execute('pragma user_version').fetchone()[0] == SCHEMA_VERSION:
+            _schema_checked.add(DB_FILE)
+            return
         sql = """create table if not exists customers(
         id integer primary key autoincrement,
         name varchar(50) not null,
@@ -17,56 +101,334 @@ def init_db():
         city varchar(100)
         )"""
         cursor.execute(sql)
-        
+        init_search(cursor)
+        init_changes(cursor)
+        init_stats(cursor)
+        cursor.execute(f'pragma user_version = {SCHEMA_VERSION}')
+    _schema_checked.add(DB_FILE)
+
+
+# full text index on name, email and city; an external content table, so the text
+# is not stored twice, kept in sync with customers by the triggers below.
+# prefix='2 3' adds indexes for 2 and 3 character prefixes, so that short prefix
+# queries do not have to scan every term starting with them
+SEARCH_SCHEMA = [
+    """create virtual table customers_fts using fts5(
+        name, email, city, content='customers', content_rowid='id', prefix='2 3')""",
+    """create trigger customers_fts_insert after insert on customers begin
+        insert into customers_fts(rowid, name, email, city) values (new.id, new.name, new.email, new.city);
+    end""",
+    """create trigger customers_fts_delete after delete on customers begin
+        insert into customers_fts(customers_fts, rowid, name, email, city)
+            values ('delete', old.id, old.name, old.email, old.city);
+    end""",
+    """create trigger customers_fts_update after update on customers begin
+        insert into customers_fts(customers_fts, rowid, name, email, city)
+            values ('delete', old.id, old.name, old.email, old.city);
+        insert into customers_fts(rowid, name, email, city) values (new.id, new.name, new.email, new.city);
+    end""",
+]
+
+def init_search(cursor):
+    cursor.execute("select 1 from sqlite_master where name = 'customers_fts'")
+    if cursor.fetchone():
+        return
+    for sql in SEARCH_SCHEMA:
+        cursor.execute(sql)
+    # index the customers that were there before the search table
+    cursor.execute("insert into customers_fts(customers_fts) values ('rebuild')")
+
+
+# the change feed: every insert/update/delete of a customer, numbered by seq, written
+# by triggers in the same transaction as the change itself
+CHANGES_SCHEMA = [
+    """create table if not exists customer_changes(
+        seq integer primary key autoincrement,
+        ts real not null default ((julianday('now') - 2440587.5) * 86400.0),     -- unix time
+        op text not null,
+        customer_id integer not null,
+        data text
+    )""",
+    """create trigger if not exists customer_changes_insert after insert on customers begin
+        insert into customer_changes(op, customer_id, data) values ('insert', new.id,
+            json_object('id', new.id, 'name', new.name, 'email', new.email, 'phone', new.phone, 'city', new.city));
+    end""",
+    """create trigger if not exists customer_changes_update after update on customers begin
+        insert into customer_changes(op, customer_id, data) values ('update', new.id,
+            json_object('id', new.id, 'name', new.name, 'email', new.email, 'phone', new.phone, 'city', new.city));
+    end""",
+    """create trigger if not exists customer_changes_delete after delete on customers begin
+        insert into customer_changes(op, customer_id) values ('delete', old.id);
+    end""",
+]
+
+def init_changes(cursor):
+    for sql in CHANGES_SCHEMA:
+        cursor.execute(sql)
+
+
+# the number of customers, in all and by city, kept by triggers in the same transaction
+# as the change, so GET /api/customers/stats reads a few rows instead of counting them
+# all (a full scan). A NULL city is counted under ''. Only a change made without the
+# triggers (before SCHEMA_VERSION 2, or with them dropped) can make them wrong:
+#   python db.py --check-stats        the counts that differ from a count of the customers
+#   python db.py --rebuild-stats      counts the customers again
+STATS_SCHEMA = [
+    """create table if not exists customer_counts(
+        dimension text not null,        -- 'all' (value ''), 'city'
+        value text not null,
+        count integer not null,
+        primary key (dimension, value)
+    ) without rowid""",
+    """create trigger if not exists customer_counts_insert after insert on customers begin
+        insert into customer_counts values ('all', '', 1) on conflict do update set count = count + 1;
+        insert into customer_counts values ('city', coalesce(new.city, ''), 1) on conflict do update set count = count + 1;
+    end""",
+    """create trigger if not exists customer_counts_delete after delete on customers begin
+        update customer_counts set count = count - 1 where dimension = 'all';
+        update customer_counts set count = count - 1 where dimension = 'city' and value = coalesce(old.city, '');
+        delete from customer_counts where dimension = 'city' and value = coalesce(old.city, '') and count <= 0;
+    end""",
+    """create trigger if not exists customer_counts_city after update of city on customers
+    when old.city is not new.city begin
+        update customer_counts set count = count - 1 where dimension = 'city' and value = coalesce(old.city, '');
+        delete from customer_counts where dimension = 'city' and value = coalesce(old.city, '') and count <= 0;
+        insert into customer_counts values ('city', coalesce(new.city, ''), 1) on conflict do update set count = count + 1;
+    end""",
+]
+
+COUNT_CUSTOMERS_SQL = """select 'all', '', count(*) from customers
+    union all
+    select 'city', coalesce(city, ''), count(*) from customers group by 2"""
+
+def init_stats(cursor):
+    cursor.execute("select 1 from sqlite_master where name = 'customer_counts'")
+    new = cursor.fetchone() is None
+    for sql in STATS_SCHEMA:
+        cursor.execute(sql)
+    if new:
+        rebuild_stats(cursor)
+
+def rebuild_stats(cursor):
+    cursor.execute('delete from customer_counts')
+    cursor.execute(f'insert into customer_counts {COUNT_CUSTOMERS_SQL}')
+
+@track_db_time
+def get_customer_stats(city=None):
+    """{'total': n, 'by_city': {city: n}}, or {'city': city, 'count': n} for one city"""
+    with reading() as conn:
+        if city is not None:
+            row = conn.execute("select count from customer_counts where dimension = 'city' and value = ?",
+                               (city,)).fetchone()
+            return {'city': city, 'count': row[0] if row else 0}
+        stats = {'total': 0, 'by_city': {}}
+        for dimension, value, count in conn.execute('select dimension, value, count from customer_counts'):
+            if dimension == 'all':
+                stats['total'] = count
+            else:
+                stats['by_city'][value] = count
+        return stats
+
+def check_customer_stats():
+    """[(dimension, value, kept count, actual count)] of the counts that are wrong"""
+    with reading() as conn:
+        kept = {(d, v): c for d, v, c in conn.execute('select dimension, value, count from customer_counts')}
+        actual = {(d, v): c for d, v, c in conn.execute(COUNT_CUSTOMERS_SQL) if c or d == 'all'}
+    return sorted((d, v, kept.get((d, v), 0), actual.get((d, v), 0))
+                  for d, v in kept.keys() | actual.keys() if kept.get((d, v), 0) != actual.get((d, v), 0))
+
+def rebuild_customer_stats():
+    # through the writer, so that no write comes in between the delete and the count
+    def rebuild(cursor):
+        for sql in STATS_SCHEMA:
+            cursor.execute(sql)
+        rebuild_stats(cursor)
+    write(rebuild)
+
+
+@track_db_time
+def get_changes(after_seq, limit=1000):
+    """(seq, ts, op, customer_id, data) of the changes after after_seq; data is the customer as JSON text"""
+    with reading() as conn:
+        cursor = conn.cursor()
+        sql = 'select seq, ts, op, customer_id, data from customer_changes where seq > ? order by seq limit ?'
+        cursor.execute(sql, (after_seq, limit))
+        return cursor.fetchall()
+
+def last_change_seq():
+    with reading() as conn:
+        return conn.execute('select coalesce(max(seq), 0) from customer_changes').fetchone()[0]
+
+def prune_changes(before_seq, batch=10_000):
+    """deletes the changes with a seq lower than before_seq, a batch per transaction so
+    that the other writes do not wait for all of it; returns how many were deleted"""
+    sql = 'delete from customer_changes where seq in (select seq from customer_changes where seq < ? limit ?)'
+    deleted = 0
+    while True:
+        # _write, not write(): nothing for the change listeners in this
+        count = _write(lambda cursor: cursor.execute(sql, (before_seq, batch)).rowcount)
+        deleted += count
+        if count < batch:
+            return deleted
+
+# called (with no arguments, from the writing thread) after every successful write
+change_listeners = []
+
+
+SEARCH_FIELDS = ('name', 'email', 'city')
+
+def to_match_query(text, field=None):
+    """
+    'vinod kay' -> '"vinod"* "kay"*': every word of the text, as a prefix.
+    The text is split the way fts5 splits the indexed values, so 'vinod@cyb' works
+    too, and none of the fts5 query syntax gets through.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    query = ' '.join(f'"{w}"*' for w in words)
+    if field is not None:
+        if field not in SEARCH_FIELDS:
+            raise ValueError(f'field must be one of {SEARCH_FIELDS}')
+        query = f'{field} : ({query})'
+    return query
+
+@track_db_time
+def search_customers(text, field=None, limit=20, offset=0):
+    """customers matching all the words (as prefixes) of text, best matches (bm25) first"""
+    query = to_match_query(text, field)
+    if query is None:
+        return []
+    with reading() as conn:
+        cursor = conn.cursor()
+        sql = """select c.* from customers_fts f join customers c on c.id = f.rowid
+            where customers_fts match ? order by f.rank limit ? offset ?"""
+        cursor.execute(sql, (query, limit, offset))
+        return cursor.fetchall()
+
+@track_db_time
 def get_all_customers():
-    with get_connection() as conn:
+    with reading() as conn:
         cursor = conn.cursor()
         sql = 'select * from customers'
         cursor.execute(sql)
         customers = cursor.fetchall()
     return customers
 
+@track_db_time
 def get_customer(cust_id):
-    with get_connection() as conn:
+    with reading() as conn:
         cursor = conn.cursor()
         sql = 'select * from customers where id = ?'
         cursor.execute(sql, [cust_id])
         return cursor.fetchone()
     
-def add_customer(customer):
-    with get_connection() as conn:
+# sqlite versions before 3.32 allow at most 999 parameters in a statement
+MAX_IDS_PER_QUERY = 900
+
+@track_db_time
+def get_customers_by_ids(ids):
+    """returns a dict {id: customer} for the given ids that exist; one query per 900 ids"""
+    unique_ids = list(dict.fromkeys(ids))
+    found = {}
+    with reading() as conn:
         cursor = conn.cursor()
-        sql = 'insert into customers(name, email, phone, city) values (?, ?, ?, ?)'
+        for i in range(0, len(unique_ids), MAX_IDS_PER_QUERY):
+            chunk = unique_ids[i:i + MAX_IDS_PER_QUERY]
+            sql = f'select * from customers where id in ({",".join("?" * len(chunk))})'
+            cursor.execute(sql, chunk)
+            for row in cursor.fetchall():
+                found[row['id']] = row
+    return found
+    
+# writes go through a WriteBatcher (group commit) once enable_write_batching() is called
+_batcher = None
+
+def enable_write_batching(max_batch=200, max_delay=0.0, synchronous='full'):
+    global _batcher
+    from write_batcher import WriteBatcher
+    disable_write_batching()
+    _batcher = WriteBatcher(get_connection, max_batch, max_delay, synchronous)
+
+def disable_write_batching():
+    """returns (batches, writes) done by the batcher"""
+    global _batcher
+    batcher, _batcher = _batcher, None
+    if batcher is None:
+        return None
+    batcher.close()
+    return batcher.batches, batcher.writes
+
+def write(fn, *args):
+    result = _write(fn, *args)
+    for listener in change_listeners:
+        listener()
+    return result
+
+def _write(fn, *args):
+    if _batcher is not None:
         try:
-            cursor.execute(sql, tuple(customer.values()))
-            customer['id'] = cursor.lastrowid
-            conn.commit()
-            return customer
+            return _batcher.submit(fn, *args)
         except DatabaseError as err:
-            conn.rollback()
             raise ValueError(str(err))
-        
-def delete_customer(cust_id):
-    with get_connection() as conn:
+
+    with _writer_lock:
+        conn = get_writer()
         cursor = conn.cursor()
-        sql = 'delete from customers where id=?'
         try:
-            cursor.execute(sql, [cust_id])
+            result = fn(cursor, *args)
             conn.commit()
+            return result
         except DatabaseError as err:
             conn.rollback()
             raise ValueError(str(err))
+
+
+def insert_customer(cursor, customer):
+    sql = 'insert into customers(name, email, phone, city) values (?, ?, ?, ?)'
+    cursor.execute(sql, tuple(customer.values()))
+    customer['id'] = cursor.lastrowid
+    return customer
+
+def remove_customer(cursor, cust_id):
+    sql = 'delete from customers where id=?'
+    cursor.execute(sql, [cust_id])
+
+def change_customer(cursor, cust):
+    params = (cust['name'], cust['email'], cust['phone'], cust['city'], cust['id'])
+    sql = 'update customers set name=?, email=?, phone=?, city=? where id=?'
+    cursor.execute(sql, params)
+
+
+@track_db_time
+def add_customer(customer):
+    return write(insert_customer, customer)
+        
+@track_db_time
+def delete_customer(cust_id):
+    write(remove_customer, cust_id)
         
 
+@track_db_time
 def update_customer(cust):
-    params = (cust['name'], cust['email'], cust['phone'], cust['city'], cust['id'])
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        sql = 'update customers set name=?, email=?, phone=?, city=? where id=?'
-        try:
-            cursor.execute(sql, params)
-            conn.commit()
-        except DatabaseError as err:
-            conn.rollback()
-            raise ValueError(str(err))
-        
\ No newline at end of file
+    write(change_customer, cust)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='The counts of customer_counts')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--check-stats', action='store_true', help='the counts that are wrong')
+    parser.add_argument('--rebuild-stats', action='store_true', help='count the customers again')
+    args = parser.parse_args()
+    DB_FILE = args.db
+    init_db()
+    if args.rebuild_stats:
+        wrong = check_customer_stats()
+        rebuild_customer_stats()
+        print(f'counts rebuilt, {len(wrong)} of them were wrong')
+    else:
+        wrong = check_customer_stats()
+        for dimension, value, kept, actual in wrong:
+            print(f'{dimension:8} {value or "(none)":30} kept {kept:9} actual {actual:9}')
+        print('the counts are right' if not wrong else f'{len(wrong)} counts are wrong, run with --rebuild-stats')
@@ -0,0 +1,143 @@
+"""
+Read latency of db.py under a sustained write load, before and after the split into
+read-only WAL readers and a single writer.
+
+    python db_concurrency_benchmark.py --customers 10000 --readers 8 --seconds 5
+
+"before" is the way db.py used to work: a rollback journal and a new connection for
+every call, so a reader has to wait whenever a writer holds the database lock.
+"after" is db.py as it is. Both run on a fresh copy of the same generated data;
+the service's customersdb.sqlite is not touched.
+
+The reads get much faster, but the writes/s drop under read load. On their own
+(--readers 0), "after" writes about twice as fast (WAL, one connection), even with
+the search, change feed and count triggers that "before" does not have. But "before" readers
+mostly wait on the database lock, sleeping, while "after" readers never wait. Then
+every reader thread wants the GIL all the time. The writer gives up the GIL on every
+sqlite call and has to get it back each time, so with 8 readers it only gets a few
+dozen writes through a second. This is about the threads of one process; every
+worker process of serve.py has a GIL of its own.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db
+from metrics import percentile
+
+
+def fill(filename, customers):
+    conn = sqlite3.connect(filename)
+    conn.execute("""create table customers(
+        id integer primary key autoincrement,
+        name varchar(50) not null,
+        email varchar(200) not null unique,
+        phone varchar(50) not null unique,
+        city varchar(100)
+        )""")
+    with conn:
+        conn.executemany('insert into customers(name, email, phone, city) values (?, ?, ?, ?)',
+                         ((f'Customer {i}', f'c{i}@xmpl.com', f'9{i:09}', 'Bangalore') for i in range(customers)))
+    conn.close()
+
+
+def before(filename):
+    def connection():
+        conn = sqlite3.connect(filename)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def get_customer(cust_id):
+        with connection() as conn:
+            return conn.execute('select * from customers where id = ?', [cust_id]).fetchone()
+
+    def get_all_customers():
+        with connection() as conn:
+            return conn.execute('select * from customers').fetchall()
+
+    def add_customer(customer):
+        with connection() as conn:
+            conn.execute('insert into customers(name, email, phone, city) values (?, ?, ?, ?)', tuple(customer.values()))
+            conn.commit()
+
+    return get_customer, get_all_customers, add_customer
+
+
+def after(filename):
+    db.DB_FILE = filename
+    db.init_db()
+    return db.get_customer, db.get_all_customers, db.add_customer
+
+
+def run(label, functions, customers, readers, seconds):
+    get_customer, get_all_customers, add_customer = functions
+    stop = threading.Event()
+    latencies = {'get': [], 'list': []}
+    errors = [0]
+    writes = [0]
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            try:
+                add_customer(dict(name=f'New {n}', email=f'new{n}@xmpl.com', phone=f'8{n:09}', city='Mysore'))
+                writes[0] += 1
+            except (ValueError, sqlite3.Error):
+                errors[0] += 1
+
+    def reader(seed):
+        r = random.Random(seed)
+        while not stop.is_set():
+            op = 'list' if r.random() < 0.02 else 'get'
+            start = time.perf_counter()
+            try:
+                if op == 'get':
+                    get_customer(r.randrange(1, customers + 1))
+                else:
+                    get_all_customers()
+            except sqlite3.Error:
+                errors[0] += 1
+                continue
+            latencies[op].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    if not readers:
+        print(f'{label:8} {"-":5} {"":10} {"":9} {"":9} {"":9} {writes[0] / seconds:9,.0f} {errors[0]:7}')
+    for op, values in latencies.items():
+        if not values:
+            continue
+        values.sort()
+        ms = lambda p: percentile(values, p) * 1000
+        print(f'{label:8} {op:5} {len(values) / seconds:10,.0f} {ms(50):9.2f} {ms(99):9.2f} {values[-1] * 1000:9.1f} '
+              f'{writes[0] / seconds:9,.0f} {errors[0]:7}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read latency under write load, before/after the WAL reader pool')
+    parser.add_argument('--customers', type=int, default=10_000)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f'{args.readers} reader threads (get by id, 2% get all {args.customers:,}), 1 writer thread, {args.seconds} s')
+    print(f'{"":8} {"read":5} {"reads/s":>10} {"p50 ms":>9} {"p99 ms":>9} {"max ms":>9} {"writes/s":>9} {"errors":>7}')
+    for label, setup in [('before', before), ('after', after)]:
+        filename = os.path.join(tempfile.mkdtemp(), 'customers.sqlite')
+        fill(filename, args.customers)
+        run(label, setup(filename), args.customers, args.readers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
-from flask import Flask, request     # pip install flask
+from flask import Flask, Response, request     # pip install flask
+from representations import REPRESENTATIONS, negotiate
+from response_compression import WsgiCompressionMiddleware
 
 app = Flask(__name__)
 
+# gzip/deflate/br for the responses bigger than 1 KB, if the client accepts them
+app.wsgi_app = WsgiCompressionMiddleware(app.wsgi_app, minimum_size=1024, level=6)
+
 customers = [
     dict(id=1, name='Vinod', city='Bangalore', email='vinod@vinod.co', phone='9731424784'),
     dict(id=2, name='Shyam', city='Shivamogga', email='shyam@xmpl.com', phone='9000080000'),
@@ -9,11 +14,13 @@ customers = [
 
 @app.get('/api/customers')
 def handle_get_all():
-    accept_header = request.headers.get('Accept')
-    if 'application/json' in accept_header or '*' in accept_header:
-        return customers    
-    
-    return 'The requested media type is not supported', 406
+    media_type = negotiate(request.headers.get('Accept'), REPRESENTATIONS)
+    if media_type is None:
+        return 'The requested media type is not supported', 406
+
+    # encoded and sent a few hundred rows at a time, instead of as one big body
+    body = REPRESENTATIONS[media_type](list(customers))
+    return Response(body, mimetype=media_type, headers={'Vary': 'Accept'})
 
 
 @app.get('/api/customers/<int:cust_id>')
@@ -1,10 +1,18 @@
 from fastapi import FastAPI, HTTPException     # pip install fastapi[all]
 import uvicorn
 from pydantic import BaseModel
+from metrics import MetricsMiddleware
+from response_compression import CompressionMiddleware
 
 
 app = FastAPI()
 
+# gzip/deflate/br for the responses bigger than 1 KB, if the client accepts them
+app.add_middleware(CompressionMiddleware, minimum_size=1024, level=6)
+
+# request counts/latencies, served as GET /metrics
+app.add_middleware(MetricsMiddleware)
+
 customers = [
     dict(id=1, name='Vinod', city='Bangalore', email='vinod@vinod.co', phone='9731424784'),
     dict(id=2, name='Shyam', city='Shivamogga', email='shyam@xmpl.com', phone='9000080000'),
@@ -1,19 +1,109 @@
-from fastapi import FastAPI, HTTPException     # pip install fastapi[all]
-import uvicorn
+import os
+from fastapi import FastAPI, HTTPException, Query, Request     # pip install fastapi[all]
 from pydantic import BaseModel
+from metrics import MetricsMiddleware
+from response_compression import CompressionMiddleware
 from fastapi.middleware.cors import CORSMiddleware
-from db import init_db, get_all_customers, get_customer, add_customer, delete_customer, update_customer
+from fastapi.responses import StreamingResponse
+from change_feed import ChangeFeed
+from admission import AdmissionMiddleware, Limit, RateLimiter, override_limits
+import db
+from db import init_db, get_all_customers, get_customer, get_customers_by_ids, search_customers, add_customer, delete_customer, update_customer, \
+    enable_write_batching, disable_write_batching, get_changes, last_change_seq, change_listeners, \
+    get_customer_stats, prune_changes
+
+# customers spread over the SQLite files in this directory (see sharded_db.py) instead
+# of the one customersdb.sqlite; search, the stats and the change feed are not available then.
+# The store is opened by the startup handler, in the worker process (see serve.py)
+SHARDS_DIR = os.environ.get('CUSTOMER_SHARDS_DIR')
+store = None
 
 app = FastAPI()
 
+# admission control (see admission.py): at most so many requests of a kind at once, a few
+# more waiting briefly, the rest turned away with 503 at once. Together the limits stay
+# around the 40 threads of the threadpool the endpoints run in.
+#   ADMISSION=off                                   no limits
+#   ADMISSION_LIMITS=reads=32/64/500,list=2/4/2000  concurrency/queue/timeout ms of a limit
+#   RATE_LIMIT=20 RATE_BURST=40                     requests per second per client (429 over it)
+#   RATE_LIMIT_KEY=x-api-key                        clients told apart by this header, not the address
+reads = Limit('reads', concurrency=16, queue=64, timeout=0.5)
+writes = Limit('writes', concurrency=8, queue=64, timeout=1.0)      # there is one writer anyway
+ADMISSION_LIMITS = {
+    '* /api/customers/changes': None,                   # streams that last; never limited
+    'GET /api/customers': Limit('list', concurrency=4, queue=8, timeout=2.0),
+    'POST /api/customers/batch-get': Limit('batch', concurrency=4, queue=8, timeout=2.0),
+    'GET /api/customers/{cust_id}': reads,              # and /search, /stats
+    'POST /api/customers': writes,
+    'PUT|DELETE /api/customers/{cust_id}': writes,
+}
+default_limit = Limit('default', concurrency=8, queue=32, timeout=1.0)
+if os.environ.get('ADMISSION', 'on') != 'off':
+    override_limits(list(ADMISSION_LIMITS.values()) + [default_limit], os.environ.get('ADMISSION_LIMITS', ''))
+    rate_limiter = None
+    if 'RATE_LIMIT' in os.environ:
+        rate_limiter = RateLimiter(float(os.environ['RATE_LIMIT']), float(os.environ.get('RATE_BURST', 0)) or None)
+    # the innermost middleware, so that the responses it rejects get the CORS headers too
+    app.add_middleware(AdmissionMiddleware, limits=ADMISSION_LIMITS, default=default_limit,
+                       rate_limiter=rate_limiter, client_header=os.environ.get('RATE_LIMIT_KEY'))
+
 app.add_middleware(CORSMiddleware, 
     allow_origins=["http://127.0.0.1:5500", 'http://localhost:5500', 'http://192.168.1.75:5500'],
     allow_methods=['*'],
     allow_headers=['*'])
 
+# gzip/deflate/br for the responses bigger than 1 KB, if the client accepts them
+app.add_middleware(CompressionMiddleware, minimum_size=1024, level=6)
+
+# request counts/latencies, served as GET /metrics
+app.add_middleware(MetricsMiddleware)
+
 @app.on_event('startup')
 def startup_event():
+    global store, get_all_customers, get_customer, get_customers_by_ids, add_customer, delete_customer, update_customer
+    if SHARDS_DIR:
+        from sharded_db import ShardedStore
+        store = ShardedStore(SHARDS_DIR)
+        get_all_customers, get_customer, get_customers_by_ids = \
+            store.get_all_customers, store.get_customer, store.get_customers_by_ids
+        add_customer, delete_customer, update_customer = store.add_customer, store.delete_customer, store.update_customer
+        return      # customersdb.sqlite is not used: no init_db(), no write batching
+    # pragma synchronous of the writes (default: SQLite's, full), e.g. WRITE_SYNCHRONOUS=normal
+    db.SYNCHRONOUS = os.environ.get('WRITE_SYNCHRONOUS')
     init_db()
+    # group commit of the writes, e.g. WRITE_BATCH_SIZE=200 WRITE_BATCH_DELAY_MS=2
+    if 'WRITE_BATCH_SIZE' in os.environ:
+        enable_write_batching(max_batch=int(os.environ['WRITE_BATCH_SIZE']),
+                              max_delay=float(os.environ.get('WRITE_BATCH_DELAY_MS', 0)) / 1000,
+                              synchronous=os.environ.get('WRITE_SYNCHRONOUS', 'full'))
+
+@app.on_event('shutdown')
+def shutdown_event():
+    disable_write_batching()
+    if store is not None:
+        store.close()
+
+
+# the changes to the customers, pushed to the clients as Server-Sent Events
+feed = None
+
+@app.on_event('startup')
+async def start_change_feed():
+    global feed
+    if SHARDS_DIR:
+        return      # not available with sharded storage (see handle_changes)
+    # the last CHANGE_RETENTION changes (default 100000) are kept for clients to resume from
+    feed = ChangeFeed(get_changes, last_change_seq(), prune=prune_changes,
+                      retention=int(os.environ.get('CHANGE_RETENTION', 100_000)))
+    feed.start()
+    change_listeners.append(feed.notify)
+
+@app.on_event('shutdown')
+async def stop_change_feed():
+    if feed is None:
+        return
+    change_listeners.remove(feed.notify)
+    await feed.stop()
 
 
 class Customer(BaseModel):
@@ -23,9 +113,75 @@ class Customer(BaseModel):
     city: str = 'Bangalore'
 
 
+class CustomerIds(BaseModel):
+    ids: list[int]
+
+
+MAX_BATCH_SIZE = 5000
+
+def get_batch(ids):
+    # in the order asked for, with an explicit entry for the ones that do not exist
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(400, f'At most {MAX_BATCH_SIZE} ids can be fetched at once')
+    found = get_customers_by_ids(ids)
+    return [{'id': i, 'found': True, 'customer': found[i]} if i in found else {'id': i, 'found': False}
+            for i in ids]
+
+
+# GET /api/customers?ids=1,2,3 fetches just those customers in one go
 @app.get('/api/customers')
-def handle_get_all():
-    return get_all_customers()
+def handle_get_all(ids: str | None = None):
+    if ids is None:
+        return get_all_customers()
+    try:
+        ids = [int(i) for i in ids.split(',') if i.strip()]
+    except ValueError:
+        raise HTTPException(400, 'ids must be a comma separated list of integers')
+    return get_batch(ids)
+
+
+# the same, for lists of ids too long for a URL
+@app.post('/api/customers/batch-get')
+def handle_batch_get(body: CustomerIds):
+    return get_batch(body.ids)
+
+
+# GET /api/customers/changes?since=120 streams the changes after 120 (default: from now on);
+# a reconnecting EventSource sends the last seq it got as Last-Event-ID
+@app.get('/api/customers/changes')
+async def handle_changes(request: Request, since: int | None = None):
+    if SHARDS_DIR:
+        raise HTTPException(501, 'The change feed is not available with sharded storage')
+    if since is None and request.headers.get('last-event-id', '').isdigit():
+        since = int(request.headers['last-event-id'])
+    return StreamingResponse(feed.subscribe(since), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# GET /api/customers/search?q=vin%20kay&field=name&limit=20&offset=0
+# (declared before /api/customers/{cust_id}, which would take 'search' for an id)
+@app.get('/api/customers/search')
+def handle_search(q: str, field: str | None = None,
+                  limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0)):
+    if SHARDS_DIR:
+        raise HTTPException(501, 'Search is not available with sharded storage')
+    try:
+        results = search_customers(q, field, limit + 1, offset)
+    except ValueError as err:
+        raise HTTPException(400, str(err))
+    # one more than asked for is fetched, to know if there is a next page
+    next_offset = offset + limit if len(results) > limit else None
+    return {'query': q, 'offset': offset, 'limit': limit, 'next_offset': next_offset,
+            'results': results[:limit]}
+
+
+# GET /api/customers/stats: the number of customers, in all and by city;
+# GET /api/customers/stats?city=Bangalore: of one city. Kept by triggers, not counted (see db.py)
+@app.get('/api/customers/stats')
+def handle_stats(city: str | None = None):
+    if SHARDS_DIR:
+        raise HTTPException(501, 'The stats are not available with sharded storage')
+    return get_customer_stats(city)
 
 
 @app.get('/api/customers/{cust_id}')
@@ -72,5 +228,7 @@ def handle_post(cust_id: int, customer: Customer):
 def index():
     return {'message': 'Welcome to FastAPI training'}
 
+# for development; python serve.py runs it in production (no reload, preforked workers)
 if __name__ == '__main__':
+    import uvicorn
     uvicorn.run(app='ex45_fastapi_sqlite_rest_demo:app', host='0.0.0.0', port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+Load generator and benchmark for the customer services (ex43, ex44, ex45).
+
+    python loadtest.py ex45 --start-server --requests 5000 --concurrency 50 \\
+        --mix get=60,list=5,post=15,put=10,delete=10 --out run.json
+
+    python loadtest.py ex45 --start-server --baseline baseline.json        # compare with a stored run
+    python loadtest.py ex45 --start-server --out baseline.json             # (re)create the baseline
+
+Runs `--concurrency` asyncio workers with one shared httpx.AsyncClient, each taking
+the next request from a shared counter until `--requests` are done. The operations
+are picked at random (with --seed for repeatable runs) according to --mix:
+
+    get     GET /api/customers/{id}        list    GET /api/customers
+    post    POST /api/customers            put     PUT /api/customers/{id}
+    delete  DELETE /api/customers/{id}
+
+Operations a service does not support (ex43/ex44 have no PUT/DELETE) are left out.
+POSTs use unique emails/phones, and PUT/DELETE only touch customers created by the
+run itself. The report (RPS, p50/p95/p99 latencies, error rates, overall and per
+operation) is printed and written as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx     # pip install httpx
+
+from metrics import percentile
+
+SERVICES = {
+    'ex43': dict(port=8080, ops={'get', 'list', 'post'},
+                 command=[sys.executable, '-m', 'flask', '--app', 'ex43_flask_rest_demo', 'run', '--port', '{port}']),
+    'ex44': dict(port=8000, ops={'get', 'list', 'post'},
+                 command=[sys.executable, '-m', 'uvicorn', 'ex44_fastapi_rest_demo:app', '--port', '{port}']),
+    'ex45': dict(port=8000, ops={'get', 'list', 'post', 'put', 'delete'},
+                 command=[sys.executable, '-m', 'uvicorn', 'ex45_fastapi_sqlite_rest_demo:app', '--port', '{port}']),
+    # ex45 the way it runs in production (see serve.py)
+    'ex45-serve': dict(port=8000, ops={'get', 'list', 'post', 'put', 'delete'},
+                       command=[sys.executable, 'serve.py', '--port', '{port}', '--workers', '4']),
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        op, weight = part.split('=')
+        mix[op.strip()] = float(weight)
+    return mix
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return dict(requests=n, rps=round(n / elapsed, 1) if elapsed else None,
+                errors=errors, error_rate=round(errors / n, 4) if n else None,
+                p50_ms=ms(percentile(latencies, 50)), p95_ms=ms(percentile(latencies, 95)),
+                p99_ms=ms(percentile(latencies, 99)), max_ms=ms(latencies[-1] if latencies else None))
+
+
+class LoadTest:
+    def __init__(self, base_url, mix, requests, concurrency, seed):
+        self.base_url = base_url
+        self.ops = list(mix)
+        self.weights = list(mix.values())
+        self.requests = requests
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        self.run_id = f'{int(time.time())}{os.getpid()}'
+        self.issued = 0
+        self.created = []       # ids of customers created by this run
+        self.known_ids = []     # ids that exist when the run starts
+        self.latencies = {op: [] for op in self.ops}
+        self.errors = {op: 0 for op in self.ops}
+        self.statuses = {}
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30) as client:
+            response = await client.get('/api/customers')
+            response.raise_for_status()
+            self.known_ids = [c['id'] for c in response.json()]
+
+            start = time.perf_counter()
+            await asyncio.gather(*[self.worker(client) for _ in range(self.concurrency)])
+            self.elapsed = time.perf_counter() - start
+
+    async def worker(self, client):
+        while self.issued < self.requests:
+            self.issued += 1
+            op = self.random.choices(self.ops, self.weights)[0]
+            # nothing of our own to update/delete yet
+            if op in ('put', 'delete') and not self.created:
+                op = 'post'
+            request = self.make_request(op)
+
+            start = time.perf_counter()
+            try:
+                response = await client.request(**request)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 'error'
+            latency = time.perf_counter() - start
+
+            self.latencies.setdefault(op, []).append(latency)
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            ok = status != 'error' and (status < 400 or (op == 'get' and status == 404))
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+            elif op == 'post':
+                self.created.append(response.json()['id'])
+
+    def make_request(self, op):
+        n = self.issued
+        if op == 'get':
+            ids = self.known_ids + self.created
+            cust_id = self.random.choice(ids) if ids else 1
+            return dict(method='GET', url=f'/api/customers/{cust_id}')
+        if op == 'list':
+            return dict(method='GET', url='/api/customers')
+        customer = dict(name=f'Load Test {n}', email=f'lt{self.run_id}.{n}@xmpl.com',
+                        phone=f'{self.run_id}{n}', city='Bangalore')
+        if op == 'post':
+            return dict(method='POST', url='/api/customers', json=customer)
+        if op == 'put':
+            cust_id = self.random.choice(self.created)
+            return dict(method='PUT', url=f'/api/customers/{cust_id}', json=customer)
+        if op == 'delete':
+            cust_id = self.created.pop(self.random.randrange(len(self.created)))
+            return dict(method='DELETE', url=f'/api/customers/{cust_id}')
+        raise ValueError(f'Unknown operation {op!r}')
+
+    def report(self):
+        all_latencies = [v for values in self.latencies.values() for v in values]
+        return dict(
+            overall=summarize(all_latencies, sum(self.errors.values()), self.elapsed),
+            by_operation={op: summarize(values, self.errors.get(op, 0), self.elapsed)
+                          for op, values in self.latencies.items() if values},
+            statuses=self.statuses,
+        )
+
+
+def start_server(service, port):
+    config = SERVICES[service]
+    command = [part.format(port=port) for part in config['command']]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f'http://127.0.0.1:{port}/', timeout=1)
+            return server
+        except httpx.HTTPError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'could not start {service}: {" ".join(command)}')
+
+
+def compare(result, baseline, tolerance):
+    """prints the change of every metric; returns False if any got worse by more than tolerance"""
+    ok = True
+    print(f'\n{"compared with the baseline":28} {"baseline":>12} {"this run":>12} {"change":>9}')
+    for key, higher_is_better in [('rps', True), ('p50_ms', False), ('p95_ms', False),
+                                  ('p99_ms', False), ('error_rate', False)]:
+        old, new = baseline['overall'][key], result['overall'][key]
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+        worse = -change if higher_is_better else change
+        flag = '  <-- worse' if worse > tolerance else ''
+        ok = ok and not flag
+        print(f'{key:28} {old:12} {new:12} {change:+9.1%}{flag}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the customer services')
+    parser.add_argument('service', choices=SERVICES, help='which service is being tested')
+    parser.add_argument('--url', help='base url of a running service (default http://127.0.0.1:<port>)')
+    parser.add_argument('--port', type=int, help='port of the service (default: its usual one)')
+    parser.add_argument('--start-server', action='store_true', help='start (and stop) the service for the run')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--mix', default='get=70,list=5,post=15,put=5,delete=5', help='op=weight,...')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='write the results (JSON) into this file')
+    parser.add_argument('--baseline', help='a results file to compare this run with')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed regression (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    config = SERVICES[args.service]
+    port = args.port or config['port']
+    mix = {op: w for op, w in parse_mix(args.mix).items() if op in config['ops'] and w > 0}
+    skipped = set(parse_mix(args.mix)) - set(mix)
+    if skipped:
+        print(f'{args.service} does not support {sorted(skipped)}; left out of the mix')
+
+    server = start_server(args.service, port) if args.start_server else None
+    try:
+        test = LoadTest(args.url or f'http://127.0.0.1:{port}', mix, args.requests, args.concurrency, args.seed)
+        asyncio.run(test.run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    result = dict(service=args.service, started_at=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  config=dict(requests=args.requests, concurrency=args.concurrency, mix=mix, seed=args.seed),
+                  **test.report())
+
+    print(f'{"":10} {"requests":>9} {"rps":>9} {"errors":>7} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for label, s in [('overall', result['overall'])] + list(result['by_operation'].items()):
+        print(f'{label:10} {s["requests"]:9} {s["rps"]:9} {s["errors"]:7} {s["p50_ms"]:9} {s["p95_ms"]:9} {s["p99_ms"]:9}')
+
+    if args.out:
+        with open(args.out, 'wt', encoding='utf-8') as file:
+            json.dump(result, file, indent=3)
+        print(f'results written to {args.out}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if not compare(result, baseline, args.tolerance):
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
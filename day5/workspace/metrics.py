@@ -0,0 +1,265 @@
+"""
+Request metrics for the FastAPI apps (ex44, ex45), in Prometheus text format.
+
+    app.add_middleware(MetricsMiddleware)
+
+MetricsMiddleware is a plain ASGI middleware (no BaseHTTPMiddleware, which runs
+every request through an extra task and stream), and records per route:
+
+    http_requests_total                 by method, route and status code
+    http_requests_in_flight             requests being handled right now
+    http_request_duration_seconds       latency histogram
+    http_request_db_seconds             time spent inside the db.py calls, per request
+
+and, for the functions of db.py decorated with @track_db_time:
+
+    db_call_duration_seconds            latency histogram per db function
+
+and, with the AdmissionMiddleware of admission.py, its settings and state per limit:
+
+    http_admission_concurrency_limit, http_admission_queue_limit, http_admission_queue_timeout_seconds
+    http_admission_active, http_admission_queued     slots in use, requests waiting for one
+    http_admission_wait_seconds         time waited for a slot (histogram)
+    http_requests_rejected_total        by limit and reason (queue_full, timeout, rate_limited)
+    http_rate_limit_requests_per_second, http_rate_limit_burst, http_rate_limit_clients
+
+GET /metrics is answered by the middleware itself.
+"""
+import asyncio
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def percentile(sorted_values, p):
+    """nearest-rank percentile (p in 0..100) of a sorted list; None for an empty one"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)      # the last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = {}          # (method, route, status) -> count
+        self.durations = {}         # (method, route) -> Histogram
+        self.db_per_request = {}    # (method, route) -> Histogram
+        self.db_calls = {}          # function -> Histogram
+        self.in_flight = 0
+        self.limits = {}            # name -> admission.Limit
+        self.admission_waits = {}   # limit name -> Histogram
+        self.rejected = {}          # (limit name, reason) -> count
+        self.rate_limiter = None
+        # the request metrics are only updated on the event loop thread; the db
+        # functions run in the threadpool, so their histograms need a lock
+        self.db_lock = threading.Lock()
+
+    def render(self):
+        lines = ['# HELP http_requests_total Number of HTTP requests handled.',
+                 '# TYPE http_requests_total counter']
+        for (method, route, status), n in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {n}')
+
+        lines += ['# HELP http_requests_in_flight Number of HTTP requests being handled.',
+                  '# TYPE http_requests_in_flight gauge',
+                  f'http_requests_in_flight {self.in_flight}']
+
+        for name, help_text, histograms in [
+            ('http_request_duration_seconds', 'Time taken to handle a request.', self.durations),
+            ('http_request_db_seconds', 'Time spent in db.py calls while handling a request.', self.db_per_request),
+        ]:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (method, route), h in sorted(histograms.items()):
+                lines.extend(h.lines(name, f'method="{method}",route="{route}"'))
+
+        if self.limits:
+            for name, help_text, value in [
+                ('http_admission_concurrency_limit', 'Requests handled at once at most.', lambda l: l.concurrency),
+                ('http_admission_queue_limit', 'Requests waiting for a slot at most.', lambda l: l.queue),
+                ('http_admission_queue_timeout_seconds', 'Time a request waits for a slot at most.', lambda l: l.timeout),
+                ('http_admission_active', 'Requests being handled.', lambda l: l.active),
+                ('http_admission_queued', 'Requests waiting for a slot.', lambda l: len(l.waiters)),
+            ]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+                lines += [f'{name}{{limit="{n}"}} {value(l)}' for n, l in sorted(self.limits.items())]
+            lines += ['# HELP http_admission_wait_seconds Time waited for a slot.',
+                      '# TYPE http_admission_wait_seconds histogram']
+            for n, h in sorted(self.admission_waits.items()):
+                lines.extend(h.lines('http_admission_wait_seconds', f'limit="{n}"'))
+        if self.limits or self.rate_limiter is not None:
+            lines += ['# HELP http_requests_rejected_total Requests turned away by the admission control.',
+                      '# TYPE http_requests_rejected_total counter']
+            for (limit, reason), n in sorted(self.rejected.items()):
+                lines.append(f'http_requests_rejected_total{{limit="{limit}",reason="{reason}"}} {n}')
+        if self.rate_limiter is not None:
+            for name, help_text, value in [
+                ('http_rate_limit_requests_per_second', 'Requests per second allowed per client.', self.rate_limiter.rate),
+                ('http_rate_limit_burst', 'Requests allowed at once per client.', self.rate_limiter.burst),
+                ('http_rate_limit_clients', 'Clients being tracked.', len(self.rate_limiter.buckets)),
+            ]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+
+        lines += ['# HELP db_call_duration_seconds Time taken by a db.py function.',
+                  '# TYPE db_call_duration_seconds histogram']
+        with self.db_lock:
+            for fn, h in sorted(self.db_calls.items()):
+                lines.extend(h.lines('db_call_duration_seconds', f'function="{fn}"'))
+        return '\n'.join(lines) + '\n'
+
+    def count_rejected(self, limit, reason):
+        self.rejected[limit, reason] = self.rejected.get((limit, reason), 0) + 1
+
+
+metrics = Metrics()
+
+# seconds spent in db calls by the current request; a list, so that the threadpool
+# thread running the endpoint (which gets a copy of the context) adds to the same one
+_db_time = ContextVar('db_time', default=None)
+
+
+def track_db_time(fn):
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_db_time = _db_time.get()
+            if request_db_time is not None:
+                request_db_time[0] += elapsed
+            with metrics.db_lock:
+                h = metrics.db_calls.get(name)
+                if h is None:
+                    h = metrics.db_calls[name] = Histogram()
+                h.observe(elapsed)
+    return wrapper
+
+
+class MetricsMiddleware:
+    def __init__(self, app, path='/metrics'):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        if scope['path'] == self.path:
+            return await self.__send_metrics(send)
+
+        status = 500
+        db_time = [0.0]
+        token = _db_time.set(db_time)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.in_flight -= 1
+            _db_time.reset(token)
+            # the route template (/api/customers/{cust_id}) is put in the scope by fastapi;
+            # the raw path would make a new time series for every customer id
+            # (requests rejected by the admission control never get to the router)
+            route = scope.get('route')
+            key = (scope['method'], route.path if route is not None else scope.get('admission_route', 'unmatched'))
+            counter_key = key + (status,)
+            metrics.requests[counter_key] = metrics.requests.get(counter_key, 0) + 1
+            h = metrics.durations.get(key)
+            if h is None:
+                h = metrics.durations[key] = Histogram()
+                metrics.db_per_request[key] = Histogram()
+            h.observe(elapsed)
+            metrics.db_per_request[key].observe(db_time[0])
+
+    async def __send_metrics(self, send):
+        body = metrics.render().encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def main():
+    # overhead of the middleware: the same app, called directly through ASGI, with and without it
+    from fastapi import FastAPI
+
+    def make_app():
+        app = FastAPI()
+
+        @app.get('/api/customers/{cust_id}')
+        async def handle_get_by_id(cust_id: int):
+            return {'id': cust_id}
+
+        return app
+
+    async def run(app, n):
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': '/api/customers/1', 'raw_path': b'/api/customers/1',
+                 'root_path': '', 'query_string': b'', 'headers': [], 'server': ('127.0.0.1', 8000)}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            pass
+
+        start = time.perf_counter()
+        for _ in range(n):
+            await app(dict(scope), receive, send)
+        return time.perf_counter() - start
+
+    plain = make_app()
+    measured = make_app()
+    measured.add_middleware(MetricsMiddleware)
+
+    n = 20_000
+    for app in (plain, measured):
+        asyncio.run(run(app, 1000))     # warm up
+    without = min(asyncio.run(run(plain, n)) for _ in range(3))
+    with_middleware = min(asyncio.run(run(measured, n)) for _ in range(3))
+    print(f'{n:,} requests through ASGI')
+    print(f'without middleware : {without / n * 1e6:8.1f} µs per request')
+    print(f'with middleware    : {with_middleware / n * 1e6:8.1f} µs per request')
+    print(f'overhead           : {(with_middleware - without) / n * 1e6:8.1f} µs per request')
+    print()
+    print(metrics.render()[:600])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Content negotiation and streamed representations of a list of customers.
+
+    media_type = negotiate(request.headers.get('Accept'), REPRESENTATIONS)
+    body = REPRESENTATIONS[media_type](customers)      # a generator of text chunks
+
+JSON (one array), NDJSON (one object per line) and XML are produced row by row,
+a batch of rows per chunk, so the response starts right away and the memory used
+does not depend on the length of the list. In XML a field whose name is not a valid
+tag is written as <field name="...">, and control characters become U+FFFD.
+
+    python representations.py           # time to first byte and memory, by list size
+"""
+import json
+import re
+import time
+import tracemalloc
+from functools import lru_cache
+from xml.sax.saxutils import escape, quoteattr
+
+try:
+    import orjson       # pip install orjson
+except ImportError:
+    orjson = None
+
+CHUNK_ROWS = 200
+
+# a subset of the XML names: what a column name can safely become as a tag
+XML_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_.-]*', re.ASCII)
+# characters XML 1.0 does not allow at all, not even as &#...; references
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+
+def parse_accept(header):
+    """'text/xml;q=0.5, application/*' -> [('text/xml', 0.5), ('application/*', 1.0)]"""
+    if not header:
+        return [('*/*', 1.0)]
+    ranges = []
+    for part in header.split(','):
+        media_type, *params = [p.strip() for p in part.split(';')]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = -1.0
+        if 0 <= q <= 1:
+            ranges.append((media_type.lower(), q))
+    return ranges
+
+
+def negotiate(header, available):
+    """
+    the media type from `available` the client prefers, or None if none is acceptable.
+    A type gets the q of the most specific range matching it (text/xml before text/*
+    before */*); ties go to the first one in `available`.
+    """
+    ranges = parse_accept(header)
+    best, best_q = None, 0.0
+    for media_type in available:
+        main_type = media_type.split('/')[0]
+        q, specificity = 0.0, -1
+        for r, r_q in ranges:
+            if r == media_type:
+                s = 2
+            elif r == f'{main_type}/*':
+                s = 1
+            elif r == '*/*':
+                s = 0
+            else:
+                continue
+            if s > specificity:
+                q, specificity = r_q, s
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def _batches(rows, size=CHUNK_ROWS):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _dicts(batch):
+    # sqlite3.Row objects are not something json can encode
+    return batch if isinstance(batch[0], dict) else [dict(r) for r in batch]
+
+
+def _dumps(obj):
+    return orjson.dumps(obj).decode('utf-8') if orjson is not None else json.dumps(obj)
+
+
+def json_chunks(rows):
+    separator = '['
+    for batch in _batches(rows):
+        # one dumps() for the whole batch, without its [ ]
+        yield separator + _dumps(_dicts(batch))[1:-1]
+        separator = ','
+    yield '[]' if separator == '[' else ']'
+
+
+def ndjson_chunks(rows):
+    # a dumps() per row; json.dumps() sets up a new encoder for each call, orjson does not
+    if orjson is not None:
+        for batch in _batches(rows):
+            yield b''.join([orjson.dumps(r) + b'\n' for r in _dicts(batch)]).decode('utf-8')
+        return
+    for batch in _batches(rows):
+        yield ''.join([json.dumps(r) + '\n' for r in _dicts(batch)])
+
+
+def _text(value):
+    value = str(value)
+    # escape() does three replace() calls; most values have nothing to escape
+    return escape(value) if '&' in value or '<' in value or '>' in value else value
+
+
+def _tags(key):
+    # (start tag, end tag, empty element); a key that is not an XML name becomes <field name="...">
+    key = str(key)
+    if XML_NAME.fullmatch(key):
+        return f'<{key}>', f'</{key}>', f'<{key}/>'
+    start = f'<field name={quoteattr(key)}'
+    return start + '>', '</field>', start + '/>'
+
+
+@lru_cache(maxsize=64)
+def _row_tags(keys):
+    # the rows of a list nearly always have the same keys, so this is worked out once
+    return [_tags(k) for k in keys]
+
+
+def _xml_element(row, item):
+    row = dict(row)
+    fields = ''.join([empty if v is None else f'{start}{_text(v)}{end}'
+                      for (start, end, empty), v in zip(_row_tags(tuple(row)), row.values())])
+    return f'<{item}>{fields}</{item}>'
+
+
+def _xml_chars(text):
+    # control characters (in the values) become U+FFFD; isprintable() is the quick check,
+    # it is True for nearly every chunk (False for tabs or new lines, and those are fine)
+    return text if text.isprintable() else XML_INVALID_CHARS.sub('\ufffd', text)
+
+
+def xml_chunks(rows, root='customers', item='customer'):
+    for name in (root, item):
+        if not XML_NAME.fullmatch(name):
+            raise ValueError(f'{name!r} is not an XML name')
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<{root}>'
+    for batch in _batches(rows):
+        yield _xml_chars(''.join([_xml_element(r, item) for r in batch]))
+    yield f'</{root}>\n'
+
+
+# in the order of preference when the client does not care
+REPRESENTATIONS = {
+    'application/json': json_chunks,
+    'application/x-ndjson': ndjson_chunks,
+    'application/xml': xml_chunks,
+    'text/xml': xml_chunks,
+}
+
+
+def main():
+    # time and memory are measured in separate runs, tracemalloc slows everything down
+    def measure(produce):
+        start = time.perf_counter()
+        chunks = produce()
+        size = len(next(chunks))
+        first = time.perf_counter()
+        for chunk in chunks:
+            size += len(chunk)      # as if written to the socket, and dropped
+        end = time.perf_counter()
+
+        tracemalloc.start()
+        for chunk in produce():
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return first - start, end - start, peak, size
+
+    def rows(n):
+        return [dict(id=i, name=f'Customer {i}', city='Bangalore', email=f'c{i}@xmpl.com', phone=f'9{i:09}')
+                for i in range(n)]
+
+    print(f'{"rows":>10} {"format":22} {"first byte ms":>14} {"total ms":>10} {"peak MB":>9} {"body MB":>9}')
+    for n in (10_000, 100_000, 1_000_000):
+        data = rows(n)
+
+        results = [('json.dumps (whole)', measure(lambda: iter([json.dumps(data)])))]
+        for media_type in ('application/json', 'application/x-ndjson', 'application/xml'):
+            results.append((media_type, measure(lambda: REPRESENTATIONS[media_type](data))))
+        for label, (first, total, peak, size) in results:
+            print(f'{n:10,} {label:22} {first * 1000:14.2f} {total * 1000:10.1f} {peak / 1e6:9.2f} {size / 1e6:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Compression of the responses of the customer services, negotiated with Accept-Encoding.
+
+    app.add_middleware(CompressionMiddleware, minimum_size=1024, level=6)          # ex44, ex45 (ASGI)
+    app.wsgi_app = WsgiCompressionMiddleware(app.wsgi_app, minimum_size=1024)      # ex43 (Flask)
+
+gzip and deflate come with zlib; br is offered too if the brotli package is
+installed. The client's preferences (q-values) decide, with ties going to the
+order of `encodings`. Responses are compressed when:
+
+- the client accepts one of the encodings
+- the content type is a text one (json, xml, text/*...); images and the like are
+  already compressed
+- the response is not encoded already
+- the body is at least minimum_size bytes; it is not worth the CPU below that
+  (a streamed response, whose size is not known, is always compressed)
+
+Streamed responses are compressed chunk by chunk, with a flush after every chunk,
+so they stay streamed: the client gets each chunk as soon as it is produced.
+
+    python response_compression.py          # bytes saved, CPU per MB and throughput by level
+"""
+import time
+import zlib
+
+from representations import json_chunks, parse_accept, xml_chunks
+
+try:
+    import brotli       # pip install brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/xml',
+                      'application/javascript', 'image/svg+xml')
+# Server-Sent Events (the change feed of ex45): compressed, the events would sit in the
+# compressor's buffer instead of reaching the client as they happen
+UNCOMPRESSED_TYPES = ('text/event-stream',)
+
+
+class ZlibCompressor:
+    # wbits 31 = gzip header and trailer, 15 = zlib (the "deflate" content coding)
+    def __init__(self, level, wbits):
+        self.__obj = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data, flush=False):
+        out = self.__obj.compress(data)
+        return out + self.__obj.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data=b''):
+        return self.__obj.compress(data) + self.__obj.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, level):
+        # brotli levels go from 0 to 11; the zlib ones (1-9) are mapped onto 1-11
+        self.__obj = brotli.Compressor(quality=min(11, max(0, round(level * 11 / 9))))
+
+    def compress(self, data, flush=False):
+        out = self.__obj.process(data)
+        return out + self.__obj.flush() if flush else out
+
+    def finish(self, data=b''):
+        return self.__obj.process(data) + self.__obj.finish()
+
+
+COMPRESSORS = {
+    'gzip': lambda level: ZlibCompressor(level, 31),
+    'deflate': lambda level: ZlibCompressor(level, 15),
+}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+
+
+def choose_encoding(accept_encoding, encodings):
+    """the encoding from `encodings` the client prefers; None means send it as it is"""
+    if not accept_encoding:
+        return None
+    q_values = dict(parse_accept(accept_encoding))
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = q_values.get(encoding, q_values.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def is_compressible(content_type):
+    if content_type is None:
+        return False
+    media_type = content_type.split(';')[0].strip().lower()
+    return media_type.startswith(COMPRESSIBLE_TYPES) and media_type not in UNCOMPRESSED_TYPES
+
+
+def _encodings(encodings):
+    return tuple(e for e in encodings if e in COMPRESSORS)
+
+
+class CompressionMiddleware:
+    """ASGI middleware"""
+    def __init__(self, app, minimum_size=1024, level=6, encodings=('br', 'gzip', 'deflate')):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.encodings = _encodings(encodings)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        headers = dict(scope['headers'])
+        encoding = choose_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'), self.encodings)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor
+            if message['type'] == 'http.response.start':
+                # held back until the first part of the body shows how big the response is
+                start_message = message
+                return
+            if message['type'] != 'http.response.body' or start_message is None:
+                return await send(message)
+
+            body, more_body = message.get('body', b''), message.get('more_body', False)
+            if compressor is None:
+                response_headers = dict(start_message['headers'])
+                if (b'content-encoding' in response_headers
+                        or not is_compressible(response_headers.get(b'content-type', b'').decode('latin-1'))
+                        or (not more_body and len(body) < self.minimum_size)):
+                    await send(start_message)
+                    start_message = None        # the rest goes through untouched
+                    return await send(message)
+
+                compressor = COMPRESSORS[encoding](self.level)
+                new_headers = [(k, v) for k, v in start_message['headers'] if k not in (b'content-length', b'vary')]
+                vary = response_headers.get(b'vary')
+                new_headers.append((b'vary', vary + b', Accept-Encoding' if vary else b'Accept-Encoding'))
+                new_headers.append((b'content-encoding', encoding.encode()))
+                if not more_body:
+                    body = compressor.finish(body)
+                    new_headers.append((b'content-length', str(len(body)).encode()))
+                    await send({**start_message, 'headers': new_headers})
+                    return await send({'type': 'http.response.body', 'body': body})
+                await send({**start_message, 'headers': new_headers})
+
+            body = compressor.compress(body, flush=True) if more_body else compressor.finish(body)
+            await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class WsgiCompressionMiddleware:
+    """WSGI middleware, for the Flask app"""
+    def __init__(self, app, minimum_size=1024, level=6, encodings=('br', 'gzip', 'deflate')):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.encodings = _encodings(encodings)
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'), self.encodings)
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        captured = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None        # the old style write() is not supported
+
+        result = self.app(environ, capture_start_response)
+        status, headers, exc_info = captured
+        response_headers = {k.lower(): v for k, v in headers}
+        length = response_headers.get('content-length')
+        if ('content-encoding' in response_headers or not is_compressible(response_headers.get('content-type'))
+                or (length is not None and int(length) < self.minimum_size)):
+            start_response(status, headers, exc_info)
+            return result
+
+        headers = [(k, v) for k, v in headers if k.lower() not in ('content-length', 'vary')]
+        vary = response_headers.get('vary')
+        headers += [('Vary', f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'),
+                    ('Content-Encoding', encoding)]
+        compressor = COMPRESSORS[encoding](self.level)
+        if length is not None:
+            # the whole body is there already
+            try:
+                body = compressor.finish(b''.join(result))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            start_response(status, headers + [('Content-Length', str(len(body)))], exc_info)
+            return [body]
+
+        start_response(status, headers, exc_info)
+        return self.__stream(result, compressor)
+
+    @staticmethod
+    def __stream(result, compressor):
+        try:
+            for chunk in result:
+                if chunk:
+                    yield compressor.compress(chunk, flush=True)
+            yield compressor.finish()
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def main():
+    rows = [dict(id=i, name=f'Customer {i}', city=('Bangalore', 'Mysore', 'Dallas')[i % 3],
+                 email=f'customer{i}@xmpl.com', phone=f'9{i:09}') for i in range(200_000)]
+    bodies = [('JSON', [c.encode() for c in json_chunks(rows)]), ('XML', [c.encode() for c in xml_chunks(rows)])]
+    wan_mbit = 50       # the link the effective throughput is computed for
+
+    print(f'{"body":6} {"encoding":9} {"level":>5} {"MB":>8} {"saved":>7} {"CPU ms/MB":>10} '
+          f'{"compress MB/s":>14} {f"time on {wan_mbit} Mbit/s":>18}')
+    for label, chunks in bodies:
+        size = sum(len(c) for c in chunks)
+        print(f'{label:6} {"identity":9} {"":5} {size / 1e6:8.2f} {"":7} {"":10} {"":14} '
+              f'{size * 8 / (wan_mbit * 1e6):17.2f}s')
+        for encoding in COMPRESSORS:
+            for level in (1, 6, 9):
+                start = time.process_time()
+                compressor = COMPRESSORS[encoding](level)
+                # streamed as the services do it: a flush after every chunk
+                compressed = sum(len(compressor.compress(c, flush=True)) for c in chunks) + len(compressor.finish())
+                cpu = time.process_time() - start
+                transfer = compressed * 8 / (wan_mbit * 1e6)
+                print(f'{label:6} {encoding:9} {level:5} {compressed / 1e6:8.2f} {1 - compressed / size:7.1%} '
+                      f'{cpu * 1000 / (size / 1e6):10.1f} {size / 1e6 / cpu:14.1f} {cpu + transfer:17.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Customer search at scale: LIKE '%x%' scans against the fts5 index of db.py.
+
+    python search_benchmark.py --rows 10000000 --file /tmp/customers_big.sqlite
+
+Fills a separate database (the service's customersdb.sqlite is not touched) with
+generated customers, builds the search index the way init_db() does for existing
+data, and times a few typical support-staff lookups both ways.
+"""
+import argparse
+import os
+import random
+import time
+
+import db
+
+FIRST_NAMES = ['Vinod', 'John', 'Jane', 'Ramesh', 'Suresh', 'Priya', 'Anita', 'Rahul', 'Kiran', 'Deepa',
+               'Arjun', 'Meera', 'Sanjay', 'Lakshmi', 'Harish', 'Kavya', 'Naveen', 'Shreya', 'Ajay', 'Divya']
+LAST_NAMES = ['Kumar', 'Doe', 'Sharma', 'Rao', 'Iyer', 'Nair', 'Reddy', 'Patel', 'Gupta', 'Menon',
+              'Shetty', 'Kamath', 'Pai', 'Bhat', 'Hegde', 'Joshi', 'Naik', 'Das', 'Singh', 'Kayartaya']
+CITIES = ['Bangalore', 'Mysore', 'Chennai', 'Hyderabad', 'Mumbai', 'Pune', 'Kolkata', 'Dallas',
+          'New Delhi', 'Mangalore', 'Udupi', 'Hubli']
+DOMAINS = ['xmpl.com', 'gmail.com', 'cyblore.com', 'yahoo.com', 'outlook.com']
+
+
+def generate(rows, seed=1):
+    r = random.Random(seed)
+    for i in range(rows):
+        first, last = r.choice(FIRST_NAMES), r.choice(LAST_NAMES)
+        yield (f'{first} {last}', f'{first.lower()}.{last.lower()}{i}@{r.choice(DOMAINS)}',
+               f'9{i:010}', r.choice(CITIES))
+
+
+def queries(rows):
+    """(text, field, the equivalent LIKE condition); from one particular customer to most of them"""
+    name, email, _, city = next(g for i, g in enumerate(generate(rows)) if i == rows // 2)
+    user = email.split('@')[0]
+    return [
+        (user[:-1], 'email', f"email like '%{user[:-1]}%'"),
+        (f'{name} {city[:3]}', None, f"name like '%{name}%' and city like '%{city[:3]}%'"),
+        ('kayar', 'name', "name like '%kayar%'"),
+        ('ramesh sh', None, "name like '%ramesh sh%'"),
+        ('udu', 'city', "city like '%udu%'"),
+    ]
+
+
+def build(filename, rows):
+    if os.path.exists(filename):
+        os.remove(filename)
+    db.DB_FILE = filename
+    conn = db.get_connection()
+    conn.execute('pragma journal_mode = off')
+    conn.execute('pragma synchronous = off')
+    conn.execute("""create table customers(
+        id integer primary key autoincrement,
+        name varchar(50) not null,
+        email varchar(200) not null unique,
+        phone varchar(50) not null unique,
+        city varchar(100)
+        )""")
+    start = time.perf_counter()
+    with conn:
+        conn.executemany('insert into customers(name, email, phone, city) values (?, ?, ?, ?)', generate(rows))
+    loaded = time.perf_counter()
+    with conn:
+        db.init_search(conn.cursor())
+    indexed = time.perf_counter()
+    conn.close()
+    print(f'{rows:,} customers loaded in {loaded - start:.1f} s, search index built in {indexed - loaded:.1f} s')
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare LIKE scans with the fts5 customer search')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--file', default='customers_search_benchmark.sqlite')
+    parser.add_argument('--reuse', action='store_true', help='use the database built by an earlier run')
+    args = parser.parse_args()
+
+    if not (args.reuse and os.path.exists(args.file)):
+        build(args.file, args.rows)
+    db.DB_FILE = args.file
+
+    rows = db.get_connection().execute('select count(*) from customers').fetchone()[0]
+    conn = db.get_connection()
+    # LIKE can stop at the first 20 rows it comes across, but has to read the whole table
+    # when there are fewer matches (and always, to rank or count them); fts5 ranks all matches
+    print(f'\n{"query":36} {"matches":>9} {"LIKE all ms":>12} {"LIKE 20 ms":>11} {"fts5 20 ms":>11} {"offset 1000 ms":>15}')
+    for text, field, condition in queries(rows):
+        like_time, found = timed(lambda: conn.execute(f'select id from customers where {condition}').fetchall(), 1)
+        first_time, _ = timed(lambda: conn.execute(f'select * from customers where {condition} limit 20').fetchall(), 1)
+        fts_time, _ = timed(lambda: db.search_customers(text, field, limit=20), 5)
+        page_time, _ = timed(lambda: db.search_customers(text, field, limit=20, offset=1000), 5)
+        label = f'{text!r}' + (f' in {field}' if field else '')
+        print(f'{label:36} {len(found):9,} {like_time * 1000:12.1f} {first_time * 1000:11.1f} '
+              f'{fts_time * 1000:11.1f} {page_time * 1000:15.1f}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Production launcher of the customer service (ex45), instead of its __main__ which is
+for development (reload=True).
+
+    python serve.py --workers 4 --port 8000
+    CUSTOMER_SHARDS_DIR=shards python serve.py --workers 4
+
+- no reloader: no file watcher process, and the app is imported once, not twice
+- the app module (fastapi, pydantic, the routes...) is imported here, once, and the
+  workers are forked from this process: they start with everything imported, and share
+  the memory of those modules with it (copy-on-write; gc.freeze() keeps the garbage
+  collector from writing to, and so copying, the pages of the objects already there).
+  uvicorn --workers starts every worker as a new interpreter that imports it all again.
+- all the workers accept on the one listening socket, opened before the fork
+- this process only restarts the workers that die, and stops them on SIGTERM/SIGINT;
+  if a worker fails in its startup handlers, it stops them all and exits with 3
+
+What must not be shared between processes (database connections, the change feed,
+the write batcher, the sharded store) is created after the fork, by the startup
+handlers of each worker. Without os.fork (Windows) it runs one worker, in-process.
+
+    python startup_benchmark.py        # -X importtime and cold start to first response
+"""
+import argparse
+import gc
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import uvicorn     # pip install uvicorn
+
+STARTUP_FAILED = 3      # the exit code of a worker whose startup handlers failed
+
+
+def load_app(spec):
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name or 'app')
+
+
+def listen(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, args):
+    config = uvicorn.Config(app, log_level=args.log_level, access_log=args.access_log,
+                            timeout_keep_alive=args.keep_alive, backlog=args.backlog)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return server.started       # False if the startup handlers failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the customer service with preforked workers')
+    parser.add_argument('--app', default='ex45_fastapi_sqlite_rest_demo:app', help='module:attribute')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--keep-alive', type=int, default=5, help='seconds an idle connection is kept')
+    parser.add_argument('--log-level', default='warning')
+    parser.add_argument('--access-log', action='store_true')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sock = listen(args.host, args.port, args.backlog)
+    app = load_app(args.app)
+
+    if not hasattr(os, 'fork') or args.workers == 1:
+        if not run_worker(app, sock, args):
+            sys.exit(STARTUP_FAILED)
+        return
+
+    # what is there now stays there, in the pages shared with the workers
+    gc.collect()
+    gc.freeze()
+
+    workers = {}        # pid -> start time
+    stopping = False
+    exit_code = 0
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                started = run_worker(app, sock, args)
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+            os._exit(0 if started else STARTUP_FAILED)
+        workers[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.workers):
+        start_worker()
+    print(f'{args.workers} workers of {args.app} on {args.host}:{args.port}, pid {os.getpid()}', flush=True)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if stopping or started is None:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if code == STARTUP_FAILED:
+            # another one would fail the same way (a bad database path, a missing setting...)
+            print(f'worker {pid} failed to start, stopping', flush=True)
+            exit_code = STARTUP_FAILED
+            stop(None, None)
+            continue
+        print(f'worker {pid} exited ({code}), starting another', flush=True)
+        if time.monotonic() - started < 1:
+            time.sleep(1)       # one that dies right away would die again; not in a tight loop
+        start_worker()
+    sock.close()
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+"""
+Customers spread over N SQLite files ("shards") by a hash of the id, as an optional
+replacement for the single customersdb.sqlite of db.py.
+
+    store = ShardedStore('customer_shards')
+    store.add_customer(customer); store.get_customer(cust_id); store.get_all_customers() ...
+
+    python sharded_db.py create customer_shards --shards 4 --from-db customersdb.sqlite
+    python sharded_db.py rebalance customer_shards --shards 8        # offline only
+    python sharded_db.py stats customer_shards
+
+The directory holds shard-000.sqlite ... shard-<N-1>.sqlite, with the customers, and
+index.sqlite, which:
+
+- hands out the ids (so the shard of a new customer is known before it is written)
+- has every email and phone, to keep them unique across all the shards
+- records the number of shards
+
+A write takes the lock of the index file only for the short id/email/phone rows,
+and the lock of one shard for the customer itself, so writers to different shards
+do not wait for each other's commits. A backup or VACUUM is done shard by shard.
+
+get_all_customers() reads all the shards in parallel threads (sqlite releases the
+GIL while it works) and merges them into one stream ordered by id.
+
+If the process dies between the index and the shard write, the index keeps the
+email/phone of a customer that was never written; `stats` lists such entries and
+`repair` removes them.
+"""
+import argparse
+import heapq
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from urllib.parse import quote
+
+SHARD_SCHEMA = """create table if not exists customers(
+    id integer primary key,
+    name varchar(50) not null,
+    email varchar(200) not null,
+    phone varchar(50) not null,
+    city varchar(100)
+)"""
+
+INDEX_SCHEMA = [
+    'create table if not exists meta(key text primary key, value)',
+    'create table if not exists customer_ids(id integer primary key autoincrement)',
+    """create table if not exists unique_keys(
+        kind text not null, value text not null, id integer not null,
+        primary key (kind, value)) without rowid""",
+    'create index if not exists unique_keys_id on unique_keys(id)',
+]
+
+
+def shard_of(cust_id, shards):
+    # crc32 rather than hash(), which is the id itself for ints (no spreading)
+    return zlib.crc32(cust_id.to_bytes(8, 'little', signed=True)) % shards
+
+
+def shard_file(directory, n):
+    return os.path.join(directory, f'shard-{n:03}.sqlite')
+
+
+def _connect(filename, read_only=False):
+    if read_only:
+        conn = sqlite3.connect(f'file:{quote(filename)}?mode=ro', uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(filename, check_same_thread=False)
+        conn.execute('pragma journal_mode = wal')
+        conn.execute('pragma synchronous = normal')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def create_store(directory, shards):
+    os.makedirs(directory, exist_ok=True)
+    index = _connect(os.path.join(directory, 'index.sqlite'))
+    with index:
+        for sql in INDEX_SCHEMA:
+            index.execute(sql)
+        index.execute("insert or replace into meta values ('shards', ?)", [shards])
+    index.close()
+    for n in range(shards):
+        conn = _connect(shard_file(directory, n))
+        conn.execute(SHARD_SCHEMA)
+        conn.close()
+
+
+class ShardedStore:
+    def __init__(self, directory, read_pool_size=4):
+        index_file = os.path.join(directory, 'index.sqlite')
+        if not os.path.exists(index_file):
+            raise FileNotFoundError(f'{directory} has no sharded store; create it with: python sharded_db.py create')
+        self.directory = directory
+        self.index = _connect(index_file)
+        self.shards = self.index.execute("select value from meta where key = 'shards'").fetchone()[0]
+        self.index_lock = threading.Lock()
+        self.writers = [_connect(shard_file(directory, n)) for n in range(self.shards)]
+        self.writer_locks = [threading.Lock() for _ in range(self.shards)]
+        self.read_pool_size = read_pool_size
+        self.readers = [queue.SimpleQueue() for _ in range(self.shards)]
+        self.pool = ThreadPoolExecutor(max_workers=self.shards, thread_name_prefix='shard')
+
+    def close(self):
+        self.pool.shutdown()
+        for conn in [self.index] + self.writers:
+            conn.close()
+        for readers in self.readers:
+            while not readers.empty():
+                readers.get().close()
+
+    def _read(self, shard, fn):
+        """fn(connection) with a read-only connection to the shard"""
+        try:
+            conn = self.readers[shard].get_nowait()
+        except queue.Empty:
+            conn = _connect(shard_file(self.directory, shard), read_only=True)
+        try:
+            return fn(conn)
+        finally:
+            if self.readers[shard].qsize() < self.read_pool_size:
+                self.readers[shard].put(conn)
+            else:
+                conn.close()
+
+    # ---------- reads ----------
+
+    def get_customer(self, cust_id):
+        return self._read(shard_of(cust_id, self.shards),
+                          lambda conn: conn.execute('select * from customers where id = ?', [cust_id]).fetchone())
+
+    def get_customers_by_ids(self, ids):
+        """{id: customer} for the ids that exist, the shards queried in parallel"""
+        by_shard = {}
+        for i in dict.fromkeys(ids):
+            by_shard.setdefault(shard_of(i, self.shards), []).append(i)
+
+        def query(shard, shard_ids):
+            def run(conn):
+                rows = []
+                for start in range(0, len(shard_ids), 900):
+                    chunk = shard_ids[start:start + 900]
+                    sql = f'select * from customers where id in ({",".join("?" * len(chunk))})'
+                    rows += conn.execute(sql, chunk).fetchall()
+                return rows
+            return self._read(shard, run)
+
+        futures = [self.pool.submit(query, shard, shard_ids) for shard, shard_ids in by_shard.items()]
+        return {row['id']: row for f in futures for row in f.result()}
+
+    def iter_all_customers(self, chunk=1000):
+        """all the customers, ordered by id, merged from the shards as they are read"""
+        def shard_rows(conn, cursor, future):
+            try:
+                # the next chunk is fetched (in the pool) while this one is being merged
+                while rows := future.result():
+                    future = self.pool.submit(cursor.fetchmany, chunk)
+                    yield from rows
+            finally:
+                # not while a fetch is still running, when the stream is dropped half way
+                future.cancel() or future.exception()
+                conn.close()
+
+        sources = []
+        for n in range(self.shards):
+            conn = _connect(shard_file(self.directory, n), read_only=True)
+            cursor = conn.execute('select * from customers order by id')
+            # the first chunks of all the shards are read at the same time
+            sources.append(shard_rows(conn, cursor, self.pool.submit(cursor.fetchmany, chunk)))
+        return heapq.merge(*sources, key=lambda row: row[0])
+
+    def get_all_customers(self):
+        return list(self.iter_all_customers())
+
+    # ---------- writes ----------
+
+    def _claim_keys(self, cursor, cust_id, customer):
+        for kind in ('email', 'phone'):
+            try:
+                cursor.execute('insert into unique_keys values (?, ?, ?)', (kind, customer[kind], cust_id))
+            except sqlite3.IntegrityError:
+                # the same message as the unique constraints of db.py give
+                raise ValueError(f'UNIQUE constraint failed: customers.{kind}')
+
+    def _release_keys(self, cust_id):
+        with self.index_lock, self.index:
+            self.index.execute('delete from unique_keys where id = ?', [cust_id])
+
+    def _write_shard(self, cust_id, sql, params):
+        shard = shard_of(cust_id, self.shards)
+        with self.writer_locks[shard], self.writers[shard] as conn:
+            return conn.execute(sql, params).rowcount
+
+    def add_customer(self, customer):
+        with self.index_lock:
+            try:
+                with self.index:
+                    cursor = self.index.execute('insert into customer_ids default values')
+                    cust_id = cursor.lastrowid
+                    self._claim_keys(cursor, cust_id, customer)
+            except sqlite3.DatabaseError as err:
+                raise ValueError(str(err))
+        try:
+            self._write_shard(cust_id, 'insert into customers(id, name, email, phone, city) values (?, ?, ?, ?, ?)',
+                              (cust_id, customer['name'], customer['email'], customer['phone'], customer['city']))
+        except sqlite3.DatabaseError as err:
+            self._release_keys(cust_id)
+            raise ValueError(str(err))
+        customer['id'] = cust_id
+        return customer
+
+    def update_customer(self, cust):
+        cust_id = cust['id']
+        with self.index_lock:
+            try:
+                with self.index:
+                    cursor = self.index.execute('select kind, value from unique_keys where id = ?', [cust_id])
+                    old_keys = cursor.fetchall()
+                    cursor.execute('delete from unique_keys where id = ?', [cust_id])
+                    self._claim_keys(cursor, cust_id, cust)
+            except sqlite3.DatabaseError as err:
+                raise ValueError(str(err))
+        try:
+            updated = self._write_shard(cust_id, 'update customers set name=?, email=?, phone=?, city=? where id=?',
+                                        (cust['name'], cust['email'], cust['phone'], cust['city'], cust_id))
+        except sqlite3.DatabaseError as err:
+            # give the old email/phone back
+            with self.index_lock, self.index:
+                self.index.execute('delete from unique_keys where id = ?', [cust_id])
+                self.index.executemany('insert into unique_keys values (?, ?, ?)',
+                                       [(kind, value, cust_id) for kind, value in old_keys])
+            raise ValueError(str(err))
+        if not updated:
+            # no such customer (which, as in db.py, is not an error); it must not keep the keys
+            self._release_keys(cust_id)
+
+    def delete_customer(self, cust_id):
+        try:
+            self._write_shard(cust_id, 'delete from customers where id=?', [cust_id])
+        except sqlite3.DatabaseError as err:
+            raise ValueError(str(err))
+        self._release_keys(cust_id)
+
+
+# ---------- offline tools ----------
+
+def _copy_into_shards(directory, shards, rows, batch=50_000):
+    """writes rows (in any order) into the shard files of a new store in directory"""
+    conns = [_connect(shard_file(directory, n)) for n in range(shards)]
+    pending = [[] for _ in range(shards)]
+    count = 0
+
+    def flush(n):
+        with conns[n]:
+            conns[n].executemany('insert into customers(id, name, email, phone, city) values (?, ?, ?, ?, ?)',
+                                 pending[n])
+        pending[n].clear()
+
+    for row in rows:
+        n = shard_of(row[0], shards)
+        pending[n].append(tuple(row))
+        count += 1
+        if len(pending[n]) >= batch:
+            flush(n)
+    for n in range(shards):
+        flush(n)
+        conns[n].close()
+    return count
+
+
+def create(directory, shards, from_db=None):
+    if os.path.exists(os.path.join(directory, 'index.sqlite')):
+        raise SystemExit(f'{directory} has a sharded store already')
+    create_store(directory, shards)
+    if from_db is None:
+        print(f'created an empty store with {shards} shards in {directory}')
+        return
+
+    source = sqlite3.connect(f'file:{quote(from_db)}?mode=ro', uri=True)
+    start = time.perf_counter()
+    count = _copy_into_shards(directory, shards,
+                              source.execute('select id, name, email, phone, city from customers'))
+    index = _connect(os.path.join(directory, 'index.sqlite'))
+    with index:
+        index.executemany('insert into unique_keys values (?, ?, ?)',
+                          ((kind, value, cust_id) for cust_id, email, phone in
+                           source.execute('select id, email, phone from customers')
+                           for kind, value in (('email', email), ('phone', phone))))
+        # new ids continue after the highest one copied
+        max_id = source.execute('select coalesce(max(id), 0) from customers').fetchone()[0]
+        index.execute("insert into sqlite_sequence(name, seq) values ('customer_ids', ?)", [max_id])
+    index.close()
+    source.close()
+    print(f'copied {count:,} customers from {from_db} into {shards} shards in {time.perf_counter() - start:.1f} s')
+
+
+def rebalance(directory, shards):
+    """
+    moves every customer to its shard for the new shard count. Offline: the service
+    must not be running. The new shards are built next to the old ones and swapped
+    in only when complete; the old ones are kept in <directory>/old-<time>.
+    """
+    store = ShardedStore(directory)
+    old_shards = store.shards
+    work = os.path.join(directory, f'rebalance-{int(time.time())}')
+    os.makedirs(work)
+    for n in range(shards):
+        conn = _connect(shard_file(work, n))
+        conn.execute(SHARD_SCHEMA)
+        conn.close()
+
+    start = time.perf_counter()
+    count = _copy_into_shards(work, shards, store.iter_all_customers(chunk=10_000))
+    store.close()
+
+    def count_rows(n):
+        with closing(_connect(shard_file(work, n), read_only=True)) as conn:
+            return conn.execute('select count(*) from customers').fetchone()[0]
+
+    copied = sum(count_rows(n) for n in range(shards))
+    if copied != count:
+        raise SystemExit(f'only {copied:,} of {count:,} customers were copied; the old shards are left in place')
+
+    old = os.path.join(directory, f'old-{int(time.time())}')
+    os.makedirs(old)
+    for n in range(old_shards):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(shard_file(directory, n) + suffix):
+                shutil.move(shard_file(directory, n) + suffix, old)
+    for n in range(shards):
+        shutil.move(shard_file(work, n), shard_file(directory, n))
+    shutil.rmtree(work)
+    index = _connect(os.path.join(directory, 'index.sqlite'))
+    with index:
+        index.execute("update meta set value = ? where key = 'shards'", [shards])
+    index.close()
+    print(f'moved {count:,} customers from {old_shards} to {shards} shards in {time.perf_counter() - start:.1f} s; '
+          f'the old shard files are in {old}')
+
+
+def orphaned_ids(store):
+    """ids with an email/phone in the index but no customer in their shard"""
+    ids = [row[0] for row in store.index.execute('select distinct id from unique_keys')]
+    found = store.get_customers_by_ids(ids)
+    return [i for i in ids if i not in found]
+
+
+def stats(directory):
+    store = ShardedStore(directory)
+    counts = [store._read(n, lambda conn: conn.execute('select count(*) from customers').fetchone()[0])
+              for n in range(store.shards)]
+    for n, count in enumerate(counts):
+        size = os.path.getsize(shard_file(directory, n))
+        print(f'shard {n:3}: {count:10,} customers {size / 1e6:10.1f} MB')
+    print(f'total    : {sum(counts):10,} customers in {store.shards} shards')
+    orphans = orphaned_ids(store)
+    if orphans:
+        print(f'{len(orphans)} id(s) with index entries but no customer (run repair): {orphans[:10]}')
+    store.close()
+
+
+def repair(directory):
+    store = ShardedStore(directory)
+    orphans = orphaned_ids(store)
+    with store.index:
+        store.index.executemany('delete from unique_keys where id = ?', [(i,) for i in orphans])
+    store.close()
+    print(f'removed the index entries of {len(orphans)} id(s)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create, inspect and rebalance a sharded customer store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('create', help='create a store, optionally filled from an unsharded database')
+    p.add_argument('directory')
+    p.add_argument('--shards', type=int, required=True)
+    p.add_argument('--from-db', help='e.g. customersdb.sqlite')
+    p = commands.add_parser('rebalance', help='change the number of shards (offline)')
+    p.add_argument('directory')
+    p.add_argument('--shards', type=int, required=True)
+    for name, help_text in [('stats', 'customers and size per shard'), ('repair', 'remove orphaned index entries')]:
+        commands.add_parser(name, help=help_text).add_argument('directory')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        create(args.directory, args.shards, args.from_db)
+    elif args.command == 'rebalance':
+        rebalance(args.directory, args.shards)
+    elif args.command == 'stats':
+        stats(args.directory)
+    else:
+        repair(args.directory)
+
+
+if __name__ == '__main__':
+    main()
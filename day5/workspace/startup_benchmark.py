@@ -0,0 +1,182 @@
+"""
+Cold start of the customer service (ex45): what its imports cost, and the time from
+starting the process to the first successful response, for the ways of running it.
+
+    python startup_benchmark.py --runs 5 --workers 4
+
+- imports: python -X importtime -c "import ex45_fastapi_sqlite_rest_demo", the total
+  and the modules it imports directly, by cumulative time (median of the runs)
+- schema: init_db() on a database it has not seen (creates/checks everything) and on
+  one with the current SCHEMA_VERSION (what every later start does)
+- cold start: each way of starting the service is run --runs times; the time is from
+  Popen until GET /api/customers?ids=1 answers 200, polled every 5 ms. The memory is
+  the total PSS (shared pages counted once, split between the processes sharing them)
+  of all the processes of the service, once it has been up for a second. Linux only.
+
+Everything runs on a copy of customersdb.sqlite, in a temporary directory.
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = 'ex45_fastapi_sqlite_rest_demo'
+
+
+def import_times(runs):
+    """(median total ms, [(module, median cumulative ms)]) of the imports of the app module"""
+    totals, modules = [], {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {APP}'],
+                                cwd=HERE, capture_output=True, text=True, check=True)
+        # a module is listed after the ones it imports, one level of indentation deeper
+        children = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            ms = int(cumulative) / 1000
+            if depth == 1:
+                children.append((name.strip(), ms))
+            elif depth == 0:
+                if name.strip() == APP:
+                    totals.append(ms)
+                    for module, module_ms in children:
+                        modules.setdefault(module, []).append(module_ms)
+                children = []
+    # the modules imported by the app itself (and not already imported by then)
+    direct = sorted(((m, statistics.median(t)) for m, t in modules.items()), key=lambda mt: -mt[1])
+    return statistics.median(totals), direct
+
+
+def schema_times(directory):
+    sys.path.insert(0, HERE)
+    import db
+    filename = os.path.join(directory, 'schema.sqlite')
+    shutil.copy(os.path.join(HERE, 'customersdb.sqlite'), filename)
+    with sqlite3.connect(filename) as conn:
+        conn.execute('pragma user_version = 0')     # as it was before there was a SCHEMA_VERSION
+    db.DB_FILE = filename
+    start = time.perf_counter()
+    db.init_db()
+    first = time.perf_counter() - start
+    db._schema_checked.clear()      # as a new process would find it
+    start = time.perf_counter()
+    db.init_db()
+    return first, time.perf_counter() - start
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as file:
+                    ppid = int(file.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    pids, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        pids.append(p)
+        todo += children.get(p, [])
+    return pids
+
+
+def pss_mb(pid):
+    total = 0
+    for p in process_tree(pid):
+        try:
+            with open(f'/proc/{p}/smaps_rollup') as file:
+                total += sum(int(line.split()[1]) for line in file if line.startswith('Pss:'))
+        except OSError:
+            pass
+    return total / 1024
+
+
+def cold_start(command, directory, timeout=60):
+    """seconds to the first 200, and the memory (MB) of the processes"""
+    port = free_port()
+    command = [c.format(port=port) for c in command]
+    env = dict(os.environ, PYTHONPATH=HERE)
+    url = f'http://127.0.0.1:{port}/api/customers?ids=1'
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=directory, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                pass
+            if process.poll() is not None or time.perf_counter() - start > timeout:
+                raise RuntimeError(f'{" ".join(command)} did not answer')
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        time.sleep(1)
+        memory = pss_mb(process.pid) if os.path.exists('/proc/self/smaps_rollup') else None
+        return elapsed, memory
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and cold start of the ex45 service')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    total, direct = import_times(args.runs)
+    print(f'import {APP}: {total:.0f} ms (median of {args.runs}), of which')
+    for module, ms in direct[:10]:
+        print(f'    {module:40} {ms:8.1f} ms')
+
+    directory = tempfile.mkdtemp()
+    first, cached = schema_times(directory)
+    print(f'init_db(): {first * 1000:.1f} ms on a database it has not seen, {cached * 1000:.2f} ms after')
+
+    shutil.copy(os.path.join(HERE, 'customersdb.sqlite'), directory)
+    py, n = sys.executable, args.workers
+    uvicorn = [py, '-m', 'uvicorn', f'{APP}:app', '--port', '{port}', '--log-level', 'warning']
+    serve = [py, os.path.join(HERE, 'serve.py'), '--port', '{port}']
+    ways = [
+        ('uvicorn --reload (development)', uvicorn + ['--reload']),
+        ('uvicorn, 1 process', uvicorn),
+        (f'uvicorn --workers {n}', uvicorn + ['--workers', str(n)]),
+        ('serve.py --workers 1', serve + ['--workers', '1']),
+        (f'serve.py --workers {n}', serve + ['--workers', str(n)]),
+    ]
+    print(f'\n{"cold start to first response":32} {"median s":>9} {"min s":>7} {"max s":>7} {"PSS MB":>8}')
+    for label, command in ways:
+        results = [cold_start(command, directory) for _ in range(args.runs)]
+        times = [t for t, _ in results]
+        memory = statistics.median(m for _, m in results) if results[0][1] is not None else float('nan')
+        print(f'{label:32} {statistics.median(times):9.3f} {min(times):7.3f} {max(times):7.3f} {memory:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Group commit for the SQLite writes of db.py.
+
+Every add/update/delete of db.py otherwise opens a connection, takes the database
+lock and commits (an fsync) on its own; concurrent writers wait for each other's
+fsyncs. The WriteBatcher owns a single writer connection in a background thread.
+Callers put their write in a queue and wait; the thread takes whatever is queued
+(up to max_batch writes, waiting at most max_delay seconds for more) and applies
+it in one transaction, i.e. with one commit. Every write runs in a savepoint of
+its own, so a failing write (a duplicate email, say) is rolled back alone and its
+caller gets the error while the others go through. Callers are answered only
+after the commit, so a write that returned is as durable as `synchronous` makes it.
+
+    batcher = WriteBatcher(connect, max_batch=200, max_delay=0.002, synchronous='normal')
+    customer = batcher.submit(insert_customer, customer)
+
+    python write_batcher.py --threads 16 --writes 500     # the benchmark
+
+If the thread cannot connect, or stops on an unexpected error, the writes waiting
+for it fail with RuntimeError, and so does submit() after that or after close().
+
+max_delay=0 (the default) adds no latency: a batch is whatever queued up while
+the previous one was being committed. A small max_delay collects bigger batches
+(fewer commits) at the cost of that much latency per write.
+"""
+import argparse
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriteBatcher:
+    def __init__(self, connect, max_batch=200, max_delay=0.0, synchronous='full'):
+        if synchronous.lower() not in ('off', 'normal', 'full', 'extra'):
+            raise ValueError(f'synchronous must be off, normal, full or extra, not {synchronous!r}')
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.synchronous = synchronous
+        self.batches = 0
+        self.writes = 0
+        self.__queue = queue.Queue()
+        # closed by close() or when the thread ends; taken with the queue, so that nothing
+        # is queued after the thread has failed what was left in it
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__run, name='write-batcher', daemon=True)
+        self.__thread.start()
+
+    def submit(self, fn, *args):
+        """runs fn(cursor, *args) in the next batch; returns its result or raises its exception"""
+        future = Future()
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError('the write batcher is closed') from self.__error
+            self.__queue.put((fn, args, future))
+        return future.result()
+
+    def close(self):
+        with self.__lock:
+            if not self.__closed:
+                self.__closed = True
+                self.__queue.put(None)
+        self.__thread.join()
+
+    def __run(self):
+        try:
+            conn = self.connect()
+            try:
+                conn.isolation_level = None         # the transactions are begun and committed here
+                conn.execute(f'pragma synchronous = {self.synchronous}')
+                self.__loop(conn)
+            finally:
+                conn.close()
+        except BaseException as err:
+            self.__error = err
+            raise
+        finally:
+            # whatever is still queued (the thread failed, or close() came first) is failed, not left waiting
+            with self.__lock:
+                self.__closed = True
+                pending = []
+                while True:
+                    try:
+                        pending.append(self.__queue.get_nowait())
+                    except queue.Empty:
+                        break
+            for item in pending:
+                if item is not None:
+                    error = RuntimeError('the write batcher is closed')
+                    error.__cause__ = self.__error
+                    item[2].set_exception(error)
+
+    def __loop(self, conn):
+        stopping = False
+        while not stopping:
+            item = self.__queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = deadline - time.monotonic()
+                    item = self.__queue.get(timeout=timeout) if timeout > 0 else self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self.__apply(conn, batch)
+            except Exception as err:
+                # something unexpected (the rollback itself failing...): this batch fails, the next ones go on
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(err)
+
+    def __apply(self, conn, batch):
+        outcomes = []
+        cursor = conn.cursor()
+        try:
+            cursor.execute('begin immediate')
+            for fn, args, future in batch:
+                cursor.execute('savepoint write')
+                try:
+                    result = fn(cursor, *args)
+                except Exception as err:
+                    cursor.execute('rollback to write')
+                    outcomes.append((future, None, err))
+                else:
+                    outcomes.append((future, result, None))
+                cursor.execute('release write')
+            cursor.execute('commit')
+        except Exception as err:
+            # the transaction itself failed (database locked, disk full...): nothing was written
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(future, None, err) for _, _, future in batch]
+
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, err in outcomes:
+            if err is None:
+                future.set_result(result)
+            else:
+                future.set_exception(err)
+
+
+def main():
+    # concurrent add_customer() calls, each committing on its own and batched
+    import db
+    from metrics import percentile
+
+    parser = argparse.ArgumentParser(description='Benchmark the group commit of db.py writes')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=500, help='writes per thread')
+    parser.add_argument('--max-delay', type=float, default=0.0, help='seconds to wait for a batch to fill')
+    parser.add_argument('--synchronous', default='full')
+    args = parser.parse_args()
+
+    def run(label, batched):
+        db.DB_FILE = os.path.join(tempfile.mkdtemp(), 'customers.sqlite')
+        db.SYNCHRONOUS = args.synchronous       # the same for both, so that only the batching differs
+        db.init_db()
+        if batched:
+            db.enable_write_batching(max_delay=args.max_delay, synchronous=args.synchronous)
+        errors = [0]
+        latencies = []
+
+        def writer(t):
+            for i in range(args.writes):
+                # every 50th write repeats an email, and must fail on its own
+                n = i - 1 if i % 50 == 49 else i
+                customer = dict(name=f'Customer {t}-{i}', email=f'c{t}.{n}@xmpl.com', phone=f'{t}-{i}', city='Bangalore')
+                start = time.perf_counter()
+                try:
+                    db.add_customer(customer)
+                except ValueError:
+                    errors[0] += 1
+                latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=writer, args=(t,)) for t in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        batches = db.disable_write_batching() if batched else None
+
+        latencies.sort()
+        p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+        count = db.get_connection().execute('select count(*) from customers').fetchone()[0]
+        print(f'{label:22} {len(latencies) / elapsed:10,.0f} {p50 * 1000:9.2f} '
+              f'{p99 * 1000:9.2f} {count:9,} {errors[0]:7,} '
+              f'{"" if batches is None else f"{batches[1] / batches[0]:.1f}":>12}')
+
+    print(f'{args.threads} threads x {args.writes} add_customer() calls, synchronous={args.synchronous} in both')
+    print(f'{"":22} {"writes/s":>10} {"p50 ms":>9} {"p99 ms":>9} {"rows":>9} {"errors":>7} {"writes/batch":>12}')
+    run('a commit per write', False)
+    run('group commit', True)
+
+
+if __name__ == '__main__':
+    main()